@@ -1,6 +1,15 @@
+if __name__ == '__main__':
+    # `python app.py` serves from dev_server: spawned password-pool workers re-run
+    # the main script, which must not be this module
+    import runpy
+    runpy.run_module('dev_server', run_name='__main__', alter_sys=True)
+    raise SystemExit
+
+from engine import ASYNC_MODE, monkey_patch, run_blocking
+monkey_patch()
+
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from flask_bcrypt import Bcrypt
 from flask_socketio import SocketIO, emit, join_room
 import pymongo
 from bson.objectid import ObjectId
@@ -10,65 +19,157 @@ import jwt
 import datetime
 import platform
 import hashlib
+import hmac
+import json
 import math
 import threading
 import time
-from behavior_analyzer import BehaviorAnalyzer
+import atexit
+import copy
+import logging
+import zlib
+from behavior_analyzer import BehaviorAnalyzer, PairBatch
+from data_access import SyncMongoStore
+from caching import ChangeTracker, TokenCache, TTLCache
+from password_hashing import PasswordHasher, PasswordPoolSaturated
+from trajectory_store import TrajectoryStore
+from status import StatusSnapshot
+from log_config import configure_logging
+from metrics import REGISTRY, Counter, Histogram, MongoCommandListener
+from profiler import PROFILE_INTERVAL_MS, ProfilerBusy, SamplingProfiler, UserProfiler
+from geofence import GeofenceEngine
+from trajectory_simplify import SIMPLIFIERS, encode_polyline, zoom_tolerance
+from warmup import ModelWarmup
 from ml_model import DeviceBehaviorModel
+from population_model import (CALIBRATION_MIN_SAMPLES, CALIBRATION_WINDOW, POPULATION_MODEL_PATH,
+                              CalibratedBehaviorModel, PopulationModel, UserCalibration)
+from streaming_model import StreamingBehaviorModel
+from scaling import create_client_manager, owner_for, owns_user, WORKER_ID
 
 load_dotenv()
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-here')
 
+CORS_ORIGINS = os.getenv('CORS_ORIGINS', 'http://localhost:3000,http://172.20.8.77:3000')
+CORS_ORIGINS = '*' if CORS_ORIGINS == '*' else CORS_ORIGINS.split(',')
+
 CORS(app, 
-     resources={r"/api/*": {"origins": ["http://localhost:3000", "http://172.20.8.77:3000"]}, 
-                r"/socket.io/*": {"origins": ["http://localhost:3000", "http://172.20.8.77:3000"]}},
+     resources={r"/api/*": {"origins": CORS_ORIGINS}, 
+                r"/socket.io/*": {"origins": CORS_ORIGINS}},
      supports_credentials=True)
 
 socketio = SocketIO(
     app,
-    cors_allowed_origins=["http://localhost:3000", "http://172.20.8.77:3000"],
+    cors_allowed_origins=CORS_ORIGINS,
     ping_timeout=60,
     ping_interval=25,
     max_http_buffer_size=1e8,
-    async_mode='threading'
+    async_mode=ASYNC_MODE,
+    **create_client_manager()
 )
 
-bcrypt = Bcrypt(app)
+# bcrypt runs on a bounded process pool, away from the socket handlers
+password_hasher = PasswordHasher()
 
 MONGO_URI = os.getenv("MONGO_URI")
-client = pymongo.MongoClient(
-    MONGO_URI,
-    maxPoolSize=50,
-    minPoolSize=10,
-    connectTimeoutMS=30000,
-    socketTimeoutMS=30000,
-    serverSelectionTimeoutMS=30000
-)
-db = client.tracker_db
-users_collection = db.users
-devices_collection = db.devices
-locations_collection = db.locations
-university_collection = db.university
-
-try:
-    devices_collection.create_index([('device_id', 1)], unique=True)
-    devices_collection.create_index([('user_email', 1)])
-    users_collection.create_index([('email', 1)], unique=True)
-    locations_collection.create_index([('device_id', 1)])
-    locations_collection.create_index([('timestamp', 1)])
-    university_collection.create_index([('user_email', 1)], unique=True)
-except Exception as e:
-    print(f"Index creation warning: {e}")
+
+def create_mongo_client():
+    # connect=False: no sockets or monitor threads until the first operation
+    return pymongo.MongoClient(
+        MONGO_URI,
+        maxPoolSize=50,
+        minPoolSize=10,
+        connectTimeoutMS=30000,
+        socketTimeoutMS=30000,
+        serverSelectionTimeoutMS=30000,
+        event_listeners=[MongoCommandListener()],
+        connect=False
+    )
+
+client = create_mongo_client()
+store = SyncMongoStore(client.tracker_db)
+
+def reopen_mongo_client():
+    """Give a forked worker its own client; pools and monitor threads are not fork-safe"""
+    global client
+    client = create_mongo_client()
+    store.use_database(client.tracker_db)
+
+# Indexes are managed by migrate.py; AUTO_MIGRATE=1 also creates them on import
+if os.getenv('AUTO_MIGRATE') == '1':
+    try:
+        store.ensure_indexes()
+    except Exception as e:
+        logger.warning('index creation failed', extra={'error': str(e)})
 
 JWT_SECRET = os.getenv("JWT_SECRET", "default_secret_key")
 
+# Verified tokens -> user documents, so polling endpoints skip the users lookup
+TOKEN_CACHE_TTL = float(os.getenv('TOKEN_CACHE_TTL', 30))
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+token_cache = TokenCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+
+# Simplified map paths keyed by (device, range, tolerance, trajectory version)
+TRAJECTORY_CACHE_TTL = float(os.getenv('TRAJECTORY_CACHE_TTL', 300))
+TRAJECTORY_CACHE_SIZE = int(os.getenv('TRAJECTORY_CACHE_SIZE', 512))
+TRAJECTORY_TOLERANCE_PX = float(os.getenv('TRAJECTORY_TOLERANCE_PX', 2))
+TRAJECTORY_MAX_RANGE_HOURS = int(os.getenv('TRAJECTORY_MAX_RANGE_HOURS', 24 * 7))
+trajectory_cache = TTLCache(maxsize=TRAJECTORY_CACHE_SIZE, ttl=TRAJECTORY_CACHE_TTL)
+
+# Client fix timestamps: live fixes further off than the skew use server time,
+# buffered fixes (POST /api/locations/bulk) older than the max age are dropped
+FIX_CLOCK_SKEW_SECONDS = float(os.getenv('FIX_CLOCK_SKEW_SECONDS', 300))
+FIX_MAX_AGE_HOURS = float(os.getenv('FIX_MAX_AGE_HOURS', 24))
+BULK_MAX_FIXES = int(os.getenv('BULK_MAX_FIXES', 1000))
+BULK_MAX_BYTES = int(os.getenv('BULK_MAX_BYTES', 2 * 1024 * 1024))
+
+# Hot-path metrics, exposed on /metrics to holders of METRICS_TOKEN
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+LOCATION_UPDATES = Counter('location_updates_total', 'update_location events by outcome', ['result'])
+LOCATION_STAGE_SECONDS = Histogram('location_update_stage_seconds', 'Time per update_location stage', ['stage'])
+ANOMALIES = Counter('anomalies_total', 'Anomalies detected', ['kind'])
+CASCADE_DECISIONS = Counter('cascade_decisions_total',
+                            'Pair evaluations by cascade outcome (cleared skips the forest)', ['outcome'])
+
+# Accounts allowed to profile live workers (comma separated emails)
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv('ADMIN_EMAILS', '').split(',') if email.strip()}
+sampling_profiler = SamplingProfiler()
+user_profiler = UserProfiler()
+
+# Per-user versions of the polled dashboard resources (ETag / If-None-Match)
+change_tracker = ChangeTracker(store)
+
 # Initialize ML components
-behavior_analyzer = BehaviorAnalyzer(db)
+behavior_analyzer = BehaviorAnalyzer(store)
+trajectory_store = TrajectoryStore(store)
+geofence_engine = GeofenceEngine()
+status_snapshot = StatusSnapshot(store)
+atexit.register(trajectory_store.flush)
+atexit.register(behavior_analyzer.rollups.flush)
+atexit.register(behavior_analyzer.reservoirs.flush)
 user_models = {}
 training_threads = {}
+# Guards the model dicts; scoring and snapshots take the user's own lock
 model_lock = threading.Lock()
+user_model_locks = {}
+
+# Opt-in streaming detector (users.ml_detector): learns from every record, snapshotted to disk
+ML_DETECTORS = ('batch', 'streaming', 'population')
+ML_DETECTOR_DEFAULT = os.getenv('ML_DETECTOR_DEFAULT', 'batch')
+STREAM_SNAPSHOT_RECORDS = int(os.getenv('STREAM_SNAPSHOT_RECORDS', 500))
+streaming_models = {}
+# Shared population model (python population_model.py) and per-user calibrated views of it
+population_model = None
+calibrated_models = {}
+# Users whose calibration is being refit (one KMeans per user at a time)
+calibrating_users = set()
+
+# Most recently written models loaded by preload_models() (gunicorn preload)
+MODELS_DIR = 'models'
+PRELOAD_MODELS = int(os.getenv('PRELOAD_MODELS', 100))
 
 # SMART LOCATION VALIDATION SETTINGS
 HIGH_ACCURACY_THRESHOLD = 3.0
@@ -117,7 +218,7 @@ def generate_university_layout(center_lat, center_lon):
         }
         sections.append(section)
     
-    print(f"🏛️ Generated university with {len(sections)} sections (12x12m each)")
+    logger.debug('generated university layout', extra={'sections': len(sections)})
     return sections
 
 def detect_section(latitude, longitude, sections):
@@ -214,12 +315,15 @@ def constrain_location_to_radius(new_lat, new_lon, anchor_lat, anchor_lon, max_r
     return constrained_lat, constrained_lon, distance
 
 def validate_and_constrain_location(device_id, latitude, longitude, accuracy):
+    return constrain_fix(latitude, longitude, accuracy, store.get_location(device_id), device_id)
+
+def constrain_fix(latitude, longitude, accuracy, last_location, device_id=None):
+    """Accept, pull towards the best known position, or reject a fix given the device's stored location"""
     if accuracy > MAX_ACCEPTABLE_ACCURACY:
-        print(f"❌ REJECTED: Device {device_id[:8]}... accuracy too low: {accuracy}m")
+        logger.info('fix rejected: accuracy too low', extra={'device_id': device_id, 'accuracy': accuracy})
         return None, None, None, False, "accuracy_too_low"
-    last_location = locations_collection.find_one({'device_id': device_id})
     if accuracy < HIGH_ACCURACY_THRESHOLD:
-        print(f"✅ HIGH ACCURACY: Device {device_id[:8]}... {accuracy:.1f}m - ACCEPTED")
+        logger.debug('fix accepted: high accuracy', extra={'device_id': device_id, 'accuracy': accuracy})
         return latitude, longitude, accuracy, True, "high_accuracy_accepted"
     if last_location and 'best_latitude' in last_location and 'best_longitude' in last_location:
         anchor_lat = last_location['best_latitude']
@@ -229,28 +333,173 @@ def validate_and_constrain_location(device_id, latitude, longitude, accuracy):
             constrained_lat, constrained_lon, actual_distance = constrain_location_to_radius(
                 latitude, longitude, anchor_lat, anchor_lon, MAX_POSITION_DRIFT
             )
-            print(f"🔒 CONSTRAINED: Device {device_id[:8]}... accuracy {accuracy:.1f}m")
+            logger.info('fix constrained to radius', extra={
+                'device_id': device_id, 'accuracy': accuracy, 'drift_m': round(distance, 1),
+                'max_drift_m': MAX_POSITION_DRIFT
+            })
             return constrained_lat, constrained_lon, accuracy, True, "constrained_to_radius"
         else:
-            print(f"✅ MEDIUM ACCURACY: Device {device_id[:8]}... accuracy {accuracy:.1f}m")
+            logger.debug('fix accepted: medium accuracy', extra={'device_id': device_id, 'accuracy': accuracy,
+                                                                  'drift_m': round(distance, 1)})
             return latitude, longitude, accuracy, True, "medium_accuracy_accepted"
     else:
-        print(f"✅ FIRST LOCATION: Device {device_id[:8]}... accuracy {accuracy:.1f}m")
+        logger.debug('fix accepted: first location', extra={'device_id': device_id, 'accuracy': accuracy})
         return latitude, longitude, accuracy, True, "first_location_accepted"
 
+def preload_models(limit=PRELOAD_MODELS, models_dir=MODELS_DIR):
+    """Load the newest saved models of users this worker owns into user_models"""
+    if limit <= 0 or not os.path.isdir(models_dir):
+        return 0
+    suffix = '_model.pkl'
+    entries = [entry for entry in os.scandir(models_dir)
+               if entry.name.endswith(suffix) and owns_user(entry.name[:-len(suffix)])]
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    loaded = 0
+    for entry in entries[:limit]:
+        user_email = entry.name[:-len(suffix)]
+        model = DeviceBehaviorModel(user_email)
+        if model.load_model(entry.path):
+            with model_lock:
+                user_models.setdefault(user_email, model)
+            loaded += 1
+    return loaded
+
+def user_model_lock(user_email):
+    """Lock serializing one user's scoring, so different users' sklearn work runs in parallel"""
+    with model_lock:
+        return user_model_locks.setdefault(user_email, threading.Lock())
+
+def streaming_model_path(user_email):
+    return f"models/{user_email}_stream.pkl"
+
+def get_streaming_model(user_email):
+    """The user's streaming detector, restored from its snapshot on first use"""
+    model = streaming_models.get(user_email)
+    if model is None:
+        model = StreamingBehaviorModel(user_email)
+        run_blocking(model.load_model, streaming_model_path(user_email))
+        with model_lock:
+            model = streaming_models.setdefault(user_email, model)
+    return model
+
+def snapshot_streaming_models():
+    """Write snapshots of streaming detectors that learned since their last one"""
+    with model_lock:
+        models = [model for model in streaming_models.values() if model.records_since_snapshot]
+    for model in models:
+        try:
+            with user_model_lock(model.user_email):
+                model.save_model(streaming_model_path(model.user_email))
+        except Exception:
+            logger.exception('streaming snapshot failed', extra={'user_email': model.user_email})
+
+atexit.register(snapshot_streaming_models)
+
+def load_population_model():
+    """The shared population model, loaded once per process (None until one is trained)"""
+    global population_model
+    if population_model is None:
+        model = PopulationModel.load(POPULATION_MODEL_PATH)
+        if model is not None:
+            with model_lock:
+                population_model = population_model or model
+    return population_model
+
+def calibrate_user(user_email, model):
+    """Refit a user's calibration on their reservoir sample and store it.
+
+    Returns False without refitting when one is already running for the user.
+    """
+    with model_lock:
+        if user_email in calibrating_users:
+            return False
+        calibrating_users.add(user_email)
+    try:
+        model.records_since_calibration = 0
+        features = behavior_analyzer.get_training_features(user_email, limit=CALIBRATION_WINDOW)
+        if len(features) < CALIBRATION_MIN_SAMPLES:
+            return False
+        calibration = run_blocking(model.population.calibrate, features.astype(float))
+        store.save_calibration(user_email, {
+            'data': calibration.to_bytes(),
+            'samples': calibration.samples,
+            'population_version': model.population.version,
+            'updated_at': datetime.datetime.utcnow()
+        })
+        model.calibration = calibration
+    finally:
+        with model_lock:
+            calibrating_users.discard(user_email)
+    change_tracker.bump(user_email, 'ml')
+    logger.debug('calibration updated', extra={'user_email': user_email, 'samples': calibration.samples})
+    return True
+
+def prepare_population_model(user_email):
+    """Create the user's calibrated model from the stored calibration; recalibrate when due"""
+    model = calibrated_models.get(user_email)
+    if model is None:
+        calibration = None
+        document = store.get_calibration(user_email)
+        # Thresholds are in the scores of one forest: a retrained population model needs new ones
+        if document and document.get('population_version') == population_model.version:
+            try:
+                calibration = UserCalibration.from_bytes(document['data'])
+            except ValueError:
+                calibration = None
+        model = CalibratedBehaviorModel(user_email, population_model, calibration)
+        if calibration is None:
+            model.records_since_calibration = CALIBRATION_MIN_SAMPLES
+        with model_lock:
+            model = calibrated_models.setdefault(user_email, model)
+    if model.needs_calibration():
+        calibrate_user(user_email, model)
+    return True
+
+def detector_model(user_email, detector):
+    """In-memory model serving the user's detector, or None"""
+    if detector == 'streaming':
+        return get_streaming_model(user_email)
+    if detector == 'population':
+        return calibrated_models.get(user_email)
+    return user_models.get(user_email)
+
+def load_user_model(user_email, model_path):
+    """Load a user's saved model into user_models unless a trained one is there"""
+    existing = user_models.get(user_email)
+    if existing is not None and existing.is_trained:
+        return True
+    model = DeviceBehaviorModel(user_email)
+    if not run_blocking(model.load_model, model_path):
+        return False
+    with model_lock:
+        existing = user_models.get(user_email)
+        if existing is None or not existing.is_trained:
+            user_models[user_email] = model
+    return True
+
+# Loads the models of recently active users this worker owns before traffic
+model_warmup = ModelWarmup(store, load_user_model, accept_user=owns_user)
+
+def update_training_status(user_email, status_data):
+    """Persist training status and invalidate cached /api/ml-status responses"""
+    behavior_analyzer.update_training_status(user_email, status_data)
+    change_tracker.bump(user_email, 'ml')
+
 def start_ml_training(user_email):
     """Start ML training process for user"""
-    print(f"🚀 Starting ML training for {user_email}")
+    logger.info('starting ML training', extra={'user_email': user_email})
     
-    with model_lock:
-        if user_email not in user_models:
-            user_models[user_email] = DeviceBehaviorModel(user_email)
-        
-        model = user_models[user_email]
-        model.training_start_time = datetime.datetime.utcnow()
+    # Only the owning worker keeps the in-memory model
+    if owns_user(user_email):
+        with model_lock:
+            if user_email not in user_models:
+                user_models[user_email] = DeviceBehaviorModel(user_email)
+            
+            model = user_models[user_email]
+            model.training_start_time = datetime.datetime.utcnow()
     
     # Update training status
-    behavior_analyzer.update_training_status(user_email, {
+    update_training_status(user_email, {
         'training_started': datetime.datetime.utcnow(),
         'is_training': True,
         'is_trained': False,
@@ -280,25 +529,27 @@ def check_and_train_model(user_email):
     
     # Check if already trained
     if training_status and training_status.get('is_trained'):
-        # Try to load saved model
+        if model.is_trained:
+            return True
+        # Not in memory yet (new process): load the saved model once
         model_path = f"models/{user_email}_model.pkl"
-        if model.load_model(model_path):
-            print(f"📂 Loaded trained model for {user_email}")
+        if run_blocking(model.load_model, model_path):
+            logger.debug('loaded trained model', extra={'user_email': user_email})
             return True
         else:
             # Model file missing, retrain
-            behavior_analyzer.update_training_status(user_email, {
+            update_training_status(user_email, {
                 'is_training': True,
                 'is_trained': False,
                 'training_samples': 0
             })
     
-    user = users_collection.find_one({'email': user_email})
+    user = store.get_user(user_email)
     device_count = len(user.get('devices', []))
     
     # Need at least 2 devices
     if device_count < 2:
-        print(f"⏸️ ML Training paused for {user_email}: Only {device_count} device(s) registered")
+        logger.debug('ML training paused', extra={'user_email': user_email, 'devices': device_count})
         return False
     
     # Check if training should start
@@ -312,11 +563,11 @@ def check_and_train_model(user_email):
         elapsed_minutes = (current_time - training_started).total_seconds() / 60
         
         # Collect training data during the training period
-        behavior_data = behavior_analyzer.get_training_data(user_email, limit=200)
-        sample_count = len(behavior_data)
+        features = behavior_analyzer.get_training_features(user_email, limit=200)
+        sample_count = len(features)
         
         # Update training status with current sample count
-        behavior_analyzer.update_training_status(user_email, {
+        update_training_status(user_email, {
             'training_samples': sample_count,
             'last_update': current_time
         })
@@ -331,26 +582,20 @@ def check_and_train_model(user_email):
         
         # Train when we have enough samples OR 5 minutes have passed
         if sample_count >= 30 or elapsed_minutes >= 5:
-            print(f"🤖 Training ML model for {user_email} with {sample_count} samples...")
-            
-            # Also get device patterns
-            device_patterns = {}
-            for device_id in user.get('devices', []):
-                pattern = behavior_analyzer.get_device_pattern(user_email, device_id)
-                if pattern:
-                    device_patterns[device_id] = pattern
+            logger.info('training ML model', extra={'user_email': user_email, 'samples': sample_count})
             
             # Train the model
-            success, message = model.train_model(behavior_data, device_patterns)
+            success, message = run_blocking(model.train_features, features.astype(float))
             
             if success:
                 # Save model to disk
                 model_path = f"models/{user_email}_model.pkl"
                 os.makedirs("models", exist_ok=True)
-                model.save_model(model_path)
+                run_blocking(model.save_model, model_path)
+                status_snapshot.mark_stale()
                 
                 # Update training status
-                behavior_analyzer.update_training_status(user_email, {
+                update_training_status(user_email, {
                     'is_training': False,
                     'is_trained': True,
                     'training_completed': datetime.datetime.utcnow(),
@@ -359,7 +604,7 @@ def check_and_train_model(user_email):
                     'model_info': model.get_model_info()
                 })
                 
-                print(f"✅ ML Model trained successfully for {user_email}")
+                logger.info('ML model trained', extra={'user_email': user_email, 'samples': sample_count})
                 
                 # Send completion notification
                 socketio.emit('ml_training_complete', {
@@ -370,124 +615,193 @@ def check_and_train_model(user_email):
                 
                 return True
             else:
-                print(f"❌ ML Training failed for {user_email}: {message}")
+                logger.warning('ML training failed', extra={'user_email': user_email, 'reason': message})
                 return False
         else:
             # Still collecting data
-            remaining_samples = max(0, 30 - sample_count)
-            print(f"⏳ ML Training for {user_email}: {sample_count}/30 samples")
+            logger.debug('ML training collecting samples', extra={
+                'user_email': user_email, 'samples': sample_count, 'remaining_samples': max(0, 30 - sample_count)
+            })
             return False
     
     return False
 
-def analyze_device_behavior(user_email, device_locations):
-    """Analyze device behavior and detect anomalies"""
+def effective_detector(detector):
+    """The detector that runs: population falls back to batch until its model exists"""
+    if detector == 'population' and load_population_model() is None:
+        # No population model trained yet (python population_model.py)
+        return 'batch'
+    return detector
+
+def detector_ready(user_email, detector):
+    """Train or calibrate the user's detector when due; True once it can score"""
+    if detector == 'streaming':
+        # Learns from every record: no training phase, no retraining
+        return True
+    with LOCATION_STAGE_SECONDS.labels('train').time():
+        if detector == 'population':
+            # Shared forest: scores from the first record, only the calibration is refit
+            return prepare_population_model(user_email)
+        # Check and train model if needed
+        return check_and_train_model(user_email)
+
+def analyze_device_behavior(user_email, device_locations, detector=ML_DETECTOR_DEFAULT, fix_time=None,
+                            university_data=None, batch=None):
+    """Analyze device behavior and detect anomalies
+    
+    fix_time stamps the behaviour records (default now). With a PairBatch the
+    records are only collected: the [(record, device1, device2)] pairs are
+    returned for ingest_fix_batch to write and score together.
+    """
     if len(device_locations) < 2:
         return None
     
-    university_data = university_collection.find_one({'user_email': user_email})
+    if university_data is None:
+        university_data = store.get_university(user_email)
     if not university_data or 'sections' not in university_data:
         return None
     
     sections = university_data['sections']
     device_list = list(device_locations.values())
+    detector = effective_detector(detector)
+    pairs = []
     
     for i in range(len(device_list)):
         for j in range(i + 1, len(device_list)):
             device1 = device_list[i]
             device2 = device_list[j]
             
-            device1_section = detect_section(device1['latitude'], device1['longitude'], sections)
-            device2_section = detect_section(device2['latitude'], device2['longitude'], sections)
+            # Prefer the geofence-confirmed section stored with the fix
+            device1_section = device1.get('current_section') or detect_section(device1['latitude'], device1['longitude'], sections)
+            device2_section = device2.get('current_section') or detect_section(device2['latitude'], device2['longitude'], sections)
             
             device1['current_section'] = device1_section
             device2['current_section'] = device2_section
             
             # Analyze device pair behavior
-            behavior_record = behavior_analyzer.analyze_device_pair(user_email, device1, device2)
+            behavior_record = behavior_analyzer.analyze_device_pair(user_email, device1, device2,
+                                                                     current_time=fix_time, batch=batch)
+            if batch is not None:
+                pairs.append((behavior_record, device1, device2))
+                continue
+            status_snapshot.incr('behavior_records')
+            change_tracker.bump(user_email, 'patterns')
             
-            # Check and train model if needed
-            model_ready = check_and_train_model(user_email)
-            
-            if model_ready:
-                with model_lock:
-                    if user_email in user_models:
-                        model = user_models[user_email]
-                        
-                        # Predict anomaly with detailed analysis
-                        is_anomaly, confidence, message, anomaly_details = model.predict_anomaly(behavior_record)
-                        
-                        if is_anomaly:
-                            print(f"🚨 ANOMALY DETECTED for {user_email}!")
-                            print(f"   Score: {anomaly_details['score']:.3f} (threshold: {anomaly_details['threshold']:.3f})")
-                            print(f"   Device 1: {device1_section}")
-                            print(f"   Device 2: {device2_section}")
-                            print(f"   Distance: {behavior_record['distance_between_devices']:.1f}m")
-                            print(f"   Confidence: {confidence:.2f}")
-                            
-                            # Get individual device patterns for more context
-                            device1_pattern = behavior_analyzer.get_device_pattern(user_email, device1['device_id'])
-                            device2_pattern = behavior_analyzer.get_device_pattern(user_email, device2['device_id'])
-                            
-                            # Check individual anomalies
-                            device1_anomaly, device1_details = model.detect_individual_anomaly(
-                                {'section_id': behavior_analyzer.get_section_id(device1_section),
-                                 'speed': behavior_record.get('movement_speed_device1', 0)},
-                                {'section_id': behavior_analyzer.get_section_id(device2_section),
-                                 'distance_to_other': behavior_record['distance_between_devices'],
-                                 'with_other_device': device2['device_id']}
-                            )
-                            
-                            device2_anomaly, device2_details = model.detect_individual_anomaly(
-                                {'section_id': behavior_analyzer.get_section_id(device2_section),
-                                 'speed': behavior_record.get('movement_speed_device2', 0)},
-                                {'section_id': behavior_analyzer.get_section_id(device1_section),
-                                 'distance_to_other': behavior_record['distance_between_devices'],
-                                 'with_other_device': device1['device_id']}
-                            )
-                            
-                            # Prepare alert data
-                            alert_data = {
-                                'message': 'Unusual device behavior detected!',
-                                'device1': device1['device_id'],
-                                'device2': device2['device_id'],
-                                'device1_section': device1_section,
-                                'device2_section': device2_section,
-                                'distance': behavior_record['distance_between_devices'],
-                                'confidence': confidence,
-                                'score': anomaly_details['score'],
-                                'threshold': anomaly_details['threshold'],
-                                'cluster_distance': anomaly_details.get('cluster_distance', 0),
-                                'timestamp': datetime.datetime.utcnow().isoformat(),
-                                'details': {
-                                    'pair_anomaly': True,
-                                    'device1_anomaly': device1_anomaly,
-                                    'device2_anomaly': device2_anomaly,
-                                    'device1_reasons': device1_details.get('reasons', []) if device1_anomaly else [],
-                                    'device2_reasons': device2_details.get('reasons', []) if device2_anomaly else [],
-                                    'feature_analysis': anomaly_details.get('features', {})
-                                }
-                            }
-                            
-                            # Send comprehensive alert
-                            socketio.emit('anomaly_alert', alert_data, room=user_email)
-                            
-                            # Also send individual alerts if needed
-                            if device1_anomaly and device1_details.get('reasons'):
-                                socketio.emit('individual_anomaly', {
-                                    'device_id': device1['device_id'],
-                                    'reasons': device1_details['reasons'],
-                                    'confidence': device1_details.get('confidence', 0.7),
-                                    'timestamp': datetime.datetime.utcnow().isoformat()
-                                }, room=user_email)
-                            
-                            if device2_anomaly and device2_details.get('reasons'):
-                                socketio.emit('individual_anomaly', {
-                                    'device_id': device2['device_id'],
-                                    'reasons': device2_details['reasons'],
-                                    'confidence': device2_details.get('confidence', 0.7),
-                                    'timestamp': datetime.datetime.utcnow().isoformat()
-                                }, room=user_email)
+            if detector_ready(user_email, detector):
+                model = detector_model(user_email, detector)
+                if model is not None:
+                    score_device_pair(user_email, detector, model, behavior_record, device1, device2)
+    return pairs if batch is not None else None
+
+def score_device_pair(user_email, detector, model, behavior_record, device1, device2):
+    """Score a pair record with the user's detector and send any anomaly alerts"""
+    device1_section = device1['current_section']
+    device2_section = device2['current_section']
+    
+    # Predict anomaly with detailed analysis. Streaming and calibrated models
+    # update their state as they score, so one user's records go one at a time
+    with user_model_lock(user_email):
+        with LOCATION_STAGE_SECONDS.labels('predict').time():
+            is_anomaly, confidence, message, anomaly_details = run_blocking(model.predict_anomaly, behavior_record)
+        if detector == 'streaming' and model.records_since_snapshot >= STREAM_SNAPSHOT_RECORDS:
+            run_blocking(model.save_model, streaming_model_path(user_email))
+    CASCADE_DECISIONS.labels(anomaly_details.get('cascade', 'off')).inc()
+    
+    if is_anomaly:
+        ANOMALIES.labels('pair').inc()
+        logger.info('anomaly detected', extra={
+            'user_email': user_email,
+            'score': round(anomaly_details['score'], 3),
+            'threshold': round(anomaly_details['threshold'], 3),
+            'device1_section': device1_section,
+            'device2_section': device2_section,
+            'distance_m': round(behavior_record['distance_between_devices'], 1),
+            'confidence': round(confidence, 2)
+        })
+        
+        # Check individual anomalies
+        device1_anomaly, device1_details = model.detect_individual_anomaly(
+            {'section_id': behavior_analyzer.get_section_id(device1_section),
+             'speed': behavior_record.get('movement_speed_device1', 0)},
+            {'section_id': behavior_analyzer.get_section_id(device2_section),
+             'distance_to_other': behavior_record['distance_between_devices'],
+             'with_other_device': device2['device_id']}
+        )
+        
+        device2_anomaly, device2_details = model.detect_individual_anomaly(
+            {'section_id': behavior_analyzer.get_section_id(device2_section),
+             'speed': behavior_record.get('movement_speed_device2', 0)},
+            {'section_id': behavior_analyzer.get_section_id(device1_section),
+             'distance_to_other': behavior_record['distance_between_devices'],
+             'with_other_device': device1['device_id']}
+        )
+        
+        # Prepare alert data
+        alert_data = {
+            'message': 'Unusual device behavior detected!',
+            'device1': device1['device_id'],
+            'device2': device2['device_id'],
+            'device1_section': device1_section,
+            'device2_section': device2_section,
+            'distance': behavior_record['distance_between_devices'],
+            'confidence': confidence,
+            'score': anomaly_details['score'],
+            'threshold': anomaly_details['threshold'],
+            'cluster_distance': anomaly_details.get('cluster_distance', 0),
+            'timestamp': datetime.datetime.utcnow().isoformat(),
+            'details': {
+                'pair_anomaly': True,
+                'device1_anomaly': device1_anomaly,
+                'device2_anomaly': device2_anomaly,
+                'device1_reasons': device1_details.get('reasons', []) if device1_anomaly else [],
+                'device2_reasons': device2_details.get('reasons', []) if device2_anomaly else [],
+                'feature_analysis': anomaly_details.get('features', {})
+            }
+        }
+        
+        # Send comprehensive alert
+        socketio.emit('anomaly_alert', alert_data, room=user_email)
+        
+        # Also send individual alerts if needed
+        if device1_anomaly and device1_details.get('reasons'):
+            ANOMALIES.labels('individual').inc()
+            socketio.emit('individual_anomaly', {
+                'device_id': device1['device_id'],
+                'reasons': device1_details['reasons'],
+                'confidence': device1_details.get('confidence', 0.7),
+                'timestamp': datetime.datetime.utcnow().isoformat()
+            }, room=user_email)
+        
+        if device2_anomaly and device2_details.get('reasons'):
+            ANOMALIES.labels('individual').inc()
+            socketio.emit('individual_anomaly', {
+                'device_id': device2['device_id'],
+                'reasons': device2_details['reasons'],
+                'confidence': device2_details.get('confidence', 0.7),
+                'timestamp': datetime.datetime.utcnow().isoformat()
+            }, room=user_email)
+
+class UserNotFound(Exception):
+    pass
+
+def resolve_token(token):
+    """User document for a JWT (cached); raises UserNotFound or a jwt error"""
+    if token.startswith('Bearer '):
+        token = token.split(' ')[1]
+    current_user = token_cache.get(token)
+    if current_user is None:
+        data = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+        current_user = store.get_user(data['email'])
+        if not current_user:
+            raise UserNotFound(data['email'])
+        # Never cache a token past its own expiry
+        ttl = min(TOKEN_CACHE_TTL, data.get('exp', 0) - time.time())
+        token_cache.set(token, current_user, ttl=ttl)
+    # Callers may change the document (e.g. its devices list): never hand out the cached one
+    return copy.deepcopy(current_user)
+
+def is_admin(user):
+    return user.get('email', '').lower() in ADMIN_EMAILS
 
 def token_required(f):
     def decorated(*args, **kwargs):
@@ -495,18 +809,60 @@ def token_required(f):
         if not token:
             return jsonify({'error': 'Token is missing'}), 401
         try:
-            if token.startswith('Bearer '):
-                token = token.split(' ')[1]
-            data = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-            current_user = users_collection.find_one({'email': data['email']})
-            if not current_user:
-                return jsonify({'error': 'User not found'}), 401
+            current_user = resolve_token(token)
+        except UserNotFound:
+            return jsonify({'error': 'User not found'}), 401
         except:
             return jsonify({'error': 'Token is invalid'}), 401
         return f(current_user, *args, **kwargs)
     decorated.__name__ = f.__name__
     return decorated
 
+def admin_required(f):
+    """Use under token_required; only ADMIN_EMAILS accounts get through"""
+    def decorated(current_user, *args, **kwargs):
+        if not is_admin(current_user):
+            return jsonify({'error': 'Admin access required'}), 403
+        return f(current_user, *args, **kwargs)
+    decorated.__name__ = f.__name__
+    return decorated
+
+def owner_required(f):
+    """Use under token_required; writes to a user's state only run on the owning worker"""
+    def decorated(current_user, *args, **kwargs):
+        user_email = current_user['email']
+        if not owns_user(user_email):
+            return jsonify({'error': 'User is handled by another worker', 'worker': owner_for(user_email)}), 409
+        return f(current_user, *args, **kwargs)
+    decorated.__name__ = f.__name__
+    return decorated
+
+def conditional_get(scope, bucket_seconds=None):
+    """Answer polls with 304 while the user's scope version matches If-None-Match
+
+    bucket_seconds adds a time bucket to the ETag for responses that also
+    depend on the clock (online flags, training progress).
+    """
+    def decorator(f):
+        def decorated(current_user, *args, **kwargs):
+            user_email = current_user['email']
+            extra = [int(time.time() // bucket_seconds)] if bucket_seconds else []
+            etag = change_tracker.etag(user_email, scope, *extra)
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+            else:
+                response = app.make_response(f(current_user, *args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            # Per-user data: never shared between accounts or by intermediaries
+            response.headers['Cache-Control'] = 'private, no-cache'
+            response.vary.add('Authorization')
+            return response
+        decorated.__name__ = f.__name__
+        return decorated
+    return decorator
+
 def serialize_document(document):
     if document is None:
         return None
@@ -522,18 +878,48 @@ def serialize_document(document):
 @app.after_request
 def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,X-Requested-With')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,X-Requested-With,If-None-Match')
+    response.headers.add('Access-Control-Expose-Headers', 'ETag')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
     response.headers.add('Access-Control-Allow-Credentials', 'true')
     return response
 
+background_tasks_started = False
+background_tasks_lock = threading.Lock()
+
+def bump_patterns(user_emails):
+    """Invalidate /api/device-patterns ETags after pair stats were written in the background"""
+    for user_email in user_emails:
+        change_tracker.bump(user_email, 'patterns')
+
+def start_background_tasks():
+    """Start per-process background loops once, in the serving process"""
+    global background_tasks_started
+    if background_tasks_started:
+        return
+    with background_tasks_lock:
+        if background_tasks_started:
+            return
+        background_tasks_started = True
+    socketio.start_background_task(model_warmup.run, socketio.start_background_task, socketio.sleep)
+    socketio.start_background_task(trajectory_store.run_flusher, socketio.sleep)
+    socketio.start_background_task(behavior_analyzer.rollups.run_flusher, socketio.sleep, on_flush=bump_patterns)
+    socketio.start_background_task(behavior_analyzer.reservoirs.run_flusher, socketio.sleep)
+    socketio.start_background_task(status_snapshot.run_refresher, socketio.sleep)
+
+@app.before_request
+def ensure_background_tasks():
+    # Load balancer health checks start the warm-up on a fresh worker
+    start_background_tasks()
+
 @socketio.on('connect')
 def handle_connect():
-    print(f'Client connected: {request.sid}')
+    start_background_tasks()
+    logger.debug('client connected', extra={'sid': request.sid})
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    print(f'Client disconnected: {request.sid}')
+    logger.debug('client disconnected', extra={'sid': request.sid})
 
 @socketio.on('join_room')
 def handle_join_room(data):
@@ -541,9 +927,14 @@ def handle_join_room(data):
         user_email = data.get('user_email')
         if user_email:
             join_room(user_email)
-            print(f'User {user_email} joined room')
+            logger.debug('joined room', extra={'user_email': user_email})
             emit('join_confirmation', {'message': f'Joined room for {user_email}'})
             
+            # Another worker owns this user's model and device state
+            if not owns_user(user_email):
+                emit('worker_redirect', {'user_email': user_email, 'worker': owner_for(user_email)})
+                return
+            
             # Send ML status
             training_status = behavior_analyzer.get_training_status(user_email)
             if training_status:
@@ -556,7 +947,7 @@ def handle_join_room(data):
                 })
             else:
                 # Check if user has 2+ devices and should start training
-                user = users_collection.find_one({'email': user_email})
+                user = store.get_user(user_email)
                 if user and len(user.get('devices', [])) >= 2:
                     emit('ml_status_update', {
                         'is_training': False,
@@ -564,36 +955,161 @@ def handle_join_room(data):
                         'training_samples': 0,
                         'message': 'Ready to start ML training with 2+ devices'
                     })
-    except Exception as e:
-        print(f"Error joining room: {str(e)}")
+    except Exception:
+        logger.exception('join_room failed')
+
+def stored_section_state(user_email, device_id, last_location):
+    """Geofence state of a device as last stored, for a worker that has none in memory"""
+    section = last_location.get('current_section') if last_location else None
+    if not section or not last_location.get('timestamp'):
+        return None
+    restore = {'section': section, 'entered_at': last_location['timestamp']}
+    if section != 'Outside Campus':
+        # The visit started at its enter event, if that is the device's last one
+        # (an exit and the next enter share a timestamp)
+        events = store.get_geofence_events(user_email, device_id, limit=2)
+        section_id = behavior_analyzer.get_section_id(section)
+        for event in events:
+            if event['timestamp'] != events[0]['timestamp']:
+                break
+            if event['type'] in ('enter', 'dwell') and event['section_id'] == section_id:
+                restore['entered_at'] = event['timestamp'] - datetime.timedelta(seconds=event.get('duration', 0))
+                restore['dwell_sent'] = event['type'] == 'dwell'
+                break
+    return restore
+
+def place_fix(user_email, device_id, latitude, longitude, fix_time, university_data, last_location):
+    """Hysteresis-filtered section of an accepted fix and the transitions it causes"""
+    if not university_data or 'sections' not in university_data:
+        return 'Outside Campus', []
+    restore = None
+    if geofence_engine.current_section(device_id) is None:
+        restore = stored_section_state(user_email, device_id, last_location)
+    return geofence_engine.update(device_id, latitude, longitude, fix_time, university_data['sections'], restore)
+
+def location_document(user_email, device_id, validated, raw, fix_time, reason, current_section, last_location):
+    """locations document for an accepted fix, carrying the best high-accuracy position forward"""
+    validated_lat, validated_lng, validated_acc = validated
+    location_data = {
+        'device_id': device_id,
+        'latitude': validated_lat,
+        'longitude': validated_lng,
+        'accuracy': validated_acc,
+        'raw_latitude': raw[0],
+        'raw_longitude': raw[1],
+        'raw_accuracy': raw[2],
+        'timestamp': fix_time,
+        'user_email': user_email,
+        'validation_reason': reason,
+        'current_section': current_section
+    }
+    if reason == "high_accuracy_accepted":
+        location_data['best_latitude'] = validated_lat
+        location_data['best_longitude'] = validated_lng
+        location_data['best_accuracy'] = validated_acc
+        location_data['best_timestamp'] = fix_time
+    elif last_location and 'best_latitude' in last_location:
+        location_data['best_latitude'] = last_location['best_latitude']
+        location_data['best_longitude'] = last_location['best_longitude']
+        location_data['best_accuracy'] = last_location['best_accuracy']
+        location_data['best_timestamp'] = last_location.get('best_timestamp', fix_time)
+    return location_data
+
+def device_fields(location_data):
+    """devices fields updated by a device's latest accepted fix"""
+    return {
+        'last_seen': location_data['timestamp'],
+        'location_tracking': True,
+        'last_latitude': location_data['latitude'],
+        'last_longitude': location_data['longitude'],
+        'last_accuracy': location_data['accuracy'],
+        'current_section': location_data['current_section']
+    }
+
+def broadcast_fix(user_email, location_data, section_events):
+    """Push an accepted fix and its section transitions to the user's room"""
+    scopes = ['devices', 'locations']
+    if section_events or location_data['current_section'] != 'Outside Campus':
+        # Dwell of a visit in progress grows with every fix inside the section
+        scopes.append('patterns')
+    change_tracker.bump(user_email, *scopes)
+    socketio.emit('location_update', {
+        'device_id': location_data['device_id'],
+        'latitude': location_data['latitude'],
+        'longitude': location_data['longitude'],
+        'accuracy': location_data['accuracy'],
+        'timestamp': location_data['timestamp'].isoformat(),
+        'validation_reason': location_data['validation_reason'],
+        'current_section': location_data['current_section']
+    }, room=user_email)
+    
+    if section_events:
+        for event in section_events:
+            socketio.emit('geofence_event', {
+                'device_id': event['device_id'],
+                'type': event['type'],
+                'section': event['section'],
+                'duration': event.get('duration'),
+                'timestamp': event['timestamp'].isoformat()
+            }, room=user_email)
+
+def parse_fix(data):
+    """(device_id, latitude, longitude, accuracy) of a client fix; raises ValueError"""
+    device_id = data.get('device_id')
+    latitude = data.get('latitude')
+    longitude = data.get('longitude')
+    if not all([device_id, latitude, longitude]):
+        raise ValueError('missing required fields')
+    try:
+        return device_id, float(latitude), float(longitude), float(data.get('accuracy', 0))
+    except TypeError:
+        raise ValueError('invalid coordinates') from None
+
+def fix_timestamp(value, now):
+    """Client capture time of a live fix; server time when missing or off by more than the allowed skew"""
+    try:
+        fix_time = parse_query_time(value, None) if isinstance(value, str) else None
+    except ValueError:
+        fix_time = None
+    if fix_time is None or abs((fix_time - now).total_seconds()) > FIX_CLOCK_SKEW_SECONDS:
+        return now
+    return fix_time
 
 @socketio.on('update_location')
 def handle_location_update(data):
+    # Runs under cProfile only while an admin has armed this user
+    user_email = data.get('user_email') if isinstance(data, dict) else None
+    user_profiler.run(user_email, process_location_update, data)
+
+def process_location_update(data):
     try:
-        device_id = data.get('device_id')
-        latitude = data.get('latitude')
-        longitude = data.get('longitude')
-        accuracy = data.get('accuracy', 0)
         user_email = data.get('user_email')
-        
-        if not all([device_id, latitude, longitude, user_email]):
-            print("Missing required fields")
+        try:
+            device_id, raw_lat, raw_lng, acc = parse_fix(data)
+        except ValueError as e:
+            LOCATION_UPDATES.labels('invalid').inc()
+            logger.debug('update_location rejected', extra={'device_id': data.get('device_id'), 'error': str(e)})
+            return
+        if not user_email:
+            LOCATION_UPDATES.labels('invalid').inc()
+            logger.debug('update_location missing required fields')
             return
         
-        try:
-            raw_lat = float(latitude)
-            raw_lng = float(longitude)
-            acc = float(accuracy)
-        except ValueError:
-            print("Invalid coordinate format")
+        if not owns_user(user_email):
+            # The fix is not stored here: it goes back for the client to resend to the owner
+            emit('worker_redirect', {'user_email': user_email, 'worker': owner_for(user_email), 'fix': data})
             return
         
-        validated_lat, validated_lng, validated_acc, is_valid, reason = validate_and_constrain_location(
-            device_id, raw_lat, raw_lng, acc
-        )
+        fix_time = fix_timestamp(data.get('timestamp'), datetime.datetime.utcnow())
+        
+        with LOCATION_STAGE_SECONDS.labels('validate').time():
+            last_location = store.get_location(device_id)
+            validated_lat, validated_lng, validated_acc, is_valid, reason = constrain_fix(
+                raw_lat, raw_lng, acc, last_location, device_id
+            )
         
         if not is_valid:
-            print(f"❌ Location rejected: {reason}")
+            LOCATION_UPDATES.labels('rejected').inc()
             socketio.emit('location_rejected', {
                 'device_id': device_id,
                 'reason': reason,
@@ -601,86 +1117,156 @@ def handle_location_update(data):
             }, room=user_email)
             return
         
-        university_data = university_collection.find_one({'user_email': user_email})
-        current_section = 'Outside Campus'
-        
-        if university_data and 'sections' in university_data:
-            current_section = detect_section(validated_lat, validated_lng, university_data['sections'])
-            print(f"📌 Device {device_id[:8]} in section: {current_section}")
-        
-        location_data = {
-            'device_id': device_id,
-            'latitude': validated_lat,
-            'longitude': validated_lng,
-            'accuracy': validated_acc,
-            'raw_latitude': raw_lat,
-            'raw_longitude': raw_lng,
-            'raw_accuracy': acc,
-            'timestamp': datetime.datetime.utcnow(),
-            'user_email': user_email,
-            'validation_reason': reason,
-            'current_section': current_section
-        }
-        
-        if reason == "high_accuracy_accepted":
-            location_data['best_latitude'] = validated_lat
-            location_data['best_longitude'] = validated_lng
-            location_data['best_accuracy'] = validated_acc
-            location_data['best_timestamp'] = datetime.datetime.utcnow()
-        else:
-            existing = locations_collection.find_one({'device_id': device_id})
-            if existing and 'best_latitude' in existing:
-                location_data['best_latitude'] = existing['best_latitude']
-                location_data['best_longitude'] = existing['best_longitude']
-                location_data['best_accuracy'] = existing['best_accuracy']
-                location_data['best_timestamp'] = existing.get('best_timestamp', datetime.datetime.utcnow())
-        
-        locations_collection.update_one(
-            {'device_id': device_id},
-            {'$set': location_data},
-            upsert=True
-        )
-        
-        devices_collection.update_one(
-            {'device_id': device_id},
-            {'$set': {
-                'last_seen': datetime.datetime.utcnow(),
-                'location_tracking': True,
-                'last_latitude': validated_lat,
-                'last_longitude': validated_lng,
-                'last_accuracy': validated_acc,
-                'current_section': current_section
-            }}
-        )
+        with LOCATION_STAGE_SECONDS.labels('section').time():
+            university_data = store.get_university(user_email)
+            current_section, section_events = place_fix(user_email, device_id, validated_lat, validated_lng,
+                                                        fix_time, university_data, last_location)
         
-        broadcast_data = {
-            'device_id': device_id,
-            'latitude': validated_lat,
-            'longitude': validated_lng,
-            'accuracy': validated_acc,
-            'timestamp': location_data['timestamp'].isoformat(),
-            'validation_reason': reason,
-            'current_section': current_section
-        }
+        location_data = location_document(user_email, device_id, (validated_lat, validated_lng, validated_acc),
+                                          (raw_lat, raw_lng, acc), fix_time, reason, current_section, last_location)
         
-        socketio.emit('location_update', broadcast_data, room=user_email)
-        
-        # Check if we should analyze behavior
-        user = users_collection.find_one({'email': user_email})
-        if user and len(user.get('devices', [])) >= 2:
-            user_devices = {}
-            for dev_id in user.get('devices', []):
-                loc = locations_collection.find_one({'device_id': dev_id})
-                if loc and 'latitude' in loc:
-                    user_devices[dev_id] = loc
+        with LOCATION_STAGE_SECONDS.labels('persist').time():
+            store.upsert_location(device_id, location_data)
+            status_snapshot.incr('locations_ingested')
+            trajectory_store.append(user_email, device_id, validated_lat, validated_lng, validated_acc, fix_time)
+            store.update_device(device_id, device_fields(location_data))
             
-            if len(user_devices) >= 2:
-                analyze_device_behavior(user_email, user_devices)
+            if section_events:
+                behavior_analyzer.record_section_events(user_email, section_events)
+        
+        LOCATION_UPDATES.labels('accepted').inc()
+        with LOCATION_STAGE_SECONDS.labels('broadcast').time():
+            broadcast_fix(user_email, location_data, section_events)
+        
+        # Check if we should analyze behavior (includes the train and predict stages)
+        with LOCATION_STAGE_SECONDS.labels('analyze').time():
+            user = store.get_user(user_email)
+            if user and len(user.get('devices', [])) >= 2:
+                user_devices = {}
+                for loc in store.get_locations(user.get('devices', [])):
+                    if 'latitude' in loc:
+                        user_devices[loc['device_id']] = loc
+                
+                if len(user_devices) >= 2:
+                    analyze_device_behavior(user_email, user_devices, user.get('ml_detector', ML_DETECTOR_DEFAULT),
+                                            fix_time=fix_time, university_data=university_data)
         
-    except Exception as e:
-        print(f"Error updating location: {str(e)}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        logger.exception('update_location failed')
+
+def ingest_fix_batch(user, fixes):
+    """Run a user's timestamped fixes through the ingest pipeline in time order.
+    
+    Same validation, sections, trajectory and analysis as update_location, but
+    state is carried in memory between fixes: locations, devices and behaviour
+    records are written once per batch and only each device's latest fix and the
+    section transitions are broadcast. Pair records are collected in a PairBatch
+    and written with one pattern update per device; the detector is trained or
+    calibrated once for the batch and then scores the records in time order.
+    Fixes older than a device's stored position are validated and kept in the
+    history without moving the device or its section. Returns counts per outcome.
+    """
+    user_email = user['email']
+    device_ids = user.get('devices', [])
+    now = datetime.datetime.utcnow()
+    oldest = now - datetime.timedelta(hours=FIX_MAX_AGE_HOURS)
+    counts = {'accepted': 0, 'rejected': 0, 'invalid': 0, 'stale': 0}
+    
+    parsed = []
+    for index, data in enumerate(fixes):
+        try:
+            if not isinstance(data, dict):
+                raise ValueError('fix must be an object')
+            device_id, raw_lat, raw_lng, acc = parse_fix(data)
+            timestamp = data.get('timestamp')
+            fix_time = parse_query_time(timestamp, None) if isinstance(timestamp, str) else None
+            if device_id not in device_ids or fix_time is None:
+                raise ValueError('unknown device or missing timestamp')
+        except ValueError:
+            counts['invalid'] += 1
+            continue
+        if fix_time > now + datetime.timedelta(seconds=FIX_CLOCK_SKEW_SECONDS) or fix_time < oldest:
+            counts['invalid'] += 1
+            continue
+        parsed.append((fix_time, index, device_id, raw_lat, raw_lng, acc))
+    parsed.sort(key=lambda fix: fix[:2])
+    LOCATION_UPDATES.labels('invalid').inc(counts['invalid'])
+    
+    locations = {loc['device_id']: loc for loc in store.get_locations(device_ids)}
+    university_data = store.get_university(user_email)
+    detector = effective_detector(user.get('ml_detector', ML_DETECTOR_DEFAULT))
+    latest = {}
+    # Each device's last fix that is older than its stored position
+    history = {}
+    section_events = []
+    batch = PairBatch()
+    pairs = []
+    for fix_time, _, device_id, raw_lat, raw_lng, acc in parsed:
+        last_location = locations.get(device_id)
+        stale = bool(last_location and last_location.get('timestamp') and fix_time < last_location['timestamp'])
+        # A stale fix is checked against the device's previous fix, not its newer position
+        reference = history.get(device_id) if stale else last_location
+        validated_lat, validated_lng, validated_acc, is_valid, reason = constrain_fix(
+            raw_lat, raw_lng, acc, reference, device_id
+        )
+        if not is_valid:
+            counts['rejected'] += 1
+            continue
+        if stale:
+            # Kept in the history (trajectory, pair records and rollups) only: the current
+            # position and the geofence state stay as they are, so no section events
+            current_section = (detect_section(validated_lat, validated_lng, university_data['sections'])
+                               if university_data and 'sections' in university_data else 'Outside Campus')
+            events = []
+        else:
+            current_section, events = place_fix(user_email, device_id, validated_lat, validated_lng, fix_time,
+                                                university_data, last_location)
+        location_data = location_document(user_email, device_id, (validated_lat, validated_lng, validated_acc),
+                                          (raw_lat, raw_lng, acc), fix_time, reason, current_section, reference)
+        if stale:
+            history[device_id] = location_data
+            counts['stale'] += 1
+        else:
+            locations[device_id] = latest[device_id] = location_data
+            section_events.extend(events)
+            counts['accepted'] += 1
+        trajectory_store.append(user_email, device_id, validated_lat, validated_lng, validated_acc, fix_time)
+        
+        # Pair each fix with the other devices' positions as of its timestamp
+        user_devices = {device_id: dict(location_data)}
+        for other_id, loc in locations.items():
+            if other_id == device_id or 'latitude' not in loc:
+                continue
+            if loc.get('timestamp') and loc['timestamp'] > fix_time:
+                loc = history.get(other_id)
+            if loc:
+                user_devices[other_id] = dict(loc)
+        if len(device_ids) >= 2 and len(user_devices) >= 2:
+            pairs.extend(analyze_device_behavior(user_email, user_devices, detector, fix_time=fix_time,
+                                                 university_data=university_data, batch=batch) or [])
+    
+    if latest:
+        store.upsert_locations(latest)
+        store.update_devices({device_id: device_fields(data) for device_id, data in latest.items()})
+    status_snapshot.incr('locations_ingested', counts['accepted'] + counts['stale'])
+    behavior_analyzer.flush_batch(user_email, batch)
+    if section_events:
+        behavior_analyzer.record_section_events(user_email, section_events)
+    if pairs:
+        status_snapshot.incr('behavior_records', len(pairs))
+        change_tracker.bump(user_email, 'patterns')
+        model = detector_model(user_email, detector) if detector_ready(user_email, detector) else None
+        if model is not None:
+            for behavior_record, device1, device2 in pairs:
+                score_device_pair(user_email, detector, model, behavior_record, device1, device2)
+    LOCATION_UPDATES.labels('accepted').inc(counts['accepted'])
+    LOCATION_UPDATES.labels('stale').inc(counts['stale'])
+    LOCATION_UPDATES.labels('rejected').inc(counts['rejected'])
+    
+    for device_id, location_data in latest.items():
+        broadcast_fix(user_email, location_data, [event for event in section_events if event['device_id'] == device_id])
+    counts['behavior_records'] = len(batch.records)
+    return counts
 
 @app.route('/')
 def home():
@@ -689,21 +1275,21 @@ def home():
 @app.route('/api/health', methods=['GET'])
 def health_check():
     try:
-        client.admin.command('ping')
-        
-        # Check ML models directory
-        models_dir = 'models'
-        model_count = 0
-        if os.path.exists(models_dir):
-            model_count = len([f for f in os.listdir(models_dir) if f.endswith('.pkl')])
+        store.ping()
+        snapshot, _ = status_snapshot.get()
+        # Not ready (503) until recently active users' models are loaded
+        ready = model_warmup.ready
         
         return jsonify({
-            'status': 'healthy',
+            'status': 'healthy' if ready else 'warming_up',
+            'ready': ready,
+            'warmup': model_warmup.status(),
             'timestamp': datetime.datetime.utcnow().isoformat(),
             'database': 'connected',
-            'ml_models': model_count,
-            'active_users': len(user_models)
-        }), 200
+            'ml_models': snapshot['trained_models'],
+            'active_users': len(user_models),
+            'worker': WORKER_ID
+        }), 200 if ready else 503
     except Exception as e:
         return jsonify({'status': 'unhealthy', 'error': str(e)}), 500
 
@@ -717,10 +1303,10 @@ def register():
         if not email or not password:
             return jsonify({'error': 'Email and password are required'}), 400
         
-        if users_collection.find_one({'email': email}):
+        if store.get_user(email):
             return jsonify({'error': 'User already exists'}), 400
         
-        hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+        hashed_password = password_hasher.generate_password_hash(password)
         
         user = {
             'email': email,
@@ -731,7 +1317,7 @@ def register():
             'last_login': datetime.datetime.utcnow()
         }
         
-        result = users_collection.insert_one(user)
+        result = store.create_user(user)
         user['_id'] = str(result.inserted_id)
         
         token = jwt.encode({
@@ -747,6 +1333,8 @@ def register():
             'user': serialize_document(user)
         }), 201
         
+    except PasswordPoolSaturated as e:
+        return jsonify({'error': 'Too many sign-in requests, please retry'}), 503, {'Retry-After': str(e.retry_after)}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -760,25 +1348,23 @@ def login():
         if not email or not password:
             return jsonify({'error': 'Email and password are required'}), 400
         
-        user = users_collection.find_one({'email': email})
+        user = store.get_user(email)
         if not user:
             return jsonify({'error': 'Invalid credentials'}), 401
         
-        if not bcrypt.check_password_hash(user['password'], password):
+        if not password_hasher.check_password_hash(user['password'], password):
             return jsonify({'error': 'Invalid credentials'}), 401
         
         device_id = generate_device_fingerprint()
-        device_exists = devices_collection.find_one({'device_id': device_id})
+        device_exists = store.get_device(device_id)
         
         token = jwt.encode({
             'email': email,
             'exp': datetime.datetime.utcnow() + datetime.timedelta(days=7)
         }, JWT_SECRET)
         
-        users_collection.update_one(
-            {'email': email},
-            {'$set': {'last_login': datetime.datetime.utcnow()}}
-        )
+        store.update_user(email, {'$set': {'last_login': datetime.datetime.utcnow()}})
+        token_cache.invalidate_user(email)
         
         user_data = serialize_document(user)
         user_data.pop('password', None)
@@ -791,6 +1377,8 @@ def login():
             'device_id': device_id
         }), 200
         
+    except PasswordPoolSaturated as e:
+        return jsonify({'error': 'Too many sign-in requests, please retry'}), 503, {'Retry-After': str(e.retry_after)}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -799,9 +1387,9 @@ def login():
 def check_device(current_user):
     try:
         device_id = generate_device_fingerprint()
-        device = devices_collection.find_one({'device_id': device_id})
+        device = store.get_device(device_id)
         
-        user = users_collection.find_one({'email': current_user['email']})
+        user = store.get_user(current_user['email'])
         user_has_device = device_id in user.get('devices', [])
         
         user_agent = request.headers.get('User-Agent', '')
@@ -833,13 +1421,14 @@ def check_device(current_user):
 
 @app.route('/api/add-device', methods=['POST'])
 @token_required
+@owner_required
 def add_device(current_user):
     try:
         device_id = generate_device_fingerprint()
         data = request.json
         device_name = data.get('device_name', 'My Device')
         
-        existing_device = devices_collection.find_one({'device_id': device_id})
+        existing_device = store.get_device(device_id)
         
         if existing_device:
             if existing_device['user_email'] == current_user['email']:
@@ -850,7 +1439,7 @@ def add_device(current_user):
                     'owner': existing_device['user_email']
                 }), 400
         
-        user = users_collection.find_one({'email': current_user['email']})
+        user = store.get_user(current_user['email'])
         if device_id in user.get('devices', []):
             return jsonify({'error': 'Device already in your account'}), 400
         
@@ -871,13 +1460,12 @@ def add_device(current_user):
             'current_section': 'Outside Campus'
         }
         
-        result = devices_collection.insert_one(device)
+        result = store.create_device(device)
         device['_id'] = str(result.inserted_id)
         
-        users_collection.update_one(
-            {'email': current_user['email']},
-            {'$push': {'devices': device_id}}
-        )
+        store.update_user(current_user['email'], {'$push': {'devices': device_id}})
+        token_cache.invalidate_user(current_user['email'])
+        change_tracker.bump(current_user['email'], 'devices', 'locations', 'patterns', 'ml')
         
         device_status = {
             'device_id': device_id,
@@ -889,8 +1477,11 @@ def add_device(current_user):
         }
         
         # Check if user now has 2+ devices and should start ML training
-        updated_user = users_collection.find_one({'email': current_user['email']})
-        if len(updated_user.get('devices', [])) >= 2:
+        updated_user = store.get_user(current_user['email'])
+        # The streaming detector has no training phase: keep its status
+        training_started = (len(updated_user.get('devices', [])) >= 2
+                            and updated_user.get('ml_detector', ML_DETECTOR_DEFAULT) != 'streaming')
+        if training_started:
             # Start ML training
             start_ml_training(current_user['email'])
         
@@ -898,7 +1489,7 @@ def add_device(current_user):
             'message': 'Device added successfully',
             'device': serialize_document(device),
             'device_status': device_status,
-            'ml_training_started': len(updated_user.get('devices', [])) >= 2
+            'ml_training_started': training_started
         }), 201
         
     except Exception as e:
@@ -906,12 +1497,10 @@ def add_device(current_user):
 
 @app.route('/api/user-devices', methods=['GET'])
 @token_required
+@conditional_get('devices')
 def get_user_devices(current_user):
     try:
-        user = users_collection.find_one(
-            {'email': current_user['email']},
-            {'devices': 1, '_id': 0}
-        )
+        user = store.get_user(current_user['email'], {'devices': 1, '_id': 0})
         
         if not user:
             return jsonify({'devices': []}), 200
@@ -921,20 +1510,15 @@ def get_user_devices(current_user):
         if not device_ids:
             return jsonify({'devices': []}), 200
         
-        devices_cursor = devices_collection.find(
-            {'device_id': {'$in': device_ids}},
-            {
-                'device_id': 1,
-                'device_name': 1,
-                'os': 1,
-                'location_tracking': 1,
-                'last_seen': 1,
-                'current_section': 1,
-                '_id': 0
-            }
-        )
-        
-        devices = list(devices_cursor)
+        devices = store.get_devices(device_ids, {
+            'device_id': 1,
+            'device_name': 1,
+            'os': 1,
+            'location_tracking': 1,
+            'last_seen': 1,
+            'current_section': 1,
+            '_id': 0
+        })
         
         return jsonify({'devices': devices}), 200
         
@@ -943,6 +1527,7 @@ def get_user_devices(current_user):
 
 @app.route('/api/grant-location-permission', methods=['POST'])
 @token_required
+@owner_required
 def grant_location_permission(current_user):
     try:
         data = request.json
@@ -953,15 +1538,12 @@ def grant_location_permission(current_user):
         if not device_id:
             return jsonify({'error': 'Device ID is required'}), 400
         
-        device = devices_collection.find_one({
-            'device_id': device_id,
-            'user_email': current_user['email']
-        })
+        device = store.get_device(device_id, current_user['email'])
         
         if not device:
             return jsonify({'error': 'Device not found or not authorized'}), 404
         
-        university_exists = university_collection.find_one({'user_email': current_user['email']})
+        university_exists = store.get_university(current_user['email'])
         
         if not university_exists and initial_latitude and initial_longitude:
             center_lat = float(initial_latitude)
@@ -980,20 +1562,17 @@ def grant_location_permission(current_user):
                 'total_size_meters': UNIVERSITY_SIZE * 111000
             }
             
-            university_collection.insert_one(university_data)
-            print(f"🏛️ University created at {center_lat}, {center_lon}")
+            store.create_university(university_data)
+            logger.info('university created', extra={'user_email': current_user['email'],
+                                                      'lat': center_lat, 'lon': center_lon})
         
-        users_collection.update_one(
-            {'email': current_user['email']},
-            {'$set': {'location_permission': True}}
-        )
+        store.update_user(current_user['email'], {'$set': {'location_permission': True}})
         
-        devices_collection.update_one(
-            {'device_id': device_id},
-            {'$set': {'location_tracking': True}}
-        )
+        store.update_device(device_id, {'location_tracking': True})
+        token_cache.invalidate_user(current_user['email'])
+        change_tracker.bump(current_user['email'], 'devices', 'locations', 'university')
         
-        university_data = university_collection.find_one({'user_email': current_user['email']})
+        university_data = store.get_university(current_user['email'])
         
         return jsonify({
             'message': 'Location permission granted successfully',
@@ -1007,9 +1586,10 @@ def grant_location_permission(current_user):
 
 @app.route('/api/university-layout', methods=['GET'])
 @token_required
+@conditional_get('university')
 def get_university_layout(current_user):
     try:
-        university_data = university_collection.find_one({'user_email': current_user['email']})
+        university_data = store.get_university(current_user['email'])
         
         if not university_data:
             return jsonify({'university': None}), 200
@@ -1023,12 +1603,10 @@ def get_university_layout(current_user):
 
 @app.route('/api/all-devices-locations', methods=['GET'])
 @token_required
+@conditional_get('locations', bucket_seconds=60)
 def get_all_devices_locations(current_user):
     try:
-        user = users_collection.find_one(
-            {'email': current_user['email']},
-            {'devices': 1, '_id': 0}
-        )
+        user = store.get_user(current_user['email'], {'devices': 1, '_id': 0})
         
         if not user:
             return jsonify({'locations': []}), 200
@@ -1038,20 +1616,17 @@ def get_all_devices_locations(current_user):
         if not device_ids:
             return jsonify({'locations': []}), 200
         
-        devices = list(devices_collection.find(
-            {'device_id': {'$in': device_ids}},
-            {
-                'device_id': 1,
-                'device_name': 1,
-                'os': 1,
-                'last_seen': 1,
-                'last_latitude': 1,
-                'last_longitude': 1,
-                'last_accuracy': 1,
-                'current_section': 1,
-                '_id': 0
-            }
-        ))
+        devices = store.get_devices(device_ids, {
+            'device_id': 1,
+            'device_name': 1,
+            'os': 1,
+            'last_seen': 1,
+            'last_latitude': 1,
+            'last_longitude': 1,
+            'last_accuracy': 1,
+            'current_section': 1,
+            '_id': 0
+        })
         
         all_locations = []
         current_time = datetime.datetime.utcnow()
@@ -1076,26 +1651,24 @@ def get_all_devices_locations(current_user):
                     'current_section': device.get('current_section', 'Outside Campus')
                 })
         
-        print(f"📌 Returning {len(all_locations)} locations from database")
         return jsonify({
             'locations': all_locations
         }), 200
         
     except Exception as e:
-        print(f"Error loading locations: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception('loading locations failed')
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/ml-status', methods=['GET'])
 @token_required
+@conditional_get('ml', bucket_seconds=6)
 def get_ml_status(current_user):
     try:
         training_status = behavior_analyzer.get_training_status(current_user['email'])
         
         if not training_status:
             # Check if user has 2+ devices
-            user = users_collection.find_one({'email': current_user['email']})
+            user = store.get_user(current_user['email'])
             device_count = len(user.get('devices', [])) if user else 0
             
             status = {
@@ -1115,12 +1688,15 @@ def get_ml_status(current_user):
         
         # Get additional info from model if trained
         model_info = {}
-        if training_status.get('is_trained') and current_user['email'] in user_models:
+        detector = training_status.get('detector', 'batch')
+        models = {'streaming': streaming_models, 'population': calibrated_models}.get(detector, user_models)
+        if training_status.get('is_trained') and current_user['email'] in models:
             with model_lock:
-                model = user_models[current_user['email']]
+                model = models[current_user['email']]
                 model_info = model.get_model_info()
         
         response = {
+            'detector': detector,
             'is_training': training_status.get('is_training', False),
             'is_trained': training_status.get('is_trained', False),
             'training_samples': training_status.get('training_samples', 0),
@@ -1144,11 +1720,35 @@ def get_ml_status(current_user):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/ml-detector', methods=['POST'])
+@token_required
+@owner_required
+def set_ml_detector(current_user):
+    """Opt in to (or out of) the streaming detector"""
+    detector = (request.get_json(silent=True) or {}).get('detector')
+    if detector not in ML_DETECTORS:
+        return jsonify({'error': f"detector must be one of {', '.join(ML_DETECTORS)}"}), 400
+    if detector == 'population' and load_population_model() is None:
+        return jsonify({'error': 'No population model has been trained'}), 409
+    user_email = current_user['email']
+    store.update_user(user_email, {'$set': {'ml_detector': detector}})
+    status = {'detector': detector, 'last_update': datetime.datetime.utcnow()}
+    if detector == 'streaming':
+        # Nothing to train: the detector scores as soon as it has seen one window
+        status.update({'is_training': False, 'is_trained': True,
+                       'message': 'Streaming detector active. It learns from every record.'})
+    elif detector == 'population':
+        status.update({'is_training': False, 'is_trained': True,
+                       'message': 'Population detector active. It calibrates to your routine as you move.'})
+    update_training_status(user_email, status)
+    return jsonify({'success': True, 'detector': detector}), 200
+
 @app.route('/api/start-ml-training', methods=['POST'])
 @token_required
+@owner_required
 def start_ml_training_route(current_user):
     try:
-        user = users_collection.find_one({'email': current_user['email']})
+        user = store.get_user(current_user['email'])
         device_count = len(user.get('devices', [])) if user else 0
         
         if device_count < 2:
@@ -1183,85 +1783,360 @@ def start_ml_training_route(current_user):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def parse_query_time(value, default):
+    """Parse an ISO-8601 query parameter into a naive UTC datetime"""
+    if not value:
+        return default
+    parsed = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def read_bulk_body():
+    """Raw, or gzip Content-Encoding, request body of at most BULK_MAX_BYTES; raises OverflowError"""
+    if (request.content_length or 0) > BULK_MAX_BYTES:
+        raise OverflowError
+    body = request.get_data(cache=False)
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        body = decompressor.decompress(body, BULK_MAX_BYTES)
+        if decompressor.unconsumed_tail:
+            raise OverflowError
+    elif len(body) > BULK_MAX_BYTES:
+        raise OverflowError
+    return body
+
+@app.route('/api/locations/bulk', methods=['POST'])
+@token_required
+@owner_required
+def upload_locations(current_user):
+    """Ingest fixes buffered while the client was offline: {"fixes": [{device_id, latitude, longitude, accuracy, timestamp}]}"""
+    user_email = current_user['email']
+    try:
+        payload = json.loads(read_bulk_body())
+    except OverflowError:
+        return jsonify({'error': f'Body exceeds {BULK_MAX_BYTES} bytes'}), 413
+    except (zlib.error, ValueError):
+        return jsonify({'error': 'Body must be JSON, optionally gzip-encoded'}), 400
+    fixes = payload.get('fixes') if isinstance(payload, dict) else None
+    if not isinstance(fixes, list):
+        return jsonify({'error': 'fixes must be a list'}), 400
+    if len(fixes) > BULK_MAX_FIXES:
+        return jsonify({'error': f'At most {BULK_MAX_FIXES} fixes per request'}), 413
+    
+    # Fresh user document: the cached one may predate a device registration
+    user = store.get_user(user_email)
+    with LOCATION_STAGE_SECONDS.labels('bulk').time():
+        counts = user_profiler.run(user_email, ingest_fix_batch, user, fixes)
+    logger.info('bulk locations ingested', extra=dict(counts, user_email=user_email, fixes=len(fixes)))
+    return jsonify(counts), 200
+
+@app.route('/api/device-trajectory', methods=['GET'])
+@token_required
+def get_device_trajectory(current_user):
+    try:
+        device_id = request.args.get('device_id')
+        if not device_id or device_id not in current_user.get('devices', []):
+            return jsonify({'error': 'Device not found'}), 404
+        
+        try:
+            # Open ranges end at the next full minute so repeated polls share a cache key
+            now = datetime.datetime.utcnow().replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+            end = parse_query_time(request.args.get('end'), now)
+            start = parse_query_time(request.args.get('start'), end - datetime.timedelta(hours=1))
+            zoom = float(request.args.get('zoom', 18))
+            precision = int(request.args.get('precision', 6))
+        except ValueError:
+            return jsonify({'error': 'Invalid start, end, zoom or precision'}), 400
+        method = request.args.get('method', 'dp')
+        if method not in SIMPLIFIERS:
+            return jsonify({'error': f'Unknown method, use one of {sorted(SIMPLIFIERS)}'}), 400
+        if start >= end or end - start > datetime.timedelta(hours=TRAJECTORY_MAX_RANGE_HOURS):
+            return jsonify({'error': f'Range must be positive and at most {TRAJECTORY_MAX_RANGE_HOURS} hours'}), 400
+        if not 5 <= precision <= 7:
+            return jsonify({'error': 'Precision must be between 5 and 7'}), 400
+        
+        user_email = current_user['email']
+        # Tolerance is computed at the university center so the key does not depend on the data
+        university = store.get_university(user_email)
+        latitude = university['center']['lat'] if university else 0
+        tolerance = round(zoom_tolerance(zoom, latitude, TRAJECTORY_TOLERANCE_PX), 2)
+        
+        # Only the owning worker sees every appended fix, so only it can key on versions
+        cacheable = owns_user(user_email)
+        cache_key = (device_id, start, end, tolerance, method, precision,
+                     trajectory_store.versions.get(device_id, 0))
+        result = trajectory_cache.get(cache_key) if cacheable else None
+        if result is None:
+            fixes = trajectory_store.get_range(device_id, start, end)
+            points = SIMPLIFIERS[method]([(lat, lon) for _, lat, lon, _ in fixes], tolerance)
+            result = {
+                'device_id': device_id,
+                'start': start.isoformat(),
+                'end': end.isoformat(),
+                'method': method,
+                'tolerance_m': tolerance,
+                'precision': precision,
+                'original_points': len(fixes),
+                'points': len(points),
+                'first_fix': datetime.datetime.utcfromtimestamp(fixes[0][0] / 1000).isoformat() if fixes else None,
+                'last_fix': datetime.datetime.utcfromtimestamp(fixes[-1][0] / 1000).isoformat() if fixes else None,
+                'polyline': encode_polyline(points, precision)
+            }
+            if cacheable:
+                trajectory_cache.set(cache_key, result)
+        
+        return jsonify(result), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/geofence-events', methods=['GET'])
+@token_required
+def get_geofence_events(current_user):
+    try:
+        device_id = request.args.get('device_id')
+        if device_id and device_id not in current_user.get('devices', []):
+            return jsonify({'error': 'Device not found'}), 404
+        try:
+            since = parse_query_time(request.args.get('since'), None)
+            limit = min(int(request.args.get('limit', 100)), 1000)
+        except ValueError:
+            return jsonify({'error': 'Invalid since or limit'}), 400
+        
+        events = store.get_geofence_events(current_user['email'], device_id, since, limit)
+        return jsonify({
+            'events': [serialize_document(event) for event in events],
+            'count': len(events)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/device-patterns', methods=['GET'])
 @token_required
+@conditional_get('patterns')
 def get_device_patterns(current_user):
     try:
-        user = users_collection.find_one({'email': current_user['email']})
-        if not user:
-            return jsonify({'patterns': {}}), 200
-        
-        device_patterns = {}
-        for device_id in user.get('devices', []):
-            pattern = behavior_analyzer.get_device_pattern(current_user['email'], device_id)
-            if pattern:
-                # Clean up the pattern data
-                pattern.pop('_id', None)
-                
-                # Calculate some statistics
-                if 'section_visits' in pattern:
-                    total_visits = sum(pattern['section_visits'].values())
-                    pattern['section_percentages'] = {
-                        section: (count / total_visits * 100) if total_visits > 0 else 0
-                        for section, count in pattern['section_visits'].items()
-                    }
-                
-                device_patterns[device_id] = pattern
+        # Section and pair statistics come precomputed from the user's rollup
+        rollup = behavior_analyzer.rollups.get(current_user['email'])
+        device_rollups = rollup.get('devices', {})
+        
+        # Pattern writes, and so cache invalidation, only happen on the owning worker
+        device_patterns = behavior_analyzer.get_device_patterns_bulk(
+            current_user['email'], current_user.get('devices', []), use_cache=owns_user(current_user['email'])
+        )
+        # Visits in progress count up to each device's latest fix
+        last_seen = {loc['device_id']: loc.get('timestamp') for loc in store.get_locations(list(device_patterns))}
+        for device_id, pattern in device_patterns.items():
+            pattern.update(behavior_analyzer.section_stats(device_rollups.get(device_id, {}), last_seen.get(device_id)))
+        
+        pairs = {
+            pair: {field: value for field, value in stats.items() if field != 'recent'}
+            for pair, stats in rollup.get('pairs', {}).items()
+        }
         
         return jsonify({
             'patterns': device_patterns,
+            'pairs': pairs,
             'device_count': len(device_patterns)
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def model_registry_metrics():
+    """Scrape-time gauges for the model registry and in-process caches"""
+    snapshot, _ = status_snapshot.get()
+    models = list(user_models.values())
+    return [
+        ('ml_models_loaded', 'Models held in memory by this worker', [({}, len(models))]),
+        ('ml_models_trained_loaded', 'Trained models held in memory', [({}, sum(1 for m in models if m.is_trained))]),
+        ('ml_streaming_models_loaded', 'Streaming detectors held in memory', [({}, len(streaming_models))]),
+        ('ml_calibrated_models_loaded', 'Population model calibrations held in memory', [({}, len(calibrated_models))]),
+        ('ml_models_saved', 'Model files in the models directory', [({}, snapshot['trained_models'])]),
+        ('cache_entries', 'Entries per in-process cache', [
+            ({'cache': 'token'}, len(token_cache)),
+            ({'cache': 'trajectory'}, len(trajectory_cache)),
+            ({'cache': 'patterns'}, len(behavior_analyzer.pattern_cache))
+        ]),
+        ('cache_hits', 'Cache hits since start', [
+            ({'cache': 'token'}, token_cache.hits),
+            ({'cache': 'trajectory'}, trajectory_cache.hits),
+            ({'cache': 'patterns'}, behavior_analyzer.pattern_cache.hits)
+        ]),
+        ('cache_misses', 'Cache misses since start', [
+            ({'cache': 'token'}, token_cache.misses),
+            ({'cache': 'trajectory'}, trajectory_cache.misses),
+            ({'cache': 'patterns'}, behavior_analyzer.pattern_cache.misses)
+        ])
+    ]
+
+REGISTRY.add_collector(model_registry_metrics)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # Per-route and model internals: only served to scrapers holding METRICS_TOKEN
+    if not METRICS_TOKEN:
+        return jsonify({'error': 'Metrics are disabled (set METRICS_TOKEN)'}), 404
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return app.response_class(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/system-status', methods=['GET'])
 @token_required
 def system_status(current_user):
     try:
-        user_count = users_collection.count_documents({})
-        device_count = devices_collection.count_documents({})
-        location_count = locations_collection.count_documents({})
-        behavior_count = behavior_analyzer.behavior_collection.count_documents({})
-        
-        # Count trained models
-        models_dir = 'models'
-        trained_models = 0
-        if os.path.exists(models_dir):
-            trained_models = len([f for f in os.listdir(models_dir) if f.endswith('.pkl')])
+        snapshot, age = status_snapshot.get()
+        counts = snapshot['counts']
+        # Exact counts scan every collection, only on explicit request
+        exact = request.args.get('exact') == '1'
+        if exact:
+            counts = status_snapshot.exact_counts()
         
         return jsonify({
             'status': 'online',
-            'users': user_count,
-            'devices': device_count,
-            'active_locations': location_count,
-            'behavior_records': behavior_count,
-            'trained_ml_models': trained_models,
+            'users': counts['users'],
+            'devices': counts['devices'],
+            'active_locations': counts['locations'],
+            'behavior_records': counts['device_behaviors'],
+            'counts_exact': exact,
+            'snapshot_age_seconds': round(age, 1),
+            'trained_ml_models': snapshot['trained_models'],
             'active_ml_models': len(user_models),
+            'process_counters': status_snapshot.counters(),
+            'password_pool': password_hasher.stats(),
             'timestamp': datetime.datetime.utcnow().isoformat()
         }), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-if __name__ == '__main__':
+def parse_profile_args(args):
+    """(seconds, interval_ms) from request args or a socket payload"""
+    seconds = float(args.get('seconds', 10))
+    interval_ms = float(args.get('interval_ms', PROFILE_INTERVAL_MS))
+    if seconds <= 0 or interval_ms <= 0:
+        raise ValueError('seconds and interval_ms must be positive')
+    return seconds, interval_ms
+
+@app.route('/api/admin/profile', methods=['GET'])
+@token_required
+@admin_required
+def admin_profile(current_user):
+    """Sample this worker's stacks for ?seconds= and return collapsed stacks"""
+    try:
+        seconds, interval_ms = parse_profile_args(request.args)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid profile arguments: {e}'}), 400
+    idle = request.args.get('idle') == '1'
+    logger.info('sampling profile started', extra={'admin': current_user['email'], 'seconds': seconds,
+                                                   'interval_ms': interval_ms, 'worker': WORKER_ID})
+    try:
+        collapsed = run_blocking(sampling_profiler.profile, seconds, interval_ms, idle)
+    except ProfilerBusy as e:
+        return jsonify({'error': str(e)}), 409
+    response = app.response_class(collapsed, mimetype='text/plain')
+    response.headers['X-Worker-Id'] = str(WORKER_ID)
+    return response
+
+@socketio.on('admin_profile')
+def handle_admin_profile(data):
+    """Socket counterpart of /api/admin/profile; replies with profile_result"""
+    sid = request.sid
+    if not isinstance(data, dict):
+        emit('profile_error', {'error': 'Payload must be an object'})
+        return
+    try:
+        current_user = resolve_token(data.get('token') or '')
+    except Exception:
+        emit('profile_error', {'error': 'Token is invalid'})
+        return
+    if not is_admin(current_user):
+        emit('profile_error', {'error': 'Admin access required'})
+        return
+    try:
+        seconds, interval_ms = parse_profile_args(data)
+    except (TypeError, ValueError) as e:
+        emit('profile_error', {'error': f'Invalid profile arguments: {e}'})
+        return
+    idle = bool(data.get('idle'))
+
+    def run():
+        try:
+            collapsed = run_blocking(sampling_profiler.profile, seconds, interval_ms, idle)
+        except ProfilerBusy as e:
+            socketio.emit('profile_error', {'error': str(e)}, room=sid)
+            return
+        socketio.emit('profile_result', {
+            'worker': WORKER_ID,
+            'seconds': seconds,
+            'interval_ms': interval_ms,
+            'collapsed': collapsed
+        }, room=sid)
+
+    socketio.start_background_task(run)
+    emit('profile_started', {'worker': WORKER_ID, 'seconds': seconds})
+
+@app.route('/api/admin/cprofile', methods=['POST'])
+@token_required
+@admin_required
+def arm_user_profile(current_user):
+    """Profile the next N update_location events of a user with cProfile"""
+    data = request.get_json(silent=True) or {}
+    user_email = data.get('user_email')
+    if not user_email:
+        return jsonify({'error': 'user_email is required'}), 400
+    # Only the owning worker sees the user's events
+    if not owns_user(user_email):
+        return jsonify({'error': 'User is handled by another worker', 'worker': owner_for(user_email)}), 409
+    try:
+        events = user_profiler.arm(user_email, data.get('events', 10))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'events must be an integer'}), 400
+    logger.info('user profile armed', extra={'admin': current_user['email'], 'user_email': user_email,
+                                             'events': events})
+    return jsonify({'user_email': user_email, 'events': events, 'worker': WORKER_ID}), 200
+
+@app.route('/api/admin/cprofile', methods=['GET'])
+@token_required
+@admin_required
+def get_user_profile(current_user):
+    user_email = request.args.get('user_email')
+    if not user_email:
+        return jsonify({'error': 'user_email is required'}), 400
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in ('cumulative', 'tottime', 'calls', 'ncalls'):
+        return jsonify({'error': 'sort must be cumulative, tottime, calls or ncalls'}), 400
+    try:
+        limit = min(int(request.args.get('limit', 40)), 500)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    report = user_profiler.report(user_email, sort, limit)
+    if report is None:
+        return jsonify({'error': 'No profiled events for this user',
+                        'pending_events': user_profiler.armed().get(user_email, 0)}), 404
+    return app.response_class(report, mimetype='text/plain')
+
+def run_dev_server():
+    """Development server with index creation (python app.py)"""
     port = int(os.environ.get('PORT', 5000))
     
     # Create models directory if it doesn't exist
     os.makedirs("models", exist_ok=True)
     
-    print(f"🚀 Starting server on port {port}")
-    print(f"📍 Location validation settings:")
-    print(f"   - High accuracy threshold: < {HIGH_ACCURACY_THRESHOLD}m (anchor points)")
-    print(f"   - Maximum acceptable accuracy: < {MAX_ACCEPTABLE_ACCURACY}m")
-    print(f"   - Maximum position drift: {MAX_POSITION_DRIFT}m (for medium accuracy locations)")
-    print(f"🏛️ University system enabled - 12x12 meter sections")
-    print(f"🤖 ENHANCED ML Anomaly Detection: Active")
-    print(f"   - Training: 5 minutes or 30 samples")
-    print(f"   - Features: Distance, sections, speed, time, patterns")
-    print(f"   - Detection: Pair anomalies + individual device anomalies")
-    print(f"   - Persistence: Models saved to disk")
-    print(f"📂 Models directory: {os.path.abspath('models')}")
+    # The development server manages its own indexes; production runs migrate.py
+    try:
+        store.ensure_indexes()
+    except Exception as e:
+        logger.warning('index creation failed', extra={'error': str(e)})
+    
+    logger.info('starting server', extra={
+        'port': port,
+        'high_accuracy_threshold_m': HIGH_ACCURACY_THRESHOLD,
+        'max_acceptable_accuracy_m': MAX_ACCEPTABLE_ACCURACY,
+        'max_position_drift_m': MAX_POSITION_DRIFT,
+        'models_dir': os.path.abspath('models')
+    })
     
     # Use 0.0.0.0 to bind to all network interfaces
     socketio.run(app, 
@@ -1,23 +1,36 @@
 import math
-from datetime import datetime, timedelta
-import pymongo
-import numpy as np
-from collections import defaultdict
+from datetime import datetime
+
+from caching import TTLCache
+from feature_store import FEATURE_SCHEMA_VERSION, pack_features
+from reservoir import Reservoirs
+from rollups import Rollups, current_sections
+
+PATTERN_FIELDS = {
+    '_id': 0, 'device_id': 1, 'movement_patterns': 1, 'companion_devices': 1,
+    'created_at': 1, 'updated_at': 1
+}
+
+class PairBatch:
+    """Behaviour records of one bulk upload, written by BehaviorAnalyzer.flush_batch"""
+    
+    def __init__(self):
+        self.records = []
+        # device_id -> (latitude, longitude, time, speed) of its latest record in the batch
+        self.positions = {}
+        # device_id -> movement pattern entries / companion device ids to apply
+        self.movements = {}
+        self.companions = {}
 
 class BehaviorAnalyzer:
-    def __init__(self, db):
-        self.db = db
-        self.behavior_collection = db.device_behaviors
-        self.training_status_collection = db.training_status
-        self.device_patterns_collection = db.device_patterns
-        
-        # Create indexes
-        try:
-            self.behavior_collection.create_index([('user_email', 1), ('timestamp', 1)])
-            self.training_status_collection.create_index([('user_email', 1)], unique=True)
-            self.device_patterns_collection.create_index([('user_email', 1), ('device_id', 1)])
-        except Exception as e:
-            print(f"Index creation warning: {e}")
+    def __init__(self, store):
+        # Indexes for device_behaviors, training_status and device_patterns
+        # are created by store.ensure_indexes()
+        self.store = store
+        self.rollups = Rollups(store)
+        self.reservoirs = Reservoirs(store)
+        # user_email -> (device ids fetched, {device_id: pattern})
+        self.pattern_cache = TTLCache(maxsize=5000, ttl=300)
     
     def get_section_id(self, section_name):
         """Convert section name to numeric ID"""
@@ -47,10 +60,7 @@ class BehaviorAnalyzer:
     
     def calculate_movement_speed(self, device_id, current_lat, current_lon, current_time):
         """Calculate device movement speed"""
-        last_location = self.behavior_collection.find_one(
-            {'device_id': device_id},
-            sort=[('timestamp', -1)]
-        )
+        last_location = self.store.get_latest_behavior(device_id)
         
         if not last_location:
             return 0
@@ -69,9 +79,29 @@ class BehaviorAnalyzer:
         speed = distance / time_diff  # meters per second
         return speed
     
-    def analyze_device_pair(self, user_email, device1_data, device2_data):
-        """Analyze behavior between two devices"""
-        current_time = datetime.utcnow()
+    def batch_movement_speed(self, batch, device_data, current_time):
+        """Movement speed from the device's previous record in the batch (stored records before that)"""
+        device_id = device_data['device_id']
+        latitude, longitude = device_data['latitude'], device_data['longitude']
+        previous = batch.positions.get(device_id)
+        if previous is None:
+            speed = self.calculate_movement_speed(device_id, latitude, longitude, current_time)
+        elif previous[2] == current_time:
+            # Same fix, another pair
+            speed = previous[3]
+        else:
+            time_diff = (current_time - previous[2]).total_seconds()
+            speed = self.calculate_distance(previous[0], previous[1], latitude, longitude) / time_diff
+        batch.positions[device_id] = (latitude, longitude, current_time, speed)
+        return speed
+    
+    def analyze_device_pair(self, user_email, device1_data, device2_data, current_time=None, batch=None):
+        """Analyze behavior between two devices
+        
+        current_time is the time of the fix (default now). With a PairBatch the
+        record and its pattern updates are collected in it for flush_batch.
+        """
+        current_time = current_time or datetime.utcnow()
         
         # Calculate distance between devices
         distance = self.calculate_distance(
@@ -89,19 +119,23 @@ class BehaviorAnalyzer:
         both_inside = device1_section_id > 0 and device2_section_id > 0
         
         # Calculate movement speeds
-        speed1 = self.calculate_movement_speed(
-            device1_data['device_id'],
-            device1_data['latitude'],
-            device1_data['longitude'],
-            current_time
-        )
-        
-        speed2 = self.calculate_movement_speed(
-            device2_data['device_id'],
-            device2_data['latitude'],
-            device2_data['longitude'],
-            current_time
-        )
+        if batch is None:
+            speed1 = self.calculate_movement_speed(
+                device1_data['device_id'],
+                device1_data['latitude'],
+                device1_data['longitude'],
+                current_time
+            )
+            
+            speed2 = self.calculate_movement_speed(
+                device2_data['device_id'],
+                device2_data['latitude'],
+                device2_data['longitude'],
+                current_time
+            )
+        else:
+            speed1 = self.batch_movement_speed(batch, device1_data, current_time)
+            speed2 = self.batch_movement_speed(batch, device2_data, current_time)
         
         # Time of day and day of week
         time_of_day = current_time.hour
@@ -138,8 +172,25 @@ class BehaviorAnalyzer:
             'device2_lon': device2_data['longitude']
         }
         
+        # Feature vector computed once, read back by training and replay
+        behavior_record['features'] = pack_features(behavior_record)
+        behavior_record['feature_version'] = FEATURE_SCHEMA_VERSION
+        
         # Store behavior record
-        self.behavior_collection.insert_one(behavior_record)
+        if batch is None:
+            self.store.insert_behavior(behavior_record)
+        else:
+            batch.records.append(behavior_record)
+        self.rollups.record_pair_sample(behavior_record)
+        self.reservoirs.add(behavior_record, stored=batch is None)
+        if batch is not None:
+            for device_id, other_id, section_id, speed in (
+                    (device1_data['device_id'], device2_data['device_id'], device1_section_id, speed1),
+                    (device2_data['device_id'], device1_data['device_id'], device2_section_id, speed2)):
+                batch.movements.setdefault(device_id, []).append(
+                    {'speed': speed, 'timestamp': current_time, 'section_id': section_id})
+                batch.companions.setdefault(device_id, set()).add(other_id)
+            return behavior_record
         
         # Update individual device patterns
         self.update_device_pattern(user_email, device1_data['device_id'], {
@@ -164,113 +215,134 @@ class BehaviorAnalyzer:
         
         return behavior_record
     
+    def pattern_update(self, movements, companions=()):
+        """Device pattern update appending movement entries and companion devices"""
+        # Section visits are counted per transition in record_section_events,
+        # the per-fix path only appends movement and companion data.
+        now = datetime.utcnow()
+        update = {
+            '$push': {'movement_patterns': {
+                '$each': movements,
+                # Keep only last 100 movement patterns
+                '$slice': -100
+            }},
+            '$set': {'updated_at': now},
+            '$setOnInsert': {'created_at': now}
+        }
+        if companions:
+            update['$addToSet'] = {'companion_devices': {'$each': sorted(companions)}}
+        return update
+    
     def update_device_pattern(self, user_email, device_id, data):
         """Update individual device behavior patterns"""
-        # Get existing pattern or create new
-        pattern = self.device_patterns_collection.find_one({
-            'user_email': user_email,
-            'device_id': device_id
+        update = self.pattern_update(
+            [{'speed': data['speed'], 'timestamp': data['timestamp'], 'section_id': data['section_id']}],
+            [data['with_other_device']] if 'with_other_device' in data else ()
+        )
+        self.store.upsert_device_pattern(user_email, device_id, update)
+        self.pattern_cache.pop(user_email)
+    
+    def flush_batch(self, user_email, batch):
+        """Insert a PairBatch's records and apply its pattern updates in one write each"""
+        if not batch.records:
+            return
+        self.store.insert_behaviors(batch.records)
+        self.store.upsert_device_patterns(user_email, {
+            device_id: self.pattern_update(movements, batch.companions.get(device_id, ()))
+            for device_id, movements in batch.movements.items()
         })
-        
-        if not pattern:
-            pattern = {
+        self.pattern_cache.pop(user_email)
+    
+    def record_section_events(self, user_email, events):
+        """Append geofence events to the event log and fold them into device patterns"""
+        if not events:
+            return []
+        records = []
+        for event in events:
+            record = {
                 'user_email': user_email,
-                'device_id': device_id,
-                'section_visits': defaultdict(int),
-                'typical_sections': [],
-                'movement_patterns': [],
-                'companion_devices': [],
-                'created_at': datetime.utcnow(),
-                'updated_at': datetime.utcnow()
+                'device_id': event['device_id'],
+                'type': event['type'],
+                'section_id': self.get_section_id(event['section']),
+                'timestamp': event['timestamp']
             }
+            if 'duration' in event:
+                record['duration'] = round(event['duration'], 1)
+            records.append(record)
+        self.store.insert_geofence_events(records)
+        self.rollups.record_section_events(user_email, records)
+        return records
+    
+    def section_stats(self, device_rollup, last_seen=None):
+        """Section visit/dwell statistics of a device from its rollup entry
         
-        # Update section visits
-        section_id = data['section_id']
-        pattern['section_visits'][str(section_id)] += 1
-        
-        # Update companion devices
-        if 'with_other_device' in data:
-            if data['with_other_device'] not in pattern['companion_devices']:
-                pattern['companion_devices'].append(data['with_other_device'])
-        
-        # Update movement patterns
-        movement_entry = {
-            'speed': data['speed'],
-            'timestamp': data['timestamp'],
-            'section_id': section_id
+        A visit still in progress counts up to last_seen, the device's latest fix.
+        """
+        sections = current_sections(device_rollup, last_seen)
+        visits = {section: stats['visits'] for section, stats in sections.items() if stats.get('visits')}
+        total_visits = sum(visits.values())
+        typical = sorted(visits.items(), key=lambda x: x[1], reverse=True)[:3]
+        hourly_dwell = {}
+        for stats in sections.values():
+            for hour, seconds in stats.get('hourly_dwell', {}).items():
+                hourly_dwell[hour] = hourly_dwell.get(hour, 0) + seconds
+        return {
+            'section_visits': visits,
+            'section_percentages': {
+                section: (count / total_visits * 100) if total_visits > 0 else 0
+                for section, count in visits.items()
+            },
+            'section_dwell_seconds': {section: stats['dwell'] for section, stats in sections.items() if 'dwell' in stats},
+            'section_hourly_dwell_seconds': {
+                section: stats['hourly_dwell'] for section, stats in sections.items() if 'hourly_dwell' in stats
+            },
+            'hourly_dwell_seconds': hourly_dwell,
+            # Most visited campus sections
+            'typical_sections': [int(s[0]) for s in typical if int(s[0]) > 0]
         }
-        pattern['movement_patterns'].append(movement_entry)
-        
-        # Keep only last 100 movement patterns
-        if len(pattern['movement_patterns']) > 100:
-            pattern['movement_patterns'] = pattern['movement_patterns'][-100:]
-        
-        # Update timestamp
-        pattern['updated_at'] = datetime.utcnow()
-        
-        # Calculate typical sections (most visited)
-        if len(pattern['section_visits']) > 0:
-            typical = sorted(pattern['section_visits'].items(), key=lambda x: x[1], reverse=True)[:3]
-            pattern['typical_sections'] = [int(s[0]) for s in typical if int(s[0]) > 0]
-        
-        # Save/update pattern
-        self.device_patterns_collection.update_one(
-            {'user_email': user_email, 'device_id': device_id},
-            {'$set': pattern},
-            upsert=True
-        )
     
     def get_device_pattern(self, user_email, device_id):
         """Get behavior pattern for specific device"""
-        return self.device_patterns_collection.find_one({
-            'user_email': user_email,
-            'device_id': device_id
-        })
+        pattern = self.store.get_device_pattern(user_email, device_id)
+        if pattern:
+            device_rollup = self.rollups.get(user_email).get('devices', {}).get(device_id, {})
+            location = self.store.get_location(device_id)
+            pattern.update(self.section_stats(device_rollup, location.get('timestamp') if location else None))
+        return pattern
     
-    def get_training_data(self, user_email, limit=500):
-        """Get all behavior data for training"""
-        behavior_data = list(self.behavior_collection.find(
-            {'user_email': user_email},
-            {'_id': 0}
-        ).sort('timestamp', -1).limit(limit))
+    def get_device_patterns_bulk(self, user_email, device_ids, use_cache=True):
+        """Patterns of several devices in one query, cached until a pattern update
         
-        # Return in chronological order
-        behavior_data.reverse()
-        return behavior_data
+        Only the process writing a user's patterns invalidates the cache, other
+        processes pass use_cache=False.
+        """
+        cached = self.pattern_cache.get(user_email) if use_cache else None
+        if cached is None or not cached[0].issuperset(device_ids):
+            patterns = {
+                pattern['device_id']: pattern
+                for pattern in self.store.get_device_patterns(user_email, list(device_ids), PATTERN_FIELDS)
+            }
+            cached = (frozenset(device_ids), patterns)
+            if use_cache:
+                self.pattern_cache.set(user_email, cached)
+        # Callers decorate the documents, hand out copies
+        return {device_id: dict(cached[1][device_id]) for device_id in device_ids if device_id in cached[1]}
+    
+    def get_training_features(self, user_email, limit=500):
+        """Feature matrix of the user's training sample"""
+        # Day/hour-stratified sample kept at ingest instead of the latest records
+        return self.reservoirs.features(user_email, limit)
     
     def get_training_status(self, user_email):
         """Get training status for user"""
-        status = self.training_status_collection.find_one({'user_email': user_email})
+        status = self.store.get_training_status(user_email)
         return status
     
     def update_training_status(self, user_email, status_data):
         """Update training status"""
-        self.training_status_collection.update_one(
-            {'user_email': user_email},
-            {'$set': status_data},
-            upsert=True
-        )
+        self.store.update_training_status(user_email, status_data)
     
     def get_recent_behavior_summary(self, user_email, minutes=10):
         """Get summary of recent device behavior"""
-        cutoff_time = datetime.utcnow() - timedelta(minutes=minutes)
-        
-        pipeline = [
-            {'$match': {
-                'user_email': user_email,
-                'timestamp': {'$gte': cutoff_time}
-            }},
-            {'$group': {
-                '_id': {
-                    'device1': '$device1_id',
-                    'device2': '$device2_id'
-                },
-                'avg_distance': {'$avg': '$distance_between_devices'},
-                'same_section_count': {'$sum': '$same_section'},
-                'moving_together_count': {'$sum': '$moving_together'},
-                'total_samples': {'$sum': 1}
-            }}
-        ]
-        
-        results = list(self.behavior_collection.aggregate(pipeline))
-        return results
\ No newline at end of file
+        # Served from per-minute pair buckets instead of scanning device_behaviors
+        return self.rollups.recent_pair_summary(user_email, minutes)
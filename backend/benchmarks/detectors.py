@@ -0,0 +1,143 @@
+"""Batch vs streaming detector benchmark on a labelled synthetic stream
+
+Each synthetic user walks between a few usual sections with both devices
+close together; ``--anomaly-rate`` of the records are injected anomalies
+(devices far apart, one off campus, odd hours). The batch model trains once
+on the first ``--train-size`` records as in production and stays frozen; the
+streaming model scores and learns every record. Reported per detector:
+records seen before it can alert, per-record cost (scoring plus learning for
+the streaming model), snapshot size, alert rate and precision/recall on the
+injected anomalies. After ``--drift-at`` the user's routine moves to other
+sections, which the frozen batch model never learns.
+
+    python -m benchmarks.detectors
+    python -m benchmarks.detectors --users 5 --records 5000 --drift-at 2500
+"""
+import argparse
+import datetime
+import os
+import pickle
+import random
+import statistics
+import sys
+import time
+import warnings
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+
+def make_labelled_stream(count, anomaly_rate, drift_at=None, seed=1):
+    """[(behaviour record, is_injected_anomaly)] in time order"""
+    rng = random.Random(seed)
+    start = datetime.datetime(2026, 1, 5, 8)
+    stream = []
+    for i in range(count):
+        timestamp = start + datetime.timedelta(minutes=i)
+        usual = (1, 2, 4) if drift_at is None or i < drift_at else (3, 5)
+        anomaly = rng.random() < anomaly_rate
+        if anomaly:
+            section1, section2 = rng.choice((0, rng.randint(1, 6))), rng.randint(0, 6)
+            distance = abs(rng.gauss(250, 150))
+            speed1, speed2 = abs(rng.gauss(2.5, 2)), abs(rng.gauss(0.3, 0.5))
+            hour = rng.choice((1, 2, 3, 22, 23))
+        else:
+            section1 = rng.choice(usual)
+            section2 = section1 if rng.random() < 0.85 else rng.choice(usual)
+            distance = abs(rng.gauss(4, 2))
+            speed1 = abs(rng.gauss(0.4, 0.2))
+            speed2 = abs(speed1 + rng.gauss(0, 0.1))
+            hour = rng.choice((9, 10, 11, 13, 14, 15))
+        stream.append(({
+            'distance_between_devices': distance,
+            'device1_section_id': section1,
+            'device2_section_id': section2,
+            'both_inside_campus': 1 if section1 and section2 else 0,
+            'movement_speed_device1': speed1,
+            'movement_speed_device2': speed2,
+            'time_of_day': hour,
+            'day_of_week': timestamp.weekday(),
+            'same_section': 1 if section1 == section2 else 0,
+            'device1_outside': 1 if section1 == 0 else 0,
+            'device2_outside': 1 if section2 == 0 else 0,
+            'moving_together': 1 if abs(speed1 - speed2) < 0.3 else 0,
+            'section_difference': abs(section1 - section2),
+            'timestamp': timestamp
+        }, anomaly))
+    return stream
+
+
+def evaluate(model, stream, train_size=None):
+    """Run one detector over the stream; train_size trains a batch model first"""
+    start = 0
+    if train_size:
+        model.train_model([record for record, _ in stream[:train_size]])
+        start = train_size
+    timings = []
+    hits = misses = false_alarms = alerts = scored = 0
+    first_scored = None
+    for index, (record, injected) in enumerate(stream[start:], start):
+        started = time.perf_counter()
+        is_anomaly, _, _, details = model.predict_anomaly(record)
+        timings.append(time.perf_counter() - started)
+        if not details:
+            continue
+        if first_scored is None:
+            first_scored = index
+        scored += 1
+        alerts += bool(is_anomaly)
+        if injected:
+            hits += bool(is_anomaly)
+            misses += not is_anomaly
+        elif is_anomaly:
+            false_alarms += 1
+    return {
+        'first_scored': first_scored,
+        'median_us': statistics.median(timings) * 1e6,
+        'p99_us': sorted(timings)[int(len(timings) * 0.99)] * 1e6,
+        'snapshot_bytes': len(pickle.dumps(model.detector if hasattr(model, 'detector') else
+                                           (model.model, model.scaler, model.kmeans, model.cascade))),
+        'alert_rate': alerts / scored if scored else 0.0,
+        'precision': hits / (hits + false_alarms) if hits + false_alarms else 0.0,
+        'recall': hits / (hits + misses) if hits + misses else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=3)
+    parser.add_argument('--records', type=int, default=3000)
+    parser.add_argument('--anomaly-rate', type=float, default=0.03)
+    parser.add_argument('--drift-at', type=int, default=None, help='record index where the routine changes')
+    parser.add_argument('--train-size', type=int, default=200)
+    args = parser.parse_args()
+
+    from ml_model import DeviceBehaviorModel
+    from streaming_model import StreamingBehaviorModel
+
+    detectors = {
+        'batch': lambda email: (DeviceBehaviorModel(email), args.train_size),
+        'streaming': lambda email: (StreamingBehaviorModel(email, seed=1), None)
+    }
+    results = {name: [] for name in detectors}
+    for user in range(args.users):
+        stream = make_labelled_stream(args.records, args.anomaly_rate, args.drift_at, seed=user)
+        for name, build in detectors.items():
+            model, train_size = build(f'bench{user}@example.com')
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', FutureWarning)
+                results[name].append(evaluate(model, stream, train_size))
+
+    print(f"{'detector':>10} {'first':>6} {'median us':>10} {'p99 us':>9} {'snapshot':>10} "
+          f"{'alerts':>7} {'precision':>9} {'recall':>7}")
+    for name, runs in results.items():
+        def mean(key):
+            return statistics.mean(run[key] for run in runs)
+        print(f"{name:>10} {mean('first_scored'):>6.0f} {mean('median_us'):>10.0f} {mean('p99_us'):>9.0f} "
+              f"{mean('snapshot_bytes') / 1024:>8.0f}KB {mean('alert_rate') * 100:>6.1f}% "
+              f"{mean('precision'):>9.2f} {mean('recall'):>7.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Compare the threading, eventlet and gevent engines on one worker
+
+For every mode the worker is started with that ASYNC_MODE, loaded with idle
+dashboard connections and then driven by a few active devices, reporting how
+many connections it accepted and the ingest latency under that load. Point
+MONGO_URI at a scratch mongod (users are seeded into its tracker_db) and raise
+``ulimit -n`` above the idle connection count.
+
+    python -m benchmarks.engine_modes --idle 2000 --users 100 --duration 20
+"""
+import argparse
+import os
+
+import pymongo
+
+from benchmarks.harness import (
+    IdleConnectionPool, drive, seed_users, start_workers, stop_processes, summarize_latencies
+)
+from engine import ASYNC_MODES
+
+
+def run_mode(mode, users, args):
+    workers, urls = start_workers(1, args.port, env={'ASYNC_MODE': mode})
+    idle = IdleConnectionPool(urls[0])
+    try:
+        connected = idle.open(args.idle)
+        result = drive(urls[0], users, args.duration, args.connections)
+        still_connected = len(idle.connections)
+    finally:
+        idle.close()
+        stop_processes(workers)
+
+    return {
+        'mode': mode,
+        'idle_connected': connected,
+        'idle_failed': idle.failures,
+        'idle_kept': still_connected,
+        'fixes_per_sec': result['fixes'] / args.duration,
+        'timeouts': result['timeouts'],
+        **summarize_latencies(result['latencies'])
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', default=','.join(ASYNC_MODES))
+    parser.add_argument('--idle', type=int, default=500, help='idle connections to hold open')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--connections', type=int, default=8, help='active driving connections')
+    parser.add_argument('--port', type=int, default=5150)
+    args = parser.parse_args()
+
+    db = pymongo.MongoClient(os.getenv('MONGO_URI')).tracker_db
+    users = seed_users(db, args.users)
+
+    rows = [run_mode(mode, users, args) for mode in args.modes.split(',')]
+
+    print(f"{'mode':>10} {'idle ok':>8} {'failed':>7} {'kept':>6} {'fixes/s':>9} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'timeouts':>8}")
+    for row in rows:
+        print(f"{row['mode']:>10} {row['idle_connected']:>8} {row['idle_failed']:>7} {row['idle_kept']:>6} "
+              f"{row['fixes_per_sec']:>9.1f} {row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} "
+              f"{row['p99_ms']:>8.1f} {row['timeouts']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+"""Shared pieces for the backend load tests: worker processes, seeding and socket drivers"""
+import os
+import random
+import select
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import requests
+import socketio
+import websocket
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def start_process(args, env=None):
+    """Start a backend process from the backend directory"""
+    full_env = dict(os.environ)
+    full_env.update(env or {})
+    return subprocess.Popen(
+        [sys.executable] + args,
+        cwd=BACKEND_DIR,
+        env=full_env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+
+def stop_processes(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def wait_for_http(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=2).status_code < 500:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def start_workers(count, base_port=5100, message_queue=None, env=None):
+    """Start count app workers sharing one message queue, return (processes, urls)"""
+    urls = [f"http://127.0.0.1:{base_port + i}" for i in range(count)]
+    processes = []
+    for i, url in enumerate(urls):
+        worker_env = {
+            'CORS_ORIGINS': '*',
+            'PORT': str(base_port + i),
+            'WORKER_ID': url,
+            'WORKER_NODES': ','.join(urls)
+        }
+        if message_queue:
+            worker_env['SOCKETIO_MESSAGE_QUEUE'] = message_queue
+        worker_env.update(env or {})
+        processes.append(start_process(['wsgi.py'], worker_env))
+    for url in urls:
+        wait_for_http(url + '/')
+    return processes, urls
+
+
+def seed_users(db, count, min_devices=2, max_devices=2, center=(6.9271, 79.8612), seed=7):
+    """Insert synthetic users with devices and a university layout, return their descriptors"""
+    from app import generate_university_layout
+
+    rng = random.Random(seed)
+    run_id = uuid.uuid4().hex[:8]
+    sections = generate_university_layout(*center)
+    users = []
+    for i in range(count):
+        email = f"bench-{run_id}-{i}@example.com"
+        devices = [uuid.uuid4().hex + uuid.uuid4().hex for _ in range(rng.randint(min_devices, max_devices))]
+        db.users.insert_one({
+            'email': email,
+            'password': '',
+            'devices': devices,
+            'location_permission': True
+        })
+        db.devices.insert_many([
+            {'device_id': device_id, 'user_email': email, 'device_name': f'Bench {n}',
+             'location_tracking': True, 'current_section': 'Outside Campus'}
+            for n, device_id in enumerate(devices)
+        ])
+        db.university.insert_one({
+            'user_email': email,
+            'center': {'lat': center[0], 'lon': center[1]},
+            'sections': sections
+        })
+        users.append({'email': email, 'devices': devices, 'sections': sections})
+    return users
+
+
+def random_fix(user, device_id, rng):
+    """Return an update_location payload somewhere inside one of the user's sections"""
+    bounds = rng.choice(user['sections'])['bounds']
+    return {
+        'device_id': device_id,
+        'user_email': user['email'],
+        'latitude': rng.uniform(bounds['min_lat'], bounds['max_lat']),
+        'longitude': rng.uniform(bounds['min_lon'], bounds['max_lon']),
+        'accuracy': rng.uniform(1.0, 15.0)
+    }
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize_latencies(latencies):
+    return {
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000
+    }
+
+
+class SocketDriver:
+    """One Socket.IO connection sending fixes closed-loop for a set of users
+
+    A fix counts as ingested once its ``location_update`` broadcast comes back,
+    so the measured latency covers validation, persistence and the room fan-out.
+    """
+
+    def __init__(self, url, users, fix_factory=random_fix, timeout=10, seed=None):
+        self.url = url
+        self.users = users
+        self.fix_factory = fix_factory
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.latencies = []
+        self.timeouts = 0
+        self.rejected = 0
+        self._pending = None
+        self._rejected = False
+        self._acked = threading.Event()
+        self.client = socketio.Client(reconnection=False)
+        self.client.on('location_update', self._on_location_update)
+        self.client.on('location_rejected', self._on_location_rejected)
+
+    def _on_location_update(self, data):
+        if self._pending and data.get('device_id') == self._pending:
+            self._acked.set()
+
+    def _on_location_rejected(self, data):
+        # A rejected fix is answered too, it just never reaches the broadcast
+        if self._pending and data.get('device_id') == self._pending:
+            self._rejected = True
+            self._acked.set()
+
+    def connect(self):
+        self.client.connect(self.url, transports=['websocket'])
+        for user in self.users:
+            self.client.emit('join_room', {'user_email': user['email']})
+
+    def run(self, duration):
+        deadline = time.time() + duration
+        while time.time() < deadline:
+            user = self.rng.choice(self.users)
+            fix = self.fix_factory(user, self.rng.choice(user['devices']), self.rng)
+            self._pending = fix['device_id']
+            self._rejected = False
+            self._acked.clear()
+            sent_at = time.perf_counter()
+            self.client.emit('update_location', fix)
+            if not self._acked.wait(self.timeout):
+                self.timeouts += 1
+            elif self._rejected:
+                self.rejected += 1
+            else:
+                self.latencies.append(time.perf_counter() - sent_at)
+
+    def close(self):
+        self.client.disconnect()
+
+
+def drive(url, users, duration, connections=4, fix_factory=random_fix):
+    """Drive one server with several connections for duration seconds"""
+    if not users:
+        return {'fixes': 0, 'timeouts': 0, 'rejected': 0, 'latencies': []}
+    groups = [users[i::connections] for i in range(connections) if users[i::connections]]
+    drivers = [SocketDriver(url, group, fix_factory, seed=i) for i, group in enumerate(groups)]
+    for driver in drivers:
+        driver.connect()
+    threads = [threading.Thread(target=driver.run, args=(duration,)) for driver in drivers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for driver in drivers:
+        driver.close()
+    latencies = [lat for driver in drivers for lat in driver.latencies]
+    return {
+        'fixes': len(latencies),
+        'timeouts': sum(driver.timeouts for driver in drivers),
+        'rejected': sum(driver.rejected for driver in drivers),
+        'latencies': latencies
+    }
+
+
+class IdleConnectionPool:
+    """Hold many idle Socket.IO connections from a single thread
+
+    Each connection is a raw Engine.IO websocket that completes the Socket.IO
+    handshake and then only answers server pings, which is all a parked
+    dashboard costs the server.
+    """
+
+    def __init__(self, url):
+        self.ws_url = url.replace('http://', 'ws://').replace('https://', 'wss://') + \
+            '/socket.io/?EIO=4&transport=websocket'
+        self.connections = []
+        self.failures = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._answer_pings, daemon=True)
+
+    def open(self, count, timeout=10):
+        for _ in range(count):
+            try:
+                conn = websocket.create_connection(self.ws_url, timeout=timeout)
+                conn.recv()  # Engine.IO open packet
+                conn.send('40')
+                conn.recv()  # Socket.IO connect ack
+                self.connections.append(conn)
+            except (OSError, websocket.WebSocketException):
+                self.failures += 1
+        if not self._thread.is_alive():
+            self._thread.start()
+        return len(self.connections)
+
+    def _answer_pings(self):
+        while not self._stop.is_set():
+            by_socket = {conn.sock: conn for conn in list(self.connections) if conn.sock}
+            if not by_socket:
+                time.sleep(0.5)
+                continue
+            readable, _, _ = select.select(list(by_socket), [], [], 0.5)
+            for sock in readable:
+                conn = by_socket[sock]
+                try:
+                    if conn.recv() == '2':
+                        conn.send('3')
+                except (OSError, websocket.WebSocketException):
+                    self.connections.remove(conn)
+
+    def close(self):
+        self._stop.set()
+        for conn in self.connections:
+            try:
+                conn.close()
+            except (OSError, websocket.WebSocketException):
+                pass
+        self.connections = []
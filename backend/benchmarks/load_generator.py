@@ -0,0 +1,302 @@
+"""End-to-end ingest benchmark with synthetic walking devices
+
+Runs the app in this process (threading engine) on a local port, backed by
+mongomock unless --mongo-uri points at a scratch mongod, seeds users with
+2-10 devices on a generated university layout and drives ``update_location``
+over a few multiplexed Socket.IO connections. Devices walk between sections
+at walking speed; fixes carry log-normal accuracy, matching GPS noise and
+occasional outliers that the validator rejects.
+
+Reports fixes/sec, ingest-to-broadcast latency percentiles, Mongo operations
+per fix (by collection and operation) and the time spent per handler stage.
+
+    python -m benchmarks.load_generator --users 2000 --duration 30
+    python -m benchmarks.load_generator --users 500 --output results.json
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+METERS_PER_DEGREE = 111320
+MONGO_OPS = ('find', 'find_one', 'insert_one', 'insert_many', 'update_one', 'update_many',
+             'delete_one', 'delete_many', 'aggregate', 'count_documents', 'estimated_document_count')
+
+
+class CampusWalkers:
+    """Fix factory: each user walks between sections, devices are carried or parked"""
+
+    def __init__(self, speed=1.4, carried_share=0.6, outlier_rate=0.02, outside_share=0.1):
+        self.speed = speed
+        self.carried_share = carried_share
+        self.outlier_rate = outlier_rate
+        self.outside_share = outside_share
+        self._people = {}
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def _random_point(self, user, rng):
+        if rng.random() < self.outside_share:
+            bounds = user['sections'][0]['bounds']
+            return (bounds['max_lat'] + rng.uniform(10, 30) / METERS_PER_DEGREE,
+                    rng.uniform(bounds['min_lon'], bounds['max_lon']))
+        bounds = rng.choice(user['sections'])['bounds']
+        return (rng.uniform(bounds['min_lat'], bounds['max_lat']),
+                rng.uniform(bounds['min_lon'], bounds['max_lon']))
+
+    def _walk(self, person, rng):
+        now = time.monotonic()
+        remaining = min(now - person['moved_at'], 30) * self.speed
+        person['moved_at'] = now
+        lat, lon = person['position']
+        while remaining > 0:
+            target_lat, target_lon = person['target']
+            dy = (target_lat - lat) * METERS_PER_DEGREE
+            dx = (target_lon - lon) * METERS_PER_DEGREE * math.cos(math.radians(lat))
+            distance = math.hypot(dx, dy)
+            if distance <= remaining:
+                lat, lon = person['target']
+                remaining -= distance
+                person['target'] = self._random_point(person['user'], rng)
+            else:
+                lat += (target_lat - lat) * remaining / distance
+                lon += (target_lon - lon) * remaining / distance
+                remaining = 0
+        person['position'] = (lat, lon)
+        return lat, lon
+
+    def __call__(self, user, device_id, rng):
+        with self._lock:
+            person = self._people.get(user['email'])
+            if person is None:
+                person = {'user': user, 'position': self._random_point(user, rng),
+                          'target': self._random_point(user, rng), 'moved_at': time.monotonic()}
+                self._people[user['email']] = person
+            device = self._devices.get(device_id)
+            if device is None:
+                device = {'carried': device_id == user['devices'][0] or rng.random() < self.carried_share,
+                          'parked_at': self._random_point(user, rng)}
+                self._devices[device_id] = device
+            lat, lon = self._walk(person, rng) if device['carried'] else device['parked_at']
+
+        if rng.random() < self.outlier_rate:
+            accuracy = rng.uniform(60, 150)
+        else:
+            accuracy = min(rng.lognormvariate(math.log(6), 0.6), 45)
+        sigma = accuracy / 2 / METERS_PER_DEGREE
+        return {
+            'device_id': device_id,
+            'user_email': user['email'],
+            'latitude': lat + rng.gauss(0, sigma),
+            'longitude': lon + rng.gauss(0, sigma) / math.cos(math.radians(lat)),
+            'accuracy': accuracy
+        }
+
+
+class OpStats:
+    """Counts and times Mongo calls per (collection, operation)"""
+
+    def __init__(self):
+        self.calls = {}
+        self.seconds = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, elapsed):
+        with self._lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+            self.seconds[key] = self.seconds.get(key, 0.0) + elapsed
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.seconds.clear()
+
+
+class CountingCollection:
+    """Collection proxy recording every driver call in an OpStats"""
+
+    def __init__(self, collection, name, stats):
+        self._collection = collection
+        self._name = name
+        self._stats = stats
+
+    def __getattr__(self, attr):
+        value = getattr(self._collection, attr)
+        if attr not in MONGO_OPS:
+            return value
+
+        def counted(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return value(*args, **kwargs)
+            finally:
+                self._stats.add((self._name, attr), time.perf_counter() - started)
+        return counted
+
+
+def instrument_store(store, stats):
+    for name, value in list(vars(store).items()):
+        if name != 'db' and hasattr(value, 'find_one'):
+            setattr(store, name, CountingCollection(value, name, stats))
+
+
+class StageStats(OpStats):
+    """Wall time per handler stage, keyed by stage name"""
+
+    def wrap(self, stage, func):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - started)
+        return timed
+
+
+def instrument_stages(app_module, stats):
+    """Time the stages of handle_location_update by wrapping what it calls"""
+    for stage, name in (('validate', 'constrain_fix'),
+                        ('analyze', 'analyze_device_behavior'),
+                        ('train_check', 'check_and_train_model')):
+        setattr(app_module, name, stats.wrap(stage, getattr(app_module, name)))
+    for stage, owner, name in (('section', app_module.geofence_engine, 'update'),
+                               ('trajectory', app_module.trajectory_store, 'append'),
+                               ('broadcast', app_module.socketio, 'emit')):
+        setattr(owner, name, stats.wrap(stage, getattr(owner, name)))
+    model_class = app_module.DeviceBehaviorModel
+    model_class.predict_anomaly = stats.wrap('predict', model_class.predict_anomaly)
+
+
+def start_server(app_module, port):
+    thread = threading.Thread(
+        target=app_module.socketio.run, args=(app_module.app,),
+        kwargs={'host': '127.0.0.1', 'port': port, 'allow_unsafe_werkzeug': True, 'log_output': False},
+        daemon=True
+    )
+    thread.start()
+    from benchmarks.harness import wait_for_http
+    wait_for_http(f'http://127.0.0.1:{port}/')
+
+
+def load_app(mongo_uri):
+    """Import the app against mongomock (default) or a real MongoDB"""
+    os.environ['ASYNC_MODE'] = 'threading'
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ['CORS_ORIGINS'] = '*'
+    if mongo_uri:
+        os.environ['MONGO_URI'] = mongo_uri
+    else:
+        try:
+            import mongomock
+        except ImportError:
+            raise SystemExit('mongomock is not installed (Run "pip install -r benchmarks/requirements.txt") '
+                             'or pass --mongo-uri')
+        import pymongo
+        pymongo.MongoClient = mongomock.MongoClient
+    import app as app_module
+    return app_module
+
+
+def report(result):
+    print(f"\n{result['users']} users, {result['devices']} devices, {result['connections']} connections, "
+          f"{result['duration']:.0f}s")
+    print(f"fixes/s {result['fixes_per_sec']:.1f}  accepted {result['fixes']}  rejected {result['rejected']}  "
+          f"timeouts {result['timeouts']}")
+    print(f"latency p50 {result['p50_ms']:.1f} ms  p95 {result['p95_ms']:.1f} ms  p99 {result['p99_ms']:.1f} ms")
+    print(f"\nmongo ops per fix: {result['mongo_ops_per_fix']:.2f}")
+    print(f"{'collection.op':>36} {'ops/fix':>8} {'ms/fix':>8}")
+    for key, row in sorted(result['mongo'].items(), key=lambda item: -item[1]['ops_per_fix']):
+        print(f"{key:>36} {row['ops_per_fix']:>8.2f} {row['ms_per_fix']:>8.3f}")
+    print(f"\n{'stage':>12} {'calls/fix':>10} {'ms/fix':>8}")
+    for stage, row in sorted(result['stages'].items(), key=lambda item: -item[1]['ms_per_fix']):
+        print(f"{stage:>12} {row['calls_per_fix']:>10.2f} {row['ms_per_fix']:>8.3f}")
+    print("(analyze includes train_check and predict; mongo time is spread over the stages)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--min-devices', type=int, default=2)
+    parser.add_argument('--max-devices', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=5, help='seconds driven before measuring')
+    parser.add_argument('--connections', type=int, default=8)
+    parser.add_argument('--port', type=int, default=5300)
+    parser.add_argument('--mongo-uri', help='scratch MongoDB instead of mongomock')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    # Saved models land in a scratch models/ directory
+    os.chdir(tempfile.mkdtemp(prefix='trackbehavior-bench-'))
+    app_module = load_app(args.mongo_uri)
+    from benchmarks.harness import drive, seed_users, summarize_latencies
+
+    users = seed_users(app_module.db, args.users, args.min_devices, args.max_devices, seed=args.seed)
+    op_stats, stage_stats = OpStats(), StageStats()
+    instrument_store(app_module.store, op_stats)
+    instrument_stages(app_module, stage_stats)
+    start_server(app_module, args.port)
+
+    walkers = CampusWalkers()
+    url = f'http://127.0.0.1:{args.port}'
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if args.warmup:
+            drive(url, users, args.warmup, args.connections, walkers)
+        op_stats.reset()
+        stage_stats.reset()
+        run = drive(url, users, args.duration, args.connections, walkers)
+
+    handled = max(run['fixes'] + run['rejected'], 1)
+    result = {
+        'timestamp': datetime.datetime.utcnow().isoformat(),
+        'users': len(users),
+        'devices': sum(len(user['devices']) for user in users),
+        'connections': args.connections,
+        'duration': args.duration,
+        'backend': 'mongodb' if args.mongo_uri else 'mongomock',
+        'fixes': run['fixes'],
+        'rejected': run['rejected'],
+        'timeouts': run['timeouts'],
+        'fixes_per_sec': handled / args.duration,
+        **summarize_latencies(run['latencies']),
+        'mongo_ops_per_fix': sum(op_stats.calls.values()) / handled,
+        'mongo': {
+            f'{collection}.{op}': {
+                'ops_per_fix': op_stats.calls[(collection, op)] / handled,
+                'ms_per_fix': op_stats.seconds[(collection, op)] * 1000 / handled
+            }
+            for collection, op in op_stats.calls
+        },
+        'stages': {
+            stage: {
+                'calls_per_fix': stage_stats.calls[stage] / handled,
+                'ms_per_fix': stage_stats.seconds[stage] * 1000 / handled
+            }
+            for stage in stage_stats.calls
+        }
+    }
+    result['stages']['mongo'] = {
+        'calls_per_fix': result['mongo_ops_per_fix'],
+        'ms_per_fix': sum(op_stats.seconds.values()) * 1000 / handled
+    }
+
+    report(result)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
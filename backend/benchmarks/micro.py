@@ -0,0 +1,299 @@
+"""Micro-benchmarks for the analyzer and model hot paths
+
+Each benchmark is timed with timeit (auto-ranged loop count, best of
+``--repeat`` runs reported as min and median per call). Results are appended
+to ``benchmarks/results/micro.json`` keyed by git commit, and every run is
+compared with the latest run of a different commit (or ``--baseline``);
+benchmarks whose median got slower than ``--threshold`` are flagged.
+Database-backed benchmarks use mongomock.
+
+    python -m benchmarks.micro
+    python -m benchmarks.micro --filter train --repeat 3
+    python -m benchmarks.micro --baseline 1a2b3c4 --fail-on-regression
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import timeit
+import warnings
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+RESULTS_FILE = os.path.join(BACKEND_DIR, 'benchmarks', 'results', 'micro.json')
+CENTER = (6.9271, 79.8612)
+
+BENCHMARKS = []
+
+
+def benchmark(name, large=False):
+    """Register a setup function returning the zero-argument callable to time
+
+    Setups of benchmarks that write may return (callable, reset) instead; reset
+    runs, untimed, before every repeat so each starts from the same data.
+    """
+    def register(setup):
+        BENCHMARKS.append({'name': name, 'setup': setup, 'large': large})
+        return setup
+    return register
+
+
+def make_behavior_records(count, seed=1):
+    rng = random.Random(seed)
+    now = datetime.datetime.utcnow()
+    records = []
+    for i in range(count):
+        section1, section2 = rng.randint(0, 6), rng.randint(0, 6)
+        speed1, speed2 = abs(rng.gauss(0.6, 0.5)), abs(rng.gauss(0.6, 0.5))
+        distance = abs(rng.gauss(8, 6))
+        records.append({
+            'distance_between_devices': distance,
+            'device1_section_id': section1,
+            'device2_section_id': section2,
+            'both_inside_campus': 1 if section1 and section2 else 0,
+            'movement_speed_device1': speed1,
+            'movement_speed_device2': speed2,
+            'time_of_day': rng.randint(7, 19),
+            'day_of_week': rng.randint(0, 6),
+            'same_section': 1 if section1 == section2 else 0,
+            'device1_outside': 1 if section1 == 0 else 0,
+            'device2_outside': 1 if section2 == 0 else 0,
+            'moving_together': 1 if speed1 > 0.5 and speed2 > 0.5 and distance < 50 else 0,
+            'section_difference': abs(section1 - section2),
+            'timestamp': now - datetime.timedelta(seconds=count - i)
+        })
+    return records
+
+
+def app_module():
+    """The app imported against mongomock, shared by the database-backed benchmarks"""
+    from benchmarks.load_generator import load_app
+    return load_app(None)
+
+
+def reset_bench_user(app):
+    """Drop what earlier runs wrote for bench@example.com, so run time does not grow with collection size"""
+    def reset():
+        app.store.device_behaviors.delete_many({'user_email': 'bench@example.com'})
+        app.store.device_patterns.delete_many({'user_email': 'bench@example.com'})
+        app.behavior_analyzer.pattern_cache.pop('bench@example.com')
+    return reset
+
+
+def trained_model(samples):
+    from ml_model import DeviceBehaviorModel
+    model = DeviceBehaviorModel('bench@example.com')
+    model.train_model(make_behavior_records(samples))
+    return model
+
+
+@benchmark('calculate_distance')
+def bench_calculate_distance():
+    app = app_module()
+    return lambda: app.calculate_distance(6.9271, 79.8612, 6.9273, 79.8615)
+
+
+@benchmark('detect_section')
+def bench_detect_section():
+    app = app_module()
+    sections = app.generate_university_layout(*CENTER)
+    # Outside campus: the worst case scans every section
+    return lambda: app.detect_section(CENTER[0] + 0.01, CENTER[1], sections)
+
+
+@benchmark('validate_and_constrain_location')
+def bench_validate():
+    app = app_module()
+    device_id = 'bench-validate'
+    app.store.upsert_location(device_id, {
+        'latitude': CENTER[0], 'longitude': CENTER[1], 'accuracy': 2.0,
+        'best_latitude': CENTER[0], 'best_longitude': CENTER[1], 'best_accuracy': 2.0
+    })
+    return lambda: app.validate_and_constrain_location(device_id, CENTER[0] + 0.00002, CENTER[1], 8.0)
+
+
+@benchmark('analyze_device_pair')
+def bench_analyze_device_pair():
+    app = app_module()
+    device1 = {'device_id': 'bench-d1', 'latitude': CENTER[0], 'longitude': CENTER[1],
+               'current_section': 'Library'}
+    device2 = {'device_id': 'bench-d2', 'latitude': CENTER[0] + 0.00005, 'longitude': CENTER[1],
+               'current_section': 'Canteen'}
+    return (lambda: app.behavior_analyzer.analyze_device_pair('bench@example.com', device1, device2),
+            reset_bench_user(app))
+
+
+@benchmark('update_device_pattern')
+def bench_update_device_pattern():
+    app = app_module()
+    data = {'section_id': 2, 'speed': 0.8, 'timestamp': datetime.datetime.utcnow(),
+            'latitude': CENTER[0], 'longitude': CENTER[1], 'with_other_device': 'bench-d2',
+            'distance_to_other': 4.0}
+    return (lambda: app.behavior_analyzer.update_device_pattern('bench@example.com', 'bench-d1', data),
+            reset_bench_user(app))
+
+
+@benchmark('extract_features[500]')
+def bench_extract_features():
+    from ml_model import DeviceBehaviorModel
+    model = DeviceBehaviorModel('bench@example.com')
+    records = make_behavior_records(500)
+    return lambda: model.extract_features(records)
+
+
+def bench_train(samples):
+    def setup():
+        from ml_model import DeviceBehaviorModel
+        records = make_behavior_records(samples)
+        return lambda: DeviceBehaviorModel('bench@example.com').train_model(records)
+    return setup
+
+
+benchmark('train_model[30]')(bench_train(30))
+benchmark('train_model[500]')(bench_train(500))
+benchmark('train_model[10000]', large=True)(bench_train(10000))
+
+
+@benchmark('predict_anomaly')
+def bench_predict_anomaly():
+    model = trained_model(500)
+    record = make_behavior_records(1, seed=2)[0]
+    return lambda: model.predict_anomaly(record)
+
+
+@benchmark('save_model')
+def bench_save_model():
+    model = trained_model(500)
+    path = os.path.join(tempfile.mkdtemp(prefix='trackbehavior-micro-'), 'model.pkl')
+    return lambda: model.save_model(path)
+
+
+@benchmark('load_model')
+def bench_load_model():
+    from ml_model import DeviceBehaviorModel
+    path = os.path.join(tempfile.mkdtemp(prefix='trackbehavior-micro-'), 'model.pkl')
+    trained_model(500).save_model(path)
+    model = DeviceBehaviorModel('bench@example.com')
+    return lambda: model.load_model(path)
+
+
+def time_call(func, repeat, reset=None):
+    timer = timeit.Timer(func)
+    if reset is None:
+        number, _ = timer.autorange()
+        runs = [elapsed / number for elapsed in timer.repeat(repeat=repeat, number=number)]
+    else:
+        reset()
+        number, _ = timer.autorange()
+        runs = []
+        for _ in range(repeat):
+            reset()
+            runs.append(timer.timeit(number) / number)
+    return {'median_s': statistics.median(runs), 'min_s': min(runs), 'number': number, 'repeat': repeat}
+
+
+def git_revision():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                         text=True, stderr=subprocess.DEVNULL).strip()
+        dirty = bool(subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                             cwd=BACKEND_DIR, text=True).strip())
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return commit, dirty
+
+
+def load_history():
+    if not os.path.exists(RESULTS_FILE):
+        return []
+    with open(RESULTS_FILE) as f:
+        return json.load(f)
+
+
+def save_history(history):
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    with open(RESULTS_FILE, 'w') as f:
+        json.dump(history, f, indent=1)
+
+
+def find_baseline(history, commit, baseline=None):
+    for run in reversed(history):
+        if baseline is not None:
+            if run['commit'].startswith(baseline):
+                return run
+        elif run['commit'] != commit:
+            return run
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--filter', help='only run benchmarks whose name contains this')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--quick', action='store_true', help='skip the large training benchmark')
+    parser.add_argument('--threshold', type=float, default=0.10, help='relative slowdown flagged as regression')
+    parser.add_argument('--baseline', help='commit to compare with (default: latest other commit)')
+    parser.add_argument('--no-save', action='store_true')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='trackbehavior-micro-'))
+    commit, dirty = git_revision()
+    results = {}
+    for bench in BENCHMARKS:
+        if args.filter and args.filter not in bench['name']:
+            continue
+        if args.quick and bench['large']:
+            continue
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), \
+                warnings.catch_warnings():
+            warnings.simplefilter('ignore', FutureWarning)
+            func = bench['setup']()
+            reset = None
+            if isinstance(func, tuple):
+                func, reset = func
+            results[bench['name']] = time_call(func, args.repeat, reset)
+        print(f"{bench['name']:>32}  {results[bench['name']]['median_s'] * 1e6:>12.1f} us", flush=True)
+
+    history = load_history()
+    baseline = find_baseline(history, commit, args.baseline)
+    regressions = []
+    if baseline:
+        print(f"\ncompared with {baseline['commit']} ({baseline['timestamp']}):")
+        for name, result in results.items():
+            previous = baseline['results'].get(name)
+            if not previous:
+                continue
+            change = result['median_s'] / previous['median_s'] - 1
+            flag = ''
+            if change > args.threshold:
+                flag = '  REGRESSION'
+                regressions.append(name)
+            print(f"{name:>32}  {change * 100:>+8.1f}%{flag}")
+
+    if not args.no_save:
+        history.append({
+            'commit': commit,
+            'dirty': dirty,
+            'timestamp': datetime.datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'results': results
+        })
+        save_history(history)
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Startup-time benchmark for the app import and the first model use
+
+Every measurement runs in a fresh interpreter (``--runs`` times, median and
+max reported):
+
+    import_app      importing app.py (Flask, Socket.IO, pymongo, no ML stack)
+    preload_ml      ml_model.preload(), the numpy/sklearn import a preloading
+                    master pays once before forking
+    first_predict   loading a saved model and scoring one record, as the
+                    first fix of a trained user does in a cold worker
+    preload_models  app.preload_models() over --models saved models
+
+Uses mongomock unless ``--mongo-uri`` is given. ``--importtime`` also prints
+the slowest modules app.py imports, from ``python -X importtime``.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --runs 10 --models 200 --importtime
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import warnings
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+# Runs in the child: patch the Mongo client, then time the given statements
+CHILD_PRELUDE = """
+import json, os, sys, time, warnings
+warnings.simplefilter('ignore')
+sys.path.insert(0, {backend!r})
+os.environ['ASYNC_MODE'] = 'threading'
+os.environ['LOG_LEVEL'] = 'OFF'
+if {mongo_uri!r}:
+    os.environ['MONGO_URI'] = {mongo_uri!r}
+else:
+    import mongomock, pymongo
+    pymongo.MongoClient = mongomock.MongoClient
+"""
+
+SCENARIOS = {
+    'import_app': ('', 'import app'),
+    'preload_ml': ('import app, ml_model', 'ml_model.preload()'),
+    'first_predict': (
+        'import app\nfrom benchmarks.micro import make_behavior_records\nrecord = make_behavior_records(1, seed=7)[0]',
+        'model = app.DeviceBehaviorModel("bench0@example.com")\n'
+        'model.load_model("models/bench0@example.com_model.pkl")\n'
+        'model.predict_anomaly(record)'
+    ),
+    'preload_models': ('import app, ml_model\nml_model.preload()', 'app.preload_models()'),
+}
+
+
+def child_source(setup, statement, mongo_uri):
+    timed = '\n'.join('    ' + line for line in statement.splitlines())
+    return (CHILD_PRELUDE.format(backend=BACKEND_DIR, mongo_uri=mongo_uri) + setup + '\n'
+            + 'started = time.perf_counter()\nif True:\n' + timed + '\n'
+            + 'print(json.dumps(time.perf_counter() - started))\n')
+
+
+def run_child(source, workdir):
+    output = subprocess.run([sys.executable, '-c', source], cwd=workdir, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def write_models(workdir, count):
+    """Train one model and save it under count user names"""
+    from benchmarks.micro import make_behavior_records
+    from ml_model import DeviceBehaviorModel
+    model = DeviceBehaviorModel('bench0@example.com')
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)
+        model.train_model(make_behavior_records(200))
+    for i in range(count):
+        model.user_email = f'bench{i}@example.com'
+        model.save_model(os.path.join(workdir, 'models', f'bench{i}@example.com_model.pkl'))
+
+
+def import_times(workdir, top):
+    """Slowest direct imports of app (cumulative microseconds) from -X importtime"""
+    # The client never connects during import, so no mongomock is needed here
+    source = CHILD_PRELUDE.format(backend=BACKEND_DIR, mongo_uri='mongodb://localhost:27017') + 'import app\n'
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', source], cwd=workdir, check=True,
+                            capture_output=True, text=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Two spaces of indentation per nesting level; app itself is level 0
+        if name.startswith('   ') and not name.startswith('     '):
+            rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--models', type=int, default=50, help='saved models for preload_models')
+    parser.add_argument('--mongo-uri', default='')
+    parser.add_argument('--importtime', action='store_true')
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='trackbehavior-startup-')
+    write_models(workdir, max(args.models, 1))
+
+    results = {}
+    for name, (setup, statement) in SCENARIOS.items():
+        source = child_source(setup, statement, args.mongo_uri)
+        samples = [run_child(source, workdir) for _ in range(args.runs)]
+        results[name] = {'median_s': statistics.median(samples), 'max_s': max(samples), 'runs': samples}
+        print(f"{name:>16}  median {results[name]['median_s'] * 1000:>8.1f} ms  "
+              f"max {results[name]['max_s'] * 1000:>8.1f} ms", flush=True)
+
+    if args.importtime:
+        print('\nslowest imports of app.py (cumulative):')
+        for cumulative, module in import_times(workdir, 15):
+            print(f'{cumulative / 1000:>10.1f} ms  {module}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'models': args.models, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Load test for multi-worker scaling over the shared Socket.IO message queue
+
+Starts 1..N app workers behind the local broker, routes every synthetic user to
+its owning worker with the same hash ring the workers use and reports ingest
+throughput per worker count. Point MONGO_URI at a scratch mongod: users are
+seeded into its tracker_db.
+
+    python -m benchmarks.worker_scaling --max-workers 4 --users 400 --duration 20
+"""
+import argparse
+import multiprocessing
+import os
+import time
+import uuid
+
+import pymongo
+
+from benchmarks.harness import (
+    drive, seed_users, start_process, start_workers, stop_processes, summarize_latencies
+)
+from scaling import HashRing
+
+
+def _drive_worker(args):
+    url, users, duration, connections = args
+    return drive(url, users, duration, connections)
+
+
+def run_round(worker_count, users, args):
+    broker_address = f"127.0.0.1:{args.broker_port}"
+    broker_env = {'SOCKETIO_BROKER_AUTHKEY': uuid.uuid4().hex}
+    broker = start_process(['scaling.py', 'broker', broker_address], env=broker_env)
+    time.sleep(1)
+    workers, urls = start_workers(worker_count, args.base_port, f"local://{broker_address}", env=broker_env)
+    try:
+        ring = HashRing(urls)
+        owned = {url: [] for url in urls}
+        for user in users:
+            owned[ring.get_node(user['email'])].append(user)
+
+        jobs = [(url, owned[url], args.duration, args.connections) for url in urls]
+        with multiprocessing.Pool(len(jobs)) as pool:
+            results = pool.map(_drive_worker, jobs)
+    finally:
+        stop_processes(workers + [broker])
+
+    latencies = [lat for result in results for lat in result['latencies']]
+    return {
+        'workers': worker_count,
+        'fixes_per_sec': len(latencies) / args.duration,
+        'timeouts': sum(result['timeouts'] for result in results),
+        **summarize_latencies(latencies)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--connections', type=int, default=4, help='socket connections per worker')
+    parser.add_argument('--base-port', type=int, default=5100)
+    parser.add_argument('--broker-port', type=int, default=6390)
+    args = parser.parse_args()
+
+    db = pymongo.MongoClient(os.getenv('MONGO_URI')).tracker_db
+    users = seed_users(db, args.users)
+
+    rows = []
+    for worker_count in range(1, args.max_workers + 1):
+        rows.append(run_round(worker_count, users, args))
+
+    baseline = rows[0]['fixes_per_sec'] or 1
+    print(f"{'workers':>7} {'fixes/s':>10} {'speedup':>8} {'eff':>6} {'p50 ms':>8} {'p99 ms':>8} {'timeouts':>8}")
+    for row in rows:
+        speedup = row['fixes_per_sec'] / baseline
+        print(f"{row['workers']:>7} {row['fixes_per_sec']:>10.1f} {speedup:>8.2f} "
+              f"{speedup / row['workers']:>6.0%} {row['p50_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['timeouts']:>8}")
+
+
+if __name__ == '__main__':
+    main()
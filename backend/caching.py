@@ -0,0 +1,120 @@
+"""Small in-process caches used by the request handlers, and the ETag change counters"""
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread-safe LRU cache bounded in size whose entries expire after ttl seconds"""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._on_set(key, value)
+            while len(self._data) > self.maxsize:
+                self._remove(next(iter(self._data)))
+
+    def pop(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._data):
+                self._remove(key)
+
+    def __len__(self):
+        return len(self._data)
+
+    def _remove(self, key):
+        _, value = self._data.pop(key)
+        self._on_remove(key, value)
+
+    def _on_set(self, key, value):
+        pass
+
+    def _on_remove(self, key, value):
+        pass
+
+
+class TokenCache(TTLCache):
+    """Verified JWTs mapped to the user document they resolved to"""
+
+    def __init__(self, maxsize=10000, ttl=30):
+        super().__init__(maxsize, ttl)
+        self._tokens_by_email = {}
+
+    def _on_set(self, token, user):
+        self._tokens_by_email.setdefault(user['email'], set()).add(token)
+
+    def _on_remove(self, token, user):
+        tokens = self._tokens_by_email.get(user['email'])
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_email[user['email']]
+
+    def invalidate_user(self, email):
+        """Drop every cached token of a user whose document or devices changed"""
+        with self._lock:
+            for token in list(self._tokens_by_email.get(email, ())):
+                self._remove(token)
+
+
+class ChangeTracker:
+    """Per-user change counters used to version-stamp (ETag) polled responses
+
+    Write paths bump the scopes they touch; a response's ETag is the scope's
+    counter, so an unchanged ETag proves the data behind it has not changed.
+    Counters are kept in MongoDB, so any worker can answer a poll with 304
+    whichever worker made the write.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def bump(self, user_email, *scopes):
+        # A new counters document gets a new epoch, so tags issued before it was lost never match
+        self.store.bump_change_versions(user_email, scopes, uuid.uuid4().hex[:8])
+
+    def version(self, user_email, scope):
+        return (self.store.get_change_versions(user_email) or {}).get(scope, 0)
+
+    def etag(self, user_email, scope, *extra):
+        versions = self.store.get_change_versions(user_email) or {}
+        # The user hash keeps two accounts in one browser from matching each other's tags
+        user_hash = hashlib.sha1(user_email.encode()).hexdigest()[:12]
+        parts = [versions.get('epoch', 'new'), user_hash, scope, str(versions.get(scope, 0))]
+        parts.extend(str(value) for value in extra)
+        return '-'.join(parts)
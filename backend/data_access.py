@@ -0,0 +1,328 @@
+"""Data access layer for the tracker collections.
+
+``MongoStore`` holds every query the app and ``BehaviorAnalyzer`` run against
+MongoDB. A backend only supplies ``_to_list``, how a cursor is materialized;
+``SyncMongoStore`` wraps a pymongo (or mongomock) database and returns plain
+values, ``AsyncMongoStore`` wraps a Motor database and returns awaitables, so
+asyncio code can overlap I/O for many devices with the same method names.
+"""
+import asyncio
+import os
+from abc import ABC, abstractmethod
+
+
+class MongoStore(ABC):
+    """Queries for users, devices, locations, university, device_behaviors,
+    device_patterns, training_status, calibrations, reservoirs, trajectories,
+    geofence_events, rollups and change_versions"""
+
+    def __init__(self, db):
+        self.use_database(db)
+
+    def use_database(self, db):
+        """Point every collection at db (e.g. through a new client after a fork)"""
+        self.db = db
+        self.users = db.users
+        self.devices = db.devices
+        self.locations = db.locations
+        self.university = db.university
+        self.device_behaviors = db.device_behaviors
+        self.device_patterns = db.device_patterns
+        self.training_status = db.training_status
+        self.calibrations = db.calibrations
+        self.reservoirs = db.reservoirs
+        self.trajectories = db.trajectories
+        self.geofence_events = db.geofence_events
+        self.rollups = db.rollups
+        self.change_versions = db.change_versions
+
+    @abstractmethod
+    def _to_list(self, cursor):
+        """Materialize a cursor"""
+
+    def index_specs(self):
+        """Return (collection, keys, options) for every index the app relies on"""
+        return [
+            (self.devices, [('device_id', 1)], {'unique': True}),
+            (self.devices, [('user_email', 1)], {}),
+            (self.devices, [('last_seen', -1)], {}),
+            (self.users, [('email', 1)], {'unique': True}),
+            (self.locations, [('device_id', 1)], {}),
+            (self.locations, [('timestamp', 1)], {}),
+            (self.university, [('user_email', 1)], {'unique': True}),
+            (self.device_behaviors, [('user_email', 1), ('timestamp', 1)], {}),
+            (self.training_status, [('user_email', 1)], {'unique': True}),
+            (self.calibrations, [('user_email', 1)], {'unique': True}),
+            (self.reservoirs, [('user_email', 1)], {'unique': True}),
+            (self.device_patterns, [('user_email', 1), ('device_id', 1)], {}),
+            (self.trajectories, [('device_id', 1), ('hour', 1)], {'unique': True}),
+            (self.geofence_events, [('user_email', 1), ('timestamp', 1)], {}),
+            (self.geofence_events, [('device_id', 1), ('timestamp', 1)], {}),
+            (self.rollups, [('user_email', 1)], {'unique': True}),
+            (self.change_versions, [('user_email', 1)], {'unique': True}),
+        ]
+
+    def ensure_indexes(self):
+        """Create all indexes, returning the driver results"""
+        return [collection.create_index(keys, **options) for collection, keys, options in self.index_specs()]
+
+    def ping(self):
+        return self.db.client.admin.command('ping')
+
+    # Users
+    def get_user(self, email, projection=None):
+        return self.users.find_one({'email': email}, projection)
+
+    def create_user(self, user):
+        return self.users.insert_one(user)
+
+    def update_user(self, email, update):
+        return self.users.update_one({'email': email}, update)
+
+    # Devices
+    def get_device(self, device_id, user_email=None):
+        query = {'device_id': device_id}
+        if user_email is not None:
+            query['user_email'] = user_email
+        return self.devices.find_one(query)
+
+    def get_devices(self, device_ids, projection=None):
+        return self._to_list(self.devices.find({'device_id': {'$in': device_ids}}, projection))
+
+    def create_device(self, device):
+        return self.devices.insert_one(device)
+
+    def update_device(self, device_id, fields):
+        return self.devices.update_one({'device_id': device_id}, {'$set': fields})
+
+    def update_devices(self, fields_by_device):
+        """Bulk update_device: {device_id: fields}"""
+        from pymongo import UpdateOne
+        return self.devices.bulk_write(
+            [UpdateOne({'device_id': device_id}, {'$set': fields}) for device_id, fields in fields_by_device.items()],
+            ordered=False
+        )
+
+    def get_active_users(self, since, limit):
+        """[{_id: user_email, last_seen}] for users with a device seen since, newest first"""
+        return self._to_list(self.devices.aggregate([
+            {'$match': {'last_seen': {'$gte': since}}},
+            {'$group': {'_id': '$user_email', 'last_seen': {'$max': '$last_seen'}}},
+            {'$sort': {'last_seen': -1}},
+            {'$limit': limit}
+        ]))
+
+    # Locations (latest fix per device)
+    def get_location(self, device_id):
+        return self.locations.find_one({'device_id': device_id})
+
+    def get_locations(self, device_ids):
+        return self._to_list(self.locations.find({'device_id': {'$in': device_ids}}))
+
+    def upsert_location(self, device_id, fields):
+        return self.locations.update_one({'device_id': device_id}, {'$set': fields}, upsert=True)
+
+    def upsert_locations(self, fields_by_device):
+        """Bulk upsert_location: {device_id: fields}"""
+        from pymongo import UpdateOne
+        return self.locations.bulk_write(
+            [UpdateOne({'device_id': device_id}, {'$set': fields}, upsert=True)
+             for device_id, fields in fields_by_device.items()],
+            ordered=False
+        )
+
+    # University layout
+    def get_university(self, user_email):
+        return self.university.find_one({'user_email': user_email})
+
+    def create_university(self, university):
+        return self.university.insert_one(university)
+
+    # Behaviour records
+    def insert_behavior(self, record):
+        return self.device_behaviors.insert_one(record)
+
+    def insert_behaviors(self, records):
+        return self.device_behaviors.insert_many(records, ordered=False)
+
+    def get_latest_behavior(self, device_id):
+        return self.device_behaviors.find_one({'device_id': device_id}, sort=[('timestamp', -1)])
+
+    def get_recent_behaviors(self, user_email, limit):
+        """Newest-first behaviour records for a user"""
+        return self._to_list(
+            self.device_behaviors.find({'user_email': user_email}, {'_id': 0})
+            .sort('timestamp', -1).limit(limit)
+        )
+
+    def iter_behaviors(self, user_email, projection=None, batch_size=1000):
+        """Chronological cursor over all of a user's behaviour records (replay)"""
+        return (self.device_behaviors.find({'user_email': user_email}, projection)
+                .sort('timestamp', 1).batch_size(batch_size))
+
+    def iter_stale_feature_behaviors(self, version, projection=None, batch_size=1000):
+        """Behaviour records without a packed feature vector of this version"""
+        return self.device_behaviors.find({'feature_version': {'$ne': version}}, projection).batch_size(batch_size)
+
+    def set_behavior_features(self, updates):
+        """Bulk-set packed feature vectors: [(record _id, fields)]"""
+        from pymongo import UpdateOne
+        return self.device_behaviors.bulk_write(
+            [UpdateOne({'_id': _id}, {'$set': fields}) for _id, fields in updates], ordered=False
+        )
+
+    def get_behavior_users(self):
+        return self.device_behaviors.distinct('user_email')
+
+    # Device patterns
+    def get_device_pattern(self, user_email, device_id):
+        return self.device_patterns.find_one({'user_email': user_email, 'device_id': device_id})
+
+    def get_device_patterns(self, user_email, device_ids, projection=None):
+        return self._to_list(self.device_patterns.find(
+            {'user_email': user_email, 'device_id': {'$in': device_ids}}, projection
+        ))
+
+    def iter_legacy_section_patterns(self):
+        """Patterns still carrying the section counters kept there before rollups"""
+        return self.device_patterns.find(
+            {'$or': [{'section_visits': {'$exists': True}}, {'section_dwell_seconds': {'$exists': True}}]},
+            {'_id': 0, 'user_email': 1, 'device_id': 1, 'section_visits': 1, 'section_dwell_seconds': 1}
+        )
+
+    def upsert_device_pattern(self, user_email, device_id, update):
+        return self.device_patterns.update_one(
+            {'user_email': user_email, 'device_id': device_id}, update, upsert=True
+        )
+
+    def upsert_device_patterns(self, user_email, updates):
+        """Bulk upsert_device_pattern: {device_id: update}"""
+        from pymongo import UpdateOne
+        return self.device_patterns.bulk_write(
+            [UpdateOne({'user_email': user_email, 'device_id': device_id}, update, upsert=True)
+             for device_id, update in updates.items()],
+            ordered=False
+        )
+
+    # Training status
+    def get_training_status(self, user_email):
+        return self.training_status.find_one({'user_email': user_email})
+
+    def get_trained_statuses(self, user_emails, projection=None):
+        return self._to_list(self.training_status.find(
+            {'user_email': {'$in': user_emails}, 'is_trained': True}, projection
+        ))
+
+    def update_training_status(self, user_email, fields):
+        return self.training_status.update_one({'user_email': user_email}, {'$set': fields}, upsert=True)
+
+    # Per-user calibrations of the population model
+    def get_calibration(self, user_email):
+        return self.calibrations.find_one({'user_email': user_email}, {'_id': 0})
+
+    def save_calibration(self, user_email, fields):
+        return self.calibrations.update_one({'user_email': user_email}, {'$set': fields}, upsert=True)
+
+    # Training samples (see reservoir)
+    def get_reservoir(self, user_email):
+        return self.reservoirs.find_one({'user_email': user_email}, {'_id': 0})
+
+    def save_reservoir(self, user_email, fields):
+        return self.reservoirs.update_one({'user_email': user_email}, {'$set': fields}, upsert=True)
+
+    # Trajectory history (see trajectory_store)
+    def push_trajectory_block(self, device_id, user_email, hour, block, count, start, end):
+        return self.trajectories.update_one(
+            {'device_id': device_id, 'hour': hour},
+            {
+                '$push': {'blocks': block},
+                '$inc': {'count': count},
+                '$min': {'start': start},
+                '$max': {'end': end},
+                '$setOnInsert': {'user_email': user_email}
+            },
+            upsert=True
+        )
+
+    def get_trajectory_chunks(self, device_id, start_hour, end):
+        return self._to_list(
+            self.trajectories.find(
+                {'device_id': device_id, 'hour': {'$gte': start_hour, '$lte': end}},
+                {'blocks': 1, '_id': 0}
+            ).sort('hour', 1)
+        )
+
+    # Section transitions (see geofence)
+    def insert_geofence_events(self, events):
+        return self.geofence_events.insert_many(events)
+
+    def get_geofence_events(self, user_email, device_id=None, since=None, limit=100):
+        """Newest-first section events of a user (or one of their devices)"""
+        query = {'user_email': user_email}
+        if device_id is not None:
+            query['device_id'] = device_id
+        if since is not None:
+            query['timestamp'] = {'$gte': since}
+        return self._to_list(self.geofence_events.find(query, {'_id': 0}).sort('timestamp', -1).limit(limit))
+
+    def iter_geofence_events(self, user_email, batch_size=1000):
+        """Oldest-first section events of a user"""
+        cursor = self.geofence_events.find({'user_email': user_email}, {'_id': 0}).sort('timestamp', 1)
+        return cursor.batch_size(batch_size)
+
+    def get_geofence_users(self):
+        return self.geofence_events.distinct('user_email')
+
+    # Rollups (see rollups)
+    def get_rollup(self, user_email):
+        return self.rollups.find_one({'user_email': user_email}, {'_id': 0})
+
+    def update_rollup(self, user_email, update):
+        return self.rollups.update_one({'user_email': user_email}, update, upsert=True)
+
+    # Change counters behind polled ETags (see caching.ChangeTracker)
+    def get_change_versions(self, user_email):
+        return self.change_versions.find_one({'user_email': user_email}, {'_id': 0})
+
+    def bump_change_versions(self, user_email, scopes, epoch):
+        return self.change_versions.update_one(
+            {'user_email': user_email},
+            {'$inc': {scope: 1 for scope in scopes}, '$setOnInsert': {'epoch': epoch}},
+            upsert=True
+        )
+
+    # Counts
+    def count(self, collection_name):
+        return getattr(self, collection_name).count_documents({})
+
+    def estimated_count(self, collection_name):
+        """Collection size from metadata, without scanning"""
+        return getattr(self, collection_name).estimated_document_count()
+
+
+class SyncMongoStore(MongoStore):
+    """Blocking pymongo backend"""
+
+    def _to_list(self, cursor):
+        return list(cursor)
+
+
+class AsyncMongoStore(MongoStore):
+    """Motor backend; every query method returns an awaitable"""
+
+    def _to_list(self, cursor):
+        return cursor.to_list(length=None)
+
+    async def ensure_indexes(self):
+        """Create all indexes concurrently, returning the index names"""
+        return await asyncio.gather(*super().ensure_indexes())
+
+
+def create_async_store(uri=None, database='tracker_db'):
+    """Build an AsyncMongoStore (requires the optional motor package)"""
+    try:
+        from motor.motor_asyncio import AsyncIOMotorClient
+    except ImportError:
+        raise RuntimeError('motor is not installed (Run "pip install motor")') from None
+    client = AsyncIOMotorClient(uri or os.getenv('MONGO_URI'))
+    return AsyncMongoStore(client[database])
@@ -0,0 +1,10 @@
+"""Development server: ``python app.py`` (or ``python dev_server.py``).
+
+The app is only imported under the ``__main__`` guard. Spawned password-pool
+workers re-run the parent's main script as ``__mp_main__`` and must not load
+the app (Mongo client, Socket.IO, ML globals).
+"""
+
+if __name__ == '__main__':
+    from app import run_dev_server
+    run_dev_server()
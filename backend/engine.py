@@ -0,0 +1,60 @@
+"""Realtime engine selection and blocking-call offload.
+
+``ASYNC_MODE`` picks the Socket.IO concurrency backend: ``threading`` (default,
+one OS thread per connection), ``eventlet`` or ``gevent`` (cooperative, for
+production). With a cooperative backend the standard library is monkey
+patched, so pymongo's socket I/O yields to other connections on its own;
+CPU-bound work such as sklearn scoring and model pickling still holds the hub
+and is pushed to a native thread pool through ``run_blocking``.
+"""
+import importlib
+import os
+
+ASYNC_MODE = os.getenv('ASYNC_MODE', 'threading')
+ASYNC_MODES = ('threading', 'eventlet', 'gevent')
+if ASYNC_MODE not in ASYNC_MODES:
+    raise ValueError(f"ASYNC_MODE must be one of {', '.join(ASYNC_MODES)}, got {ASYNC_MODE!r}")
+
+# Native threads available to run_blocking under eventlet/gevent
+BLOCKING_POOL_SIZE = int(os.getenv('BLOCKING_POOL_SIZE', 8))
+
+_patched = False
+
+
+def monkey_patch():
+    """Patch the standard library for the cooperative backend (must run before other imports)"""
+    global _patched
+    if _patched:
+        return
+    if ASYNC_MODE == 'eventlet':
+        os.environ.setdefault('EVENTLET_THREADPOOL_SIZE', str(BLOCKING_POOL_SIZE))
+        import eventlet
+        eventlet.monkey_patch()
+    elif ASYNC_MODE == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+        import gevent
+        gevent.get_hub().threadpool.maxsize = BLOCKING_POOL_SIZE
+    _patched = True
+
+
+def run_blocking(func, *args, **kwargs):
+    """Run func on a native thread pool so it does not stall the event loop"""
+    if ASYNC_MODE == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(func, *args, **kwargs)
+    if ASYNC_MODE == 'gevent':
+        import gevent
+        return gevent.get_hub().threadpool.apply(func, args, kwargs)
+    return func(*args, **kwargs)
+
+
+def native(module, name):
+    """Unpatched standard library attribute (e.g. time.sleep) for native threads"""
+    if ASYNC_MODE == 'eventlet' and _patched:
+        from eventlet import patcher
+        return getattr(patcher.original(module), name)
+    if ASYNC_MODE == 'gevent' and _patched:
+        from gevent import monkey
+        return monkey.get_original(module, name)
+    return getattr(importlib.import_module(module), name)
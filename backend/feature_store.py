@@ -0,0 +1,46 @@
+"""Packed feature vectors stored with behaviour records.
+
+``analyze_device_pair`` computes each record's feature vector once, as
+``N_FEATURES`` little-endian float32 values, and stores the 64 bytes with the
+record as ``features`` together with ``feature_version``. Training,
+calibration, the training reservoir and replay join these and read the batch
+with one ``np.frombuffer`` instead of rebuilding features from BSON fields.
+
+Records without a vector of the current ``FEATURE_SCHEMA_VERSION`` (stored
+before it, or before a change to ``feature_row``) are computed from their
+fields. ``python migrate.py --backfill-features`` packs them in place.
+"""
+import struct
+
+from ml_model import FEATURE_FIELDS, N_FEATURES, feature_row
+
+FEATURE_SCHEMA_VERSION = 1
+ROW = struct.Struct(f'<{N_FEATURES}f')
+# Behaviour record fields needed to read features
+FEATURE_PROJECTION = {'_id': 0, 'features': 1, 'feature_version': 1}
+# ... and to compute them when the packed vector is missing or stale
+FALLBACK_PROJECTION = dict(FEATURE_PROJECTION, **dict.fromkeys(FEATURE_FIELDS, 1))
+
+
+def pack_features(record):
+    return ROW.pack(*feature_row(record))
+
+
+def has_packed_features(record):
+    return record.get('feature_version') == FEATURE_SCHEMA_VERSION and bool(record.get('features'))
+
+
+def packed_features(record):
+    """The record's stored vector if current, else one computed from its fields"""
+    return bytes(record['features']) if has_packed_features(record) else pack_features(record)
+
+
+def features_from_bytes(data):
+    """float32 (rows, N_FEATURES) matrix over concatenated packed vectors"""
+    import numpy as np
+    return np.frombuffer(data, dtype='<f4').reshape(-1, N_FEATURES)
+
+
+def features_from_records(records):
+    """Feature matrix for behaviour records, packed or not"""
+    return features_from_bytes(b''.join(packed_features(record) for record in records))
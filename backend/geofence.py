@@ -0,0 +1,132 @@
+"""Per-device section state machine emitting enter/exit/dwell events.
+
+A raw per-fix section lookup flaps between neighbouring 12 m sections on GPS
+jitter. The engine applies two kinds of hysteresis before it changes a
+device's section:
+
+* a fix still counts as inside the current section while it is within
+  ``GEOFENCE_MARGIN_M`` meters of the section's bounds;
+* a different section must be seen on ``GEOFENCE_CONFIRM_FIXES`` consecutive
+  fixes before the transition is accepted.
+
+A device that stays ``GEOFENCE_DWELL_SECONDS`` in a section gets one dwell
+event for that visit. State is in memory on the worker owning the user, for at
+most ``GEOFENCE_MAX_DEVICES`` devices and dropped after
+``GEOFENCE_IDLE_SECONDS`` without a fix. A device without state resumes from
+its last stored section, or silently adopts the section of its fix: no event
+is emitted for a visit whose start was not observed.
+"""
+import math
+import os
+import threading
+
+from caching import TTLCache
+
+GEOFENCE_MARGIN_M = float(os.getenv('GEOFENCE_MARGIN_M', 2.0))
+GEOFENCE_CONFIRM_FIXES = int(os.getenv('GEOFENCE_CONFIRM_FIXES', 2))
+GEOFENCE_DWELL_SECONDS = float(os.getenv('GEOFENCE_DWELL_SECONDS', 120))
+GEOFENCE_MAX_DEVICES = int(os.getenv('GEOFENCE_MAX_DEVICES', 10000))
+GEOFENCE_IDLE_SECONDS = float(os.getenv('GEOFENCE_IDLE_SECONDS', 6 * 3600))
+
+OUTSIDE = 'Outside Campus'
+METERS_PER_DEGREE = 111320
+
+
+def in_bounds(latitude, longitude, bounds, margin_m=0.0):
+    lat_margin = margin_m / METERS_PER_DEGREE
+    lon_margin = margin_m / (METERS_PER_DEGREE * max(math.cos(math.radians(latitude)), 1e-6))
+    return (bounds['min_lat'] - lat_margin <= latitude <= bounds['max_lat'] + lat_margin and
+            bounds['min_lon'] - lon_margin <= longitude <= bounds['max_lon'] + lon_margin)
+
+
+def raw_section(latitude, longitude, sections):
+    for section in sections:
+        if in_bounds(latitude, longitude, section['bounds']):
+            return section['name']
+    return OUTSIDE
+
+
+class GeofenceEngine:
+    """Tracks the confirmed section of each device and reports transitions"""
+
+    def __init__(self, margin_m=GEOFENCE_MARGIN_M, confirm_fixes=GEOFENCE_CONFIRM_FIXES,
+                 dwell_seconds=GEOFENCE_DWELL_SECONDS, max_devices=GEOFENCE_MAX_DEVICES,
+                 idle_seconds=GEOFENCE_IDLE_SECONDS):
+        self.margin_m = margin_m
+        self.confirm_fixes = confirm_fixes
+        self.dwell_seconds = dwell_seconds
+        self._states = TTLCache(maxsize=max_devices, ttl=idle_seconds)
+        self._lock = threading.Lock()
+
+    def current_section(self, device_id):
+        state = self._states.get(device_id)
+        return state['section'] if state else None
+
+    def forget(self, device_id):
+        with self._lock:
+            self._states.pop(device_id)
+
+    def update(self, device_id, latitude, longitude, timestamp, sections, restore=None):
+        """Feed one fix; return (confirmed section, list of events)
+
+        restore ({'section', 'entered_at', 'dwell_sent'}) is the device's last
+        stored state, used when the engine has none for it.
+        """
+        by_name = {section['name']: section for section in sections}
+        with self._lock:
+            state = self._states.get(device_id)
+            if state is None:
+                if restore and (restore['section'] == OUTSIDE or restore['section'] in by_name):
+                    state = {'section': restore['section'], 'entered_at': restore['entered_at'],
+                             'dwell_sent': restore.get('dwell_sent', False), 'candidate': None,
+                             'candidate_fixes': 0}
+                else:
+                    # Nothing stored: the device was already wherever this fix is
+                    section = raw_section(latitude, longitude, sections)
+                    self._states.set(device_id, {'section': section, 'entered_at': timestamp, 'dwell_sent': False,
+                                                 'candidate': None, 'candidate_fixes': 0})
+                    return section, []
+
+            events = []
+            current = by_name.get(state['section'])
+            if current is not None and in_bounds(latitude, longitude, current['bounds'], self.margin_m):
+                state['candidate'], state['candidate_fixes'] = None, 0
+            else:
+                candidate = raw_section(latitude, longitude, sections)
+                if candidate == state['section']:
+                    state['candidate'], state['candidate_fixes'] = None, 0
+                else:
+                    if candidate == state['candidate']:
+                        state['candidate_fixes'] += 1
+                    else:
+                        state['candidate'], state['candidate_fixes'] = candidate, 1
+                        state['candidate_at'] = timestamp
+                    if state['candidate_fixes'] >= self.confirm_fixes:
+                        # The transition happened at the first fix seen in the new section
+                        events.extend(self._transition(device_id, state, candidate, state['candidate_at']))
+
+            if (state['section'] != OUTSIDE and not state['dwell_sent'] and
+                    (timestamp - state['entered_at']).total_seconds() >= self.dwell_seconds):
+                state['dwell_sent'] = True
+                events.append(self._event('dwell', device_id, state['section'], timestamp,
+                                          (timestamp - state['entered_at']).total_seconds()))
+            # Setting it again renews its idle timeout
+            self._states.set(device_id, state)
+            return state['section'], events
+
+    def _transition(self, device_id, state, section, timestamp):
+        events = []
+        if state['section'] != OUTSIDE:
+            events.append(self._event('exit', device_id, state['section'], timestamp,
+                                      (timestamp - state['entered_at']).total_seconds()))
+        if section != OUTSIDE:
+            events.append(self._event('enter', device_id, section, timestamp))
+        state.update({'section': section, 'entered_at': timestamp, 'dwell_sent': False,
+                      'candidate': None, 'candidate_fixes': 0})
+        return events
+
+    def _event(self, event_type, device_id, section, timestamp, duration=None):
+        event = {'type': event_type, 'device_id': device_id, 'section': section, 'timestamp': timestamp}
+        if duration is not None:
+            event['duration'] = duration
+        return event
@@ -0,0 +1,46 @@
+"""Production gunicorn settings (gunicorn -c gunicorn.conf.py app:app).
+
+With ``preload_app`` the master imports the app, the ML stack and the most
+recently trained models once, then forks: workers start with them in
+copy-on-write memory and a restarted worker is serving again immediately.
+Run ``python migrate.py`` before starting; workers do not create indexes.
+"""
+import gc
+import os
+
+from engine import ASYNC_MODE
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+# Socket.IO needs sticky sessions; scale out with WORKER_NODES instead
+workers = int(os.getenv('WEB_CONCURRENCY', 1))
+if workers > 1:
+    # Forked workers would share one WORKER_ID and one set of in-process user state,
+    # and gunicorn does not keep a client's Socket.IO session on one worker
+    raise SystemExit('Run one gunicorn worker per process (WEB_CONCURRENCY=1); scale out with WORKER_NODES')
+worker_class = {'eventlet': 'eventlet', 'gevent': 'gevent'}.get(ASYNC_MODE, 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', 100)) if worker_class == 'gthread' else 1
+timeout = 120
+preload_app = os.getenv('PRELOAD_APP', '1') == '1'
+
+
+def when_ready(server):
+    """In the master, after the app import and before the first fork"""
+    if not preload_app:
+        return
+    import app
+    import ml_model
+    ml_model.preload()
+    loaded = app.preload_models()
+    app.load_population_model()
+    # Keep preloaded objects out of later collections so their pages stay shared
+    gc.freeze()
+    server.log.info('preloaded ML stack and %d models', loaded)
+
+
+def post_worker_init(worker):
+    """Open the worker's own MongoDB client, then start its background loops and model warm-up"""
+    import app
+    if preload_app:
+        # The client imported in the master must not be shared across the fork
+        app.reopen_mongo_client()
+    app.start_background_tasks()
@@ -0,0 +1,69 @@
+"""Leveled, structured logging for the backend.
+
+``LOG_LEVEL`` sets the level (DEBUG, INFO, WARNING, ERROR; OFF disables all
+logging) and ``LOG_FORMAT`` picks ``text`` (``key=value`` fields) or ``json``
+(one object per line). Fields are passed with ``extra``::
+
+    logger.info('location rejected', extra={'device_id': device_id, 'reason': reason})
+
+Per-fix messages are DEBUG, so at the default INFO level they cost a level
+check and nothing else.
+"""
+import json
+import logging
+import os
+import sys
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def _fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _RESERVED}
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = _fields(record)
+        if fields:
+            line += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        entry.update(_fields(record))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+_configured = False
+
+
+def configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT):
+    """Install the root handler once"""
+    global _configured
+    if _configured:
+        return
+    _configured = True
+    if level == 'OFF':
+        logging.disable(logging.CRITICAL)
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
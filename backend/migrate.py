@@ -0,0 +1,135 @@
+"""One-time database migrations: create the indexes the app relies on.
+
+Run once per deploy (e.g. the Procfile release phase) instead of on every
+worker start. ``--backfill-features`` also packs the feature vectors of
+behaviour records stored before the current feature schema (see
+feature_store). ``--backfill-rollups`` rebuilds the section counters of
+``rollups`` from the geofence event log, and from the counters device
+patterns kept before rollups for devices without events; run it before the
+workers start:
+
+    python migrate.py
+    python migrate.py --dry-run
+    python migrate.py --backfill-features
+    python migrate.py --backfill-rollups
+"""
+import argparse
+import logging
+import os
+import sys
+
+import pymongo
+from dotenv import load_dotenv
+
+from data_access import SyncMongoStore
+from log_config import configure_logging
+
+logger = logging.getLogger(__name__)
+
+
+def describe(collection, keys, options):
+    fields = ', '.join(f'{field} {direction}' for field, direction in keys)
+    flags = ' unique' if options.get('unique') else ''
+    return f'{collection.name} ({fields}){flags}'
+
+
+def backfill_features(store, batch_size=1000):
+    """Pack feature vectors of records without one of the current FEATURE_SCHEMA_VERSION"""
+    from feature_store import FALLBACK_PROJECTION, FEATURE_SCHEMA_VERSION, pack_features
+    cursor = store.iter_stale_feature_behaviors(FEATURE_SCHEMA_VERSION, dict(FALLBACK_PROJECTION, _id=1), batch_size)
+    updated = 0
+    batch = []
+    for record in cursor:
+        batch.append((record['_id'], {'features': pack_features(record), 'feature_version': FEATURE_SCHEMA_VERSION}))
+        if len(batch) >= batch_size:
+            store.set_behavior_features(batch)
+            updated += len(batch)
+            batch = []
+            logger.info('features backfilled', extra={'records': updated})
+    if batch:
+        store.set_behavior_features(batch)
+        updated += len(batch)
+    logger.info('feature backfill complete', extra={'records': updated, 'version': FEATURE_SCHEMA_VERSION})
+    return updated
+
+
+def backfill_rollups(store, batch_size=1000):
+    """Rebuild every device's section counters and open visit in rollups"""
+    from rollups import section_counters
+    rebuilt = {}
+    for user_email in store.get_geofence_users():
+        for device_id, counters in section_counters(store.iter_geofence_events(user_email, batch_size)).items():
+            rebuilt.setdefault(user_email, {})[device_id] = counters
+    for pattern in store.iter_legacy_section_patterns():
+        devices = rebuilt.setdefault(pattern['user_email'], {})
+        if pattern['device_id'] in devices:
+            continue
+        # Recorded before the event log: totals only, no hour of day
+        sections = {}
+        for section_id, visits in pattern.get('section_visits', {}).items():
+            sections.setdefault(section_id, {})['visits'] = visits
+        for section_id, seconds in pattern.get('section_dwell_seconds', {}).items():
+            sections.setdefault(section_id, {})['dwell'] = seconds
+        devices[pattern['device_id']] = (sections, None)
+
+    devices_written = 0
+    for user_email, devices in rebuilt.items():
+        update = {'$set': {}, '$unset': {}}
+        for device_id, (sections, visit) in devices.items():
+            prefix = f'devices.{device_id}'
+            update['$set'][f'{prefix}.sections'] = sections
+            if visit:
+                update['$set'][f'{prefix}.open'] = visit
+            else:
+                update['$unset'][f'{prefix}.open'] = ''
+            # Counters of the layout before per-section keys
+            for field in ('visits', 'dwell', 'hourly_dwell'):
+                update['$unset'][f'{prefix}.{field}'] = ''
+        store.update_rollup(user_email, update)
+        devices_written += len(devices)
+    logger.info('rollup backfill complete', extra={'users': len(rebuilt), 'devices': devices_written})
+    return devices_written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mongo-uri', default=None, help='defaults to MONGO_URI')
+    parser.add_argument('--database', default='tracker_db')
+    parser.add_argument('--dry-run', action='store_true', help='list the indexes without creating them')
+    parser.add_argument('--backfill-features', action='store_true',
+                        help='pack feature vectors of behaviour records stored without one')
+    parser.add_argument('--backfill-rollups', action='store_true',
+                        help='rebuild the section counters of rollups from the geofence event log')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    load_dotenv()
+    configure_logging()
+    client = pymongo.MongoClient(args.mongo_uri or os.getenv('MONGO_URI'), serverSelectionTimeoutMS=30000)
+    store = SyncMongoStore(client[args.database])
+
+    specs = store.index_specs()
+    if args.dry_run:
+        for spec in specs:
+            print(describe(*spec))
+        return
+
+    failed = 0
+    for collection, keys, options in specs:
+        try:
+            name = collection.create_index(keys, **options)
+            logger.info('index ready', extra={'collection': collection.name, 'index': name})
+        except pymongo.errors.PyMongoError as e:
+            failed += 1
+            logger.error('index creation failed', extra={'index': describe(collection, keys, options),
+                                                         'error': str(e)})
+    if failed:
+        sys.exit(1)
+    if args.backfill_features:
+        backfill_features(store, args.batch_size)
+    if args.backfill_rollups:
+        backfill_rollups(store, args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
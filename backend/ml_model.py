@@ -1,18 +1,70 @@
-import numpy as np
-from sklearn.ensemble import IsolationForest
-from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
 import pickle
 import os
 from datetime import datetime, timedelta
 import json
-import joblib
+import logging
+
+# numpy and sklearn are imported on first use so importing the app stays cheap;
+# call preload() where the import cost should be paid up front (before fork)
+
+# Training parameters (override per model for replay experiments, see replay.py)
+MODEL_CONTAMINATION = float(os.getenv('MODEL_CONTAMINATION', 0.15))
+MODEL_N_ESTIMATORS = int(os.getenv('MODEL_N_ESTIMATORS', 150))
+MODEL_N_CLUSTERS = int(os.getenv('MODEL_N_CLUSTERS', 3))
+# Training scores below this percentile count as anomalies
+MODEL_THRESHOLD_PERCENTILE = float(os.getenv('MODEL_THRESHOLD_PERCENTILE', 10))
+
+# Detection cascade: records inside the learned feature box and within their
+# cluster's radius are cleared without running the forest. The tightest
+# quantile is chosen at training time so that at most CASCADE_FN_BUDGET of the
+# training records the forest flags would have been cleared.
+CASCADE_ENABLED = os.getenv('CASCADE_ENABLED', '1') == '1'
+CASCADE_FN_BUDGET = float(os.getenv('CASCADE_FN_BUDGET', 0.01))
+CASCADE_QUANTILES = (0.99, 0.95, 0.9, 0.8, 0.7, 0.6, 0.5, 0.4, 0.3)
+
+# Behaviour record fields read by extract_features, in feature order
+FEATURE_FIELDS = (
+    'distance_between_devices', 'device1_section_id', 'device2_section_id', 'both_inside_campus',
+    'movement_speed_device1', 'movement_speed_device2', 'time_of_day', 'day_of_week',
+    'same_section', 'device1_outside', 'device2_outside', 'moving_together', 'section_difference'
+)
+# Plus three derived columns (speed difference, one device outside)
+N_FEATURES = len(FEATURE_FIELDS) + 3
+
+logger = logging.getLogger(__name__)
+
+
+def preload():
+    """Import the ML stack now (e.g. in a preforking server's master)"""
+    import numpy
+    import sklearn.cluster
+    import sklearn.ensemble
+    import sklearn.preprocessing
+
+
+def feature_row(record):
+    """Feature vector of one behaviour record (bump FEATURE_SCHEMA_VERSION when changed)"""
+    values = [float(record.get(field) or 0) for field in FEATURE_FIELDS]
+    section1, section2 = values[1], values[2]
+    return values + [
+        # Additional derived features
+        abs(values[4] - values[5]),
+        1.0 if section1 == 0 and section2 > 0 else 0.0,
+        1.0 if section1 > 0 and section2 == 0 else 0.0,
+    ]
 
 class DeviceBehaviorModel:
-    def __init__(self, user_email):
+    def __init__(self, user_email, contamination=MODEL_CONTAMINATION, n_estimators=MODEL_N_ESTIMATORS,
+                 n_clusters=MODEL_N_CLUSTERS, threshold_percentile=MODEL_THRESHOLD_PERCENTILE,
+                 cascade_fn_budget=CASCADE_FN_BUDGET):
         self.user_email = user_email
+        self.contamination = contamination
+        self.n_estimators = n_estimators
+        self.n_clusters = n_clusters
+        self.threshold_percentile = threshold_percentile
+        self.cascade_fn_budget = cascade_fn_budget
         self.model = None
-        self.scaler = StandardScaler()
+        self.scaler = None
         self.kmeans = None
         self.is_trained = False
         self.training_start_time = None
@@ -20,38 +72,18 @@ class DeviceBehaviorModel:
         self.min_training_samples = 30  # Minimum samples needed for training
         self.normal_patterns = {}
         self.anomaly_threshold = -0.5  # Lower = more sensitive
+        self.cascade = None
+        # Pair evaluations per cascade outcome since load (see cascade_pass_rates)
+        self.cascade_stats = {'records': 0, 'box_passed': 0, 'cleared': 0, 'forest': 0}
         
     def extract_features(self, behavior_data):
-        """Extract enhanced features from device behavior data"""
-        features = []
-        
-        for record in behavior_data:
-            # Enhanced feature vector
-            feature_vector = [
-                record.get('distance_between_devices', 0),
-                record.get('device1_section_id', 0),
-                record.get('device2_section_id', 0),
-                record.get('both_inside_campus', 0),
-                record.get('movement_speed_device1', 0),
-                record.get('movement_speed_device2', 0),
-                record.get('time_of_day', 0),
-                record.get('day_of_week', 0) if 'day_of_week' in record else 0,
-                record.get('same_section', 0),
-                record.get('device1_outside', 0),
-                record.get('device2_outside', 0),
-                record.get('moving_together', 0) if 'moving_together' in record else 0,
-                record.get('section_difference', 0) if 'section_difference' in record else 0,
-                # Additional derived features
-                abs(record.get('movement_speed_device1', 0) - record.get('movement_speed_device2', 0)),
-                1 if record.get('device1_section_id', 0) == 0 and record.get('device2_section_id', 0) > 0 else 0,
-                1 if record.get('device1_section_id', 0) > 0 and record.get('device2_section_id', 0) == 0 else 0,
-            ]
-            features.append(feature_vector)
-        
-        return np.array(features)
+        """Feature matrix for behaviour records (their packed vectors when stored)"""
+        from feature_store import features_from_records
+        return features_from_records(behavior_data).astype(float)
     
     def extract_individual_features(self, device_data, companion_data=None):
         """Extract features for individual device analysis"""
+        import numpy as np
         features = []
         
         # Device alone features
@@ -79,29 +111,38 @@ class DeviceBehaviorModel:
     def train_model(self, behavior_data, device_patterns=None):
         """Train the anomaly detection model with enhanced features"""
         if len(behavior_data) < self.min_training_samples:
-            print(f"⚠️ Need at least {self.min_training_samples} samples, got {len(behavior_data)}")
             return False, f"Need at least {self.min_training_samples} samples, got {len(behavior_data)}"
         
-        print(f"🤖 Training ML model with {len(behavior_data)} samples...")
-        
         # Extract enhanced features
         features = self.extract_features(behavior_data)
+        return self.train_features(features)
+    
+    def train_features(self, features):
+        """Train on a feature matrix (rows as built by extract_features)"""
+        import numpy as np
+        from sklearn.cluster import KMeans
+        from sklearn.ensemble import IsolationForest
+        from sklearn.preprocessing import StandardScaler
+        
+        if len(features) < self.min_training_samples:
+            return False, f"Need at least {self.min_training_samples} samples, got {len(features)}"
         
         # Scale features
+        self.scaler = StandardScaler()
         features_scaled = self.scaler.fit_transform(features)
         
         # Train Isolation Forest with adjusted parameters
         self.model = IsolationForest(
-            contamination=0.15,  # Expect 15% anomalies (more sensitive for demo)
+            contamination=self.contamination,  # Expected anomaly share, MODEL_CONTAMINATION (default 0.15)
             random_state=42,
-            n_estimators=150,
+            n_estimators=self.n_estimators,
             max_samples='auto',
             bootstrap=True
         )
         self.model.fit(features_scaled)
         
         # Train KMeans for pattern clustering
-        self.kmeans = KMeans(n_clusters=3, random_state=42)
+        self.kmeans = KMeans(n_clusters=self.n_clusters, n_init=10, random_state=42)
         cluster_labels = self.kmeans.fit_predict(features_scaled)
         
         # Store normal patterns (cluster centroids)
@@ -114,14 +155,79 @@ class DeviceBehaviorModel:
         
         # Calculate anomaly scores for training data
         train_scores = self.model.score_samples(features_scaled)
-        self.anomaly_threshold = np.percentile(train_scores, 10)  # Bottom 10% as potential anomalies
+        self.anomaly_threshold = np.percentile(train_scores, self.threshold_percentile)  # Bottom 10% as potential anomalies
+        
+        self.cascade = self.calibrate_cascade(features_scaled, train_scores) if CASCADE_ENABLED else None
         
         self.is_trained = True
-        print(f"✅ ML Model trained successfully. Anomaly threshold: {self.anomaly_threshold:.3f}")
+        logger.debug('model trained', extra={'user_email': self.user_email, 'samples': len(features),
+                                             'threshold': round(float(self.anomaly_threshold), 3)})
         return True, "Model trained successfully"
     
+    def scale(self, features):
+        """StandardScaler transform without sklearn's per-call input validation"""
+        return (features - self.scaler.mean_) / self.scaler.scale_
+    
+    def prefilter(self, features_scaled, cascade=None):
+        """Cascade checks for scaled rows: (inside box, cleared) boolean arrays"""
+        import numpy as np
+        cascade = cascade or self.cascade
+        in_box = np.all((features_scaled >= cascade['low']) & (features_scaled <= cascade['high']), axis=1)
+        distances = np.sqrt(((features_scaled[:, None, :] - cascade['centers'][None]) ** 2).sum(axis=2))
+        nearest = distances.argmin(axis=1)
+        within = distances[np.arange(len(nearest)), nearest] <= cascade['radii'][nearest]
+        return in_box, in_box & within
+    
+    def calibrate_cascade(self, features_scaled, train_scores):
+        """Widest box/radius quantile whose cleared set stays within the FN budget"""
+        import numpy as np
+        flagged = train_scores < self.anomaly_threshold
+        # Borderline records (up to twice the anomaly percentile) must not be cleared
+        # either, so the in-sample calibration keeps a margin for unseen data
+        guarded = train_scores < np.percentile(train_scores, min(2 * self.threshold_percentile, 50))
+        labels = self.kmeans.labels_
+        centers = self.kmeans.cluster_centers_
+        member_distances = np.linalg.norm(features_scaled - centers[labels], axis=1)
+        allowed = self.cascade_fn_budget * max(int(flagged.sum()), 1)
+        for quantile in CASCADE_QUANTILES:
+            radii = np.array([np.quantile(member_distances[labels == k], quantile) if np.any(labels == k) else 0.0
+                              for k in range(len(centers))])
+            # Split the excluded share over the features so the whole box covers ~quantile
+            tail = (1 - quantile) / (2 * features_scaled.shape[1])
+            cascade = {
+                'quantile': quantile,
+                'low': np.quantile(features_scaled, tail, axis=0),
+                'high': np.quantile(features_scaled, 1 - tail, axis=0),
+                'centers': centers,
+                'radii': radii
+            }
+            _, cleared = self.prefilter(features_scaled, cascade)
+            missed = int((cleared & guarded).sum())
+            if missed <= allowed:
+                cascade['train_clear_rate'] = float(cleared.mean())
+                cascade['train_fn_rate'] = missed / max(int(flagged.sum()), 1)
+                return cascade
+        return None
+    
+    def cascade_pass_rates(self):
+        """Share of evaluations passing the box, cleared by the radius and reaching the forest"""
+        stats = dict(self.cascade_stats)
+        records = max(stats['records'], 1)
+        return {
+            'records': stats['records'],
+            'box_pass_rate': stats['box_passed'] / records,
+            'cleared_rate': stats['cleared'] / records,
+            'forest_rate': stats['forest'] / records
+        }
+    
+    def score_features(self, features):
+        """Vectorised scoring of a feature matrix: (scores, is_anomaly) arrays"""
+        scores = self.model.score_samples(self.scale(features))
+        return scores, scores < self.anomaly_threshold
+    
     def predict_anomaly(self, current_behavior):
         """Predict if current behavior is anomaly with confidence"""
+        import numpy as np
         if not self.is_trained:
             return False, 0.0, "Model not trained yet", {}
         
@@ -130,7 +236,25 @@ class DeviceBehaviorModel:
         if features.shape[0] == 0:
             return False, 0.0, "No features extracted", {}
         
-        features_scaled = self.scaler.transform(features)
+        features_scaled = self.scale(features)
+        self.cascade_stats['records'] += 1
+        
+        # Cheap checks first: clearly normal records never reach the forest
+        cascade_outcome = 'off'
+        if self.cascade is not None:
+            in_box, cleared = self.prefilter(features_scaled)
+            if in_box[0]:
+                self.cascade_stats['box_passed'] += 1
+            if cleared[0]:
+                self.cascade_stats['cleared'] += 1
+                return False, 0.0, "Cleared by cascade", {
+                    'score': None,
+                    'threshold': float(self.anomaly_threshold),
+                    'is_anomaly': False,
+                    'cascade': 'cleared'
+                }
+            cascade_outcome = 'radius_miss' if in_box[0] else 'box_miss'
+        self.cascade_stats['forest'] += 1
         
         # Get anomaly score (lower = more abnormal)
         score = self.model.score_samples(features_scaled)[0]
@@ -158,19 +282,24 @@ class DeviceBehaviorModel:
             'assigned_cluster': int(assigned_cluster),
             'is_anomaly': bool(is_anomaly),
             'confidence': float(confidence),
-            'features': {
-                'distance': float(current_behavior.get('distance_between_devices', 0)),
-                'device1_section': int(current_behavior.get('device1_section_id', 0)),
-                'device2_section': int(current_behavior.get('device2_section_id', 0)),
-                'same_section': bool(current_behavior.get('same_section', 0)),
-                'moving_together': bool(current_behavior.get('moving_together', 0) if 'moving_together' in current_behavior else 0),
-                'device1_outside': bool(current_behavior.get('device1_outside', 0)),
-                'device2_outside': bool(current_behavior.get('device2_outside', 0))
-            }
+            'cascade': cascade_outcome,
+            'features': self.feature_summary(current_behavior)
         }
         
         return is_anomaly, confidence, "Prediction successful", anomaly_details
     
+    def feature_summary(self, current_behavior):
+        """Readable subset of a behaviour record for alert explanations"""
+        return {
+            'distance': float(current_behavior.get('distance_between_devices', 0)),
+            'device1_section': int(current_behavior.get('device1_section_id', 0)),
+            'device2_section': int(current_behavior.get('device2_section_id', 0)),
+            'same_section': bool(current_behavior.get('same_section', 0)),
+            'moving_together': bool(current_behavior.get('moving_together', 0) if 'moving_together' in current_behavior else 0),
+            'device1_outside': bool(current_behavior.get('device1_outside', 0)),
+            'device2_outside': bool(current_behavior.get('device2_outside', 0))
+        }
+    
     def detect_individual_anomaly(self, device_data, companion_data=None):
         """Detect anomalies in individual device behavior"""
         if not self.is_trained:
@@ -221,6 +350,7 @@ class DeviceBehaviorModel:
             'training_start_time': self.training_start_time,
             'anomaly_threshold': self.anomaly_threshold,
             'normal_patterns': self.normal_patterns,
+            'cascade': self.cascade,
             'user_email': self.user_email
         }
         
@@ -228,7 +358,7 @@ class DeviceBehaviorModel:
         with open(filepath, 'wb') as f:
             pickle.dump(model_data, f)
         
-        print(f"💾 Model saved to {filepath}")
+        logger.debug('model saved', extra={'path': filepath})
     
     def load_model(self, filepath):
         """Load trained model from disk"""
@@ -243,10 +373,12 @@ class DeviceBehaviorModel:
                     self.training_start_time = model_data['training_start_time']
                     self.anomaly_threshold = model_data.get('anomaly_threshold', -0.5)
                     self.normal_patterns = model_data.get('normal_patterns', {})
-                print(f"📂 Model loaded from {filepath}")
+                    # Models saved before the cascade existed always run the forest
+                    self.cascade = model_data.get('cascade') if CASCADE_ENABLED else None
+                logger.debug('model loaded', extra={'path': filepath})
                 return True
             except Exception as e:
-                print(f"❌ Error loading model: {e}")
+                logger.warning('model load failed', extra={'path': filepath, 'error': str(e)})
                 return False
         return False
     
@@ -260,7 +392,9 @@ class DeviceBehaviorModel:
             "training_start_time": self.training_start_time.isoformat() if self.training_start_time else None,
             "anomaly_threshold": self.anomaly_threshold,
             "normal_patterns_count": len(self.normal_patterns.get('cluster_centers', [])),
-            "model_type": "Isolation Forest + KMeans"
+            "model_type": "Isolation Forest + KMeans",
+            "cascade_quantile": self.cascade['quantile'] if self.cascade else None,
+            "cascade_train_clear_rate": self.cascade['train_clear_rate'] if self.cascade else None
         }
         
         return info
\ No newline at end of file
@@ -0,0 +1,145 @@
+"""Password hashing on a bounded process pool with admission control.
+
+bcrypt is deliberately slow and CPU-bound; running it on the request thread
+lets a login burst starve the socket handlers in the same process. Hashes are
+computed in a small spawn-based process pool instead, with at most
+``PASSWORD_POOL_MAX_PENDING`` operations admitted (running or queued). Beyond
+that ``PasswordPoolSaturated`` is raised and the endpoint answers 503 with
+Retry-After. Hashes are compatible with Flask-Bcrypt's ``$2b$`` output.
+
+Spawned children re-run the parent's main script. The entry scripts
+(``dev_server.py``, which ``python app.py`` hands over to, and ``wsgi.py``)
+import the app only under their ``__main__`` guard, so workers load just this
+module. A pool whose worker died is replaced on the next call.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+PASSWORD_POOL_WORKERS = int(os.getenv('PASSWORD_POOL_WORKERS', 2))
+PASSWORD_POOL_MAX_PENDING = int(os.getenv('PASSWORD_POOL_MAX_PENDING', 16))
+PASSWORD_RETRY_AFTER = int(os.getenv('PASSWORD_RETRY_AFTER', 2))
+BCRYPT_LOG_ROUNDS = int(os.getenv('BCRYPT_LOG_ROUNDS', 12))
+
+logger = logging.getLogger(__name__)
+
+
+class PasswordPoolSaturated(Exception):
+    """Raised when the hashing pool has no free admission slot"""
+
+    def __init__(self, retry_after=PASSWORD_RETRY_AFTER):
+        super().__init__('Password hashing pool is saturated')
+        self.retry_after = retry_after
+
+
+def _hash_password(password, rounds, submitted_at):
+    started_at = time.time()
+    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+    return hashed, started_at - submitted_at, time.time() - started_at
+
+
+def _check_password(pw_hash, password, submitted_at):
+    started_at = time.time()
+    matches = bcrypt.checkpw(password.encode('utf-8'), pw_hash.encode('utf-8'))
+    return matches, started_at - submitted_at, time.time() - started_at
+
+
+class PasswordHasher:
+    """Process-pool bcrypt with a concurrency cap and queue-time statistics"""
+
+    def __init__(self, workers=PASSWORD_POOL_WORKERS, max_pending=PASSWORD_POOL_MAX_PENDING,
+                 rounds=BCRYPT_LOG_ROUNDS):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rounds = rounds
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.completed = 0
+        self.rejected = 0
+        self.queue_seconds_total = 0.0
+        self.queue_seconds_max = 0.0
+        self.hash_seconds_total = 0.0
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                # spawn: never fork a parent that holds sockets, locks or green threads
+                executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+                try:
+                    _, queued, hashed = executor.submit(_hash_password, 'calibration', self.rounds,
+                                                        time.time()).result()
+                except BrokenProcessPool:
+                    executor.shutdown(wait=False)
+                    raise
+                self._executor = executor
+                logger.info('password pool started', extra={
+                    'work_factor': self.rounds, 'hash_ms': round(hashed * 1000),
+                    'workers': self.workers, 'max_pending': self.max_pending
+                })
+            return self._executor
+
+    def _drop_executor(self, executor):
+        """Forget a broken pool so the next call starts a new one"""
+        with self._executor_lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+        logger.warning('password pool broken, restarting it')
+
+    def _submit(self, func, *args):
+        """Run func in the pool, once more on a new pool if a worker died"""
+        for attempt in range(2):
+            executor = self._get_executor()
+            try:
+                return executor.submit(func, *args, time.time()).result()
+            except BrokenProcessPool:
+                self._drop_executor(executor)
+                if attempt:
+                    raise
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._stats_lock:
+                self.rejected += 1
+            raise PasswordPoolSaturated()
+        try:
+            result, queued, hashed = self._submit(func, *args)
+        finally:
+            self._slots.release()
+        with self._stats_lock:
+            self.completed += 1
+            self.queue_seconds_total += queued
+            self.queue_seconds_max = max(self.queue_seconds_max, queued)
+            self.hash_seconds_total += hashed
+        return result
+
+    def generate_password_hash(self, password):
+        return self._run(_hash_password, password, self.rounds)
+
+    def check_password_hash(self, pw_hash, password):
+        return self._run(_check_password, pw_hash, password)
+
+    def stats(self):
+        with self._stats_lock:
+            completed = self.completed or 1
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'work_factor': self.rounds,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'avg_queue_ms': self.queue_seconds_total / completed * 1000,
+                'max_queue_ms': self.queue_seconds_max * 1000,
+                'avg_hash_ms': self.hash_seconds_total / completed * 1000
+            }
@@ -0,0 +1,279 @@
+"""Shared population detector with lightweight per-user calibration.
+
+A ``DeviceBehaviorModel`` is a private 150-tree forest per user that needs 30
+samples before it scores. ``PopulationModel`` is one IsolationForest trained
+offline (``python population_model.py``) on feature rows pooled from many
+users. Each user's rows are standardised with that user's own statistics and
+pooled without identifiers, so the forest learns how far a record strays from
+its owner's routine rather than anyone's habits. A user then only needs a
+``UserCalibration``: feature means and scales, a score threshold and a few
+centroids, packed as float32 in a few hundred bytes (``calibrations``
+collection).
+
+Calibration statistics and thresholds are shrunk towards the population's
+with weight ``n / (n + CALIBRATION_PRIOR_SAMPLES)``. A user without a
+calibration is scored with the population values from the first record, and
+the calibration tightens as their records arrive.
+
+    python population_model.py
+    python population_model.py --max-users 2000 --per-user 500 --output models/population_model.pkl
+"""
+import argparse
+import datetime
+import logging
+import os
+import pickle
+import random
+import struct
+import time
+
+from feature_store import features_from_records
+from ml_model import MODEL_CONTAMINATION, MODEL_N_CLUSTERS, MODEL_THRESHOLD_PERCENTILE, N_FEATURES, DeviceBehaviorModel
+
+POPULATION_MODEL_PATH = os.getenv('POPULATION_MODEL_PATH', 'models/population_model.pkl')
+POPULATION_N_ESTIMATORS = int(os.getenv('POPULATION_N_ESTIMATORS', 200))
+# Most recent rows taken from each user when training the shared forest
+POPULATION_PER_USER = int(os.getenv('POPULATION_PER_USER', 500))
+# Population pseudo-samples mixed into every calibration
+CALIBRATION_PRIOR_SAMPLES = int(os.getenv('CALIBRATION_PRIOR_SAMPLES', 20))
+CALIBRATION_MIN_SAMPLES = int(os.getenv('CALIBRATION_MIN_SAMPLES', 10))
+# Records a calibration is fitted on, drawn from the user's day/hour-stratified reservoir
+CALIBRATION_WINDOW = int(os.getenv('CALIBRATION_WINDOW', 200))
+
+logger = logging.getLogger(__name__)
+
+
+class UserCalibration:
+    """Per-user scaler statistics, score threshold and centroids"""
+
+    VERSION = 1
+    HEADER = struct.Struct('<BIHf')  # version, samples, centroids, threshold
+
+    def __init__(self, mean, scale, threshold, centers, samples):
+        import numpy as np
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+        self.threshold = float(threshold)
+        self.centers = np.asarray(centers, dtype=np.float32).reshape(-1, N_FEATURES)
+        self.samples = int(samples)
+
+    def to_bytes(self):
+        import numpy as np
+        header = self.HEADER.pack(self.VERSION, self.samples, len(self.centers), self.threshold)
+        return header + np.concatenate([self.mean, self.scale, self.centers.ravel()]).astype('<f4').tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        import numpy as np
+        version, samples, n_centers, threshold = cls.HEADER.unpack_from(data)
+        if version != cls.VERSION:
+            raise ValueError(f'unsupported calibration version {version}')
+        values = np.frombuffer(data, dtype='<f4', offset=cls.HEADER.size)
+        return cls(values[:N_FEATURES], values[N_FEATURES:2 * N_FEATURES], threshold,
+                   values[2 * N_FEATURES:].reshape(n_centers, N_FEATURES), samples)
+
+
+class PopulationModel:
+    """IsolationForest over per-user standardised rows, shared by every calibrated user"""
+
+    def __init__(self, contamination=MODEL_CONTAMINATION, n_estimators=POPULATION_N_ESTIMATORS,
+                 threshold_percentile=MODEL_THRESHOLD_PERCENTILE):
+        self.contamination = contamination
+        self.n_estimators = n_estimators
+        self.threshold_percentile = threshold_percentile
+        self.forest = None
+        self.mean = None
+        self.scale = None
+        self.threshold = None
+        self.users = 0
+        self.rows = 0
+        self.version = None
+
+    @property
+    def is_trained(self):
+        return self.forest is not None
+
+    def shrunk_stats(self, features):
+        """User means and scales pulled towards the population's"""
+        import numpy as np
+        n = len(features)
+        if not n:
+            return self.mean, self.scale
+        weight = n / (n + CALIBRATION_PRIOR_SAMPLES)
+        mean = weight * features.mean(axis=0) + (1 - weight) * self.mean
+        variance = weight * features.var(axis=0) + (1 - weight) * self.scale ** 2
+        return mean, np.sqrt(variance)
+
+    def fit(self, user_features):
+        """Train on a list of per-user feature matrices (rows as built by extract_features)"""
+        import numpy as np
+        from sklearn.ensemble import IsolationForest
+
+        user_features = [features for features in user_features if len(features) >= CALIBRATION_MIN_SAMPLES]
+        if not user_features:
+            return False, f"No user has {CALIBRATION_MIN_SAMPLES} samples"
+        raw = np.vstack(user_features)
+        self.mean = raw.mean(axis=0)
+        self.scale = raw.std(axis=0)
+        self.scale[self.scale == 0] = 1.0
+        pooled = np.vstack([(features - mean) / scale
+                            for features, (mean, scale) in ((f, self.shrunk_stats(f)) for f in user_features)])
+        self.forest = IsolationForest(contamination=self.contamination, random_state=42,
+                                      n_estimators=self.n_estimators, max_samples='auto', bootstrap=True)
+        self.forest.fit(pooled)
+        self.threshold = float(np.percentile(self.forest.score_samples(pooled), self.threshold_percentile))
+        self.users = len(user_features)
+        self.rows = len(pooled)
+        self.version = datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S')
+        return True, "Population model trained successfully"
+
+    def default_calibration(self):
+        """Calibration used before a user has any: population statistics and threshold"""
+        import numpy as np
+        return UserCalibration(self.mean, self.scale, self.threshold, np.empty((0, N_FEATURES)), 0)
+
+    def calibrate(self, features):
+        """Fit a user's calibration on their recent feature rows"""
+        import numpy as np
+        from sklearn.cluster import KMeans
+        mean, scale = self.shrunk_stats(features)
+        scaled = (features - mean) / scale
+        scores = self.forest.score_samples(scaled)
+        weight = len(features) / (len(features) + CALIBRATION_PRIOR_SAMPLES)
+        threshold = weight * np.percentile(scores, self.threshold_percentile) + (1 - weight) * self.threshold
+        n_clusters = min(MODEL_N_CLUSTERS, len(features))
+        centers = KMeans(n_clusters=n_clusters, n_init=10, random_state=42).fit(scaled).cluster_centers_
+        return UserCalibration(mean, scale, threshold, centers, len(features))
+
+    def save(self, filepath):
+        """Write atomically so serving workers never read a partial file"""
+        os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+        tmp_path = filepath + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self.__dict__, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, filepath)
+        logger.debug('population model saved', extra={'path': filepath})
+
+    @classmethod
+    def load(cls, filepath):
+        """Model saved by save(), or None"""
+        if not os.path.exists(filepath):
+            return None
+        try:
+            with open(filepath, 'rb') as f:
+                state = pickle.load(f)
+            model = cls()
+            model.__dict__.update(state)
+            logger.debug('population model loaded', extra={'path': filepath, 'version': model.version})
+            return model
+        except Exception as e:
+            logger.warning('population model load failed', extra={'path': filepath, 'error': str(e)})
+            return None
+
+
+class CalibratedBehaviorModel(DeviceBehaviorModel):
+    """DeviceBehaviorModel interface over the shared PopulationModel and one UserCalibration"""
+
+    kind = 'population'
+
+    def __init__(self, user_email, population, calibration=None):
+        super().__init__(user_email, threshold_percentile=population.threshold_percentile)
+        self.population = population
+        self.calibration = calibration
+        self.records_since_calibration = 0
+        self.is_trained = True
+
+    def needs_calibration(self):
+        """Recalibrate after 10, 20, 40... new records, then every CALIBRATION_WINDOW"""
+        samples = self.calibration.samples if self.calibration else 0
+        return self.records_since_calibration >= min(max(samples, CALIBRATION_MIN_SAMPLES), CALIBRATION_WINDOW)
+
+    def predict_anomaly(self, current_behavior):
+        """Score the record with the shared forest in the user's calibrated space"""
+        import numpy as np
+        features = self.extract_features([current_behavior])
+        if features.shape[0] == 0:
+            return False, 0.0, "No features extracted", {}
+        self.records_since_calibration += 1
+
+        calibration = self.calibration or self.population.default_calibration()
+        features_scaled = (features - calibration.mean) / calibration.scale
+        score = float(self.population.forest.score_samples(features_scaled)[0])
+        if len(calibration.centers):
+            cluster_distances = np.linalg.norm(calibration.centers - features_scaled[0], axis=1)
+            min_cluster_distance, assigned_cluster = float(cluster_distances.min()), int(cluster_distances.argmin())
+        else:
+            min_cluster_distance, assigned_cluster = 0.0, -1
+
+        is_anomaly = score < calibration.threshold
+        confidence = abs(score)
+        return is_anomaly, confidence, "Prediction successful", {
+            'score': score,
+            'threshold': calibration.threshold,
+            'cluster_distance': min_cluster_distance,
+            'assigned_cluster': assigned_cluster,
+            'is_anomaly': bool(is_anomaly),
+            'confidence': float(confidence),
+            'cascade': 'population',
+            'features': self.feature_summary(current_behavior)
+        }
+
+    def get_model_info(self):
+        calibration = self.calibration or self.population.default_calibration()
+        return {
+            "status": "Trained" if self.calibration else "Population defaults",
+            "model_type": "Population Isolation Forest + per-user calibration",
+            "anomaly_threshold": calibration.threshold,
+            "normal_patterns_count": len(calibration.centers),
+            "calibration_samples": calibration.samples,
+            "calibration_bytes": len(calibration.to_bytes()),
+            "population_version": self.population.version,
+            "population_users": self.population.users
+        }
+
+
+def main():
+    import pymongo
+    from dotenv import load_dotenv
+    from data_access import SyncMongoStore
+
+    parser = argparse.ArgumentParser(description='Train the shared population model')
+    parser.add_argument('--mongo-uri', default=None, help='defaults to MONGO_URI')
+    parser.add_argument('--database', default='tracker_db')
+    parser.add_argument('--max-users', type=int, default=2000, help='random sample of users (0 = all)')
+    parser.add_argument('--per-user', type=int, default=POPULATION_PER_USER)
+    parser.add_argument('--n-estimators', type=int, default=POPULATION_N_ESTIMATORS)
+    parser.add_argument('--output', default=POPULATION_MODEL_PATH)
+    args = parser.parse_args()
+
+    load_dotenv()
+    store = SyncMongoStore(pymongo.MongoClient(args.mongo_uri or os.getenv('MONGO_URI'))[args.database])
+    users = store.get_behavior_users()
+    random.shuffle(users)
+    if args.max_users:
+        users = users[:args.max_users]
+
+    started = time.perf_counter()
+    user_features = [features_from_records(store.get_recent_behaviors(user_email, args.per_user)).astype(float)
+                     for user_email in users]
+    read_seconds = time.perf_counter() - started
+
+    population = PopulationModel(n_estimators=args.n_estimators)
+    started = time.perf_counter()
+    trained, message = population.fit(user_features)
+    if not trained:
+        raise SystemExit(message)
+    population.save(args.output)
+    calibration = population.calibrate(next(f for f in user_features if len(f) >= CALIBRATION_MIN_SAMPLES))
+
+    per_user_bytes = sum(entry.stat().st_size for entry in os.scandir(os.path.dirname(args.output) or '.')
+                         if entry.name.endswith('_model.pkl'))
+    print(f'users {population.users}  rows {population.rows}  read {read_seconds:.1f}s  '
+          f'train {time.perf_counter() - started:.1f}s  threshold {population.threshold:.3f}')
+    print(f'population model {os.path.getsize(args.output) / 1024:.0f}KB  '
+          f'calibration {len(calibration.to_bytes())} bytes per user  '
+          f'(per-user models on disk: {per_user_bytes / 1024:.0f}KB)')
+
+
+if __name__ == '__main__':
+    main()
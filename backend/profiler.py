@@ -0,0 +1,165 @@
+"""On-demand profiling of a live worker.
+
+``SamplingProfiler`` walks ``sys._current_frames()`` from a native thread every
+few milliseconds and counts whole stacks, so the profiled code runs untouched
+(no tracing hooks) and the cost is bounded by the sampling interval. Output is
+in the collapsed-stack format (``frame;frame;frame count`` per line) read by
+flamegraph.pl, speedscope and inferno. Under eventlet/gevent all greenlets
+share the main OS thread, so its samples show whichever greenlet holds the hub.
+
+``UserProfiler`` is the opt-in deterministic counterpart: once armed for a
+user it runs that user's next N location updates under cProfile and keeps the
+aggregated stats for a report.
+"""
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+from collections import Counter
+
+from engine import native
+
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', 60))
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', 5))
+PROFILE_MAX_EVENTS = int(os.getenv('PROFILE_MAX_EVENTS', 500))
+
+# Leaf functions of threads parked waiting for work, dropped unless idle=True
+IDLE_FUNCTIONS = {'wait', 'select', 'poll', 'epoll', 'sleep', 'acquire', 'accept',
+                  'recv', 'recv_into', 'readinto', 'get', 'run_forever', 'switch'}
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profiling session is already running on this worker"""
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def collapse(stacks):
+    """Render a Counter of stack tuples as collapsed-stack lines"""
+    return '\n'.join(f"{';'.join(stack)} {count}" for stack, count in stacks.most_common()) + '\n'
+
+
+class SamplingProfiler:
+    """Wall-clock stack sampler; one session at a time per process"""
+
+    def __init__(self, max_seconds=PROFILE_MAX_SECONDS):
+        self.max_seconds = max_seconds
+        self._busy = threading.Lock()
+
+    def sample(self, seconds, interval_ms=PROFILE_INTERVAL_MS, idle=False):
+        """Sample all threads for seconds and return (stacks Counter, sample count).
+
+        Blocks the calling thread; call it through ``run_blocking`` from a
+        request handler so the event loop keeps running while it samples.
+        """
+        if not self._busy.acquire(blocking=False):
+            raise ProfilerBusy('a profiling session is already running')
+        try:
+            return self._sample(min(seconds, self.max_seconds), max(interval_ms, 1) / 1000.0, idle)
+        finally:
+            self._busy.release()
+
+    def _sample(self, seconds, interval, idle):
+        sleep = native('time', 'sleep')
+        monotonic = native('time', 'monotonic')
+        own_ident = native('threading', 'get_ident')()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = Counter()
+        samples = 0
+        deadline = monotonic() + seconds
+        while monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                if not idle and frame.f_code.co_name in IDLE_FUNCTIONS:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f'thread-{ident}'))
+                stacks[tuple(reversed(stack))] += 1
+            samples += 1
+            sleep(interval)
+        return stacks, samples
+
+    def profile(self, seconds, interval_ms=PROFILE_INTERVAL_MS, idle=False):
+        """Collapsed-stack text for a session of seconds"""
+        stacks, _ = self.sample(seconds, interval_ms, idle)
+        return collapse(stacks)
+
+
+class UserProfiler:
+    """cProfile capture of the next N events of an armed user.
+
+    Only one event is profiled at a time (cProfile hooks the running thread);
+    an armed user's event that arrives while another is being profiled runs
+    unprofiled and does not use up the budget.
+    """
+
+    def __init__(self, max_events=PROFILE_MAX_EVENTS):
+        self.max_events = max_events
+        self._armed = {}
+        self._stats = {}
+        self._running = threading.Lock()
+        self._lock = threading.Lock()
+
+    def arm(self, user_email, events):
+        """Profile the user's next events (replaces earlier stats); 0 disarms"""
+        events = max(0, min(int(events), self.max_events))
+        with self._lock:
+            self._stats.pop(user_email, None)
+            if events:
+                self._armed[user_email] = events
+            else:
+                self._armed.pop(user_email, None)
+        return events
+
+    def armed(self):
+        with self._lock:
+            return dict(self._armed)
+
+    def run(self, user_email, func, *args, **kwargs):
+        """Call func, under cProfile if user_email is armed"""
+        if user_email not in self._armed or not self._running.acquire(blocking=False):
+            return func(*args, **kwargs)
+        try:
+            with self._lock:
+                remaining = self._armed.get(user_email, 0)
+                if remaining <= 1:
+                    self._armed.pop(user_email, None)
+                else:
+                    self._armed[user_email] = remaining - 1
+            if not remaining:
+                return func(*args, **kwargs)
+            profile = cProfile.Profile()
+            try:
+                return profile.runcall(func, *args, **kwargs)
+            finally:
+                with self._lock:
+                    entry = self._stats.setdefault(user_email, {'events': 0, 'stats': None})
+                    entry['events'] += 1
+                    if entry['stats'] is None:
+                        entry['stats'] = pstats.Stats(profile)
+                    else:
+                        entry['stats'].add(profile)
+        finally:
+            self._running.release()
+
+    def report(self, user_email, sort='cumulative', limit=40):
+        """pstats text for the user's captured events, or None if nothing was captured"""
+        with self._lock:
+            entry = self._stats.get(user_email)
+            if entry is None:
+                return None
+            out = io.StringIO()
+            stats = entry['stats']
+            stats.stream = out
+            out.write(f"{entry['events']} profiled events for {user_email}\n")
+            stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        return out.getvalue()
@@ -0,0 +1,232 @@
+"""Offline replay of device_behaviors through DeviceBehaviorModel.
+
+Each user's stored behaviour records are streamed in timestamp order and
+their packed feature vectors (see feature_store) read into feature matrices
+in batches of ``--batch-size`` records. Records stored without one have
+their features computed from their fields and are counted;
+``python migrate.py --backfill-features`` packs them in place. The first
+``--train-size`` records train the model (production trains once 30 samples
+are collected) and every later record is scored as it would have been live. With ``--retrain-every N`` the model is retrained on
+the last ``--train-window`` records after every N scored records. Users are
+replayed in parallel on a process pool; the report gives alert rates and
+scoring throughput so parameter changes can be compared over the fleet's
+history:
+
+    python replay.py --processes 8
+    python replay.py --n-estimators 100 --threshold-percentile 5 --output replay.json
+    python replay.py --users a@example.com,b@example.com --retrain-every 500
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pymongo
+from dotenv import load_dotenv
+
+from data_access import SyncMongoStore
+from feature_store import FALLBACK_PROJECTION, features_from_records, has_packed_features
+from ml_model import (CASCADE_FN_BUDGET, MODEL_CONTAMINATION, MODEL_N_CLUSTERS, MODEL_N_ESTIMATORS,
+                      MODEL_THRESHOLD_PERCENTILE, DeviceBehaviorModel)
+
+MODEL_PARAMS = ('contamination', 'n_estimators', 'n_clusters', 'threshold_percentile', 'cascade_fn_budget')
+
+_store = None
+
+
+def _init_worker(mongo_uri, database):
+    global _store
+    import warnings
+    warnings.simplefilter('ignore', FutureWarning)
+    _store = SyncMongoStore(pymongo.MongoClient(mongo_uri)[database])
+
+
+def _run_user(user_email, config):
+    return replay_user(_store, user_email, config)
+
+
+def batches(cursor, size):
+    while True:
+        batch = list(itertools.islice(cursor, size))
+        if not batch:
+            return
+        yield batch
+
+
+def replay_user(store, user_email, config):
+    """Train and score one user's history chronologically; returns the user's stats"""
+    import numpy as np
+    model = DeviceBehaviorModel(user_email, **{name: config[name] for name in MODEL_PARAMS})
+    model.min_training_samples = min(model.min_training_samples, config['train_size'])
+    train_size, retrain_every, train_window = config['train_size'], config['retrain_every'], config['train_window']
+
+    stats = {'user_email': user_email, 'records': 0, 'unpacked': 0, 'trained': False, 'scored': 0, 'alerts': 0,
+             'retrains': 0, 'read_seconds': 0.0, 'train_seconds': 0.0, 'score_seconds': 0.0,
+             'cascade_box_passed': 0, 'cascade_cleared': 0, 'cascade_missed': 0, 'prefilter_seconds': 0.0}
+    history = np.empty((0, 0))
+    since_training = 0
+
+    def train(features):
+        started = time.perf_counter()
+        trained, _ = model.train_features(features)
+        stats['train_seconds'] += time.perf_counter() - started
+        return trained
+
+    # Fields too, so records stored before packing are not dropped from the history
+    cursor = store.iter_behaviors(user_email, FALLBACK_PROJECTION, config['batch_size'])
+    read_started = time.perf_counter()
+    for batch in batches(cursor, config['batch_size']):
+        stats['unpacked'] += sum(1 for record in batch if not has_packed_features(record))
+        features = features_from_records(batch).astype(float)
+        stats['read_seconds'] += time.perf_counter() - read_started
+        stats['records'] += len(batch)
+        history = features if not history.size else np.vstack([history, features])
+
+        def seen(offset):
+            """Rows of history up to (excluding) batch row offset"""
+            return history[:len(history) - (len(features) - offset)]
+
+        offset = 0
+        if not model.is_trained:
+            offset = len(features)
+            if stats['records'] >= train_size:
+                # Train on the first train_size records, score the rest of the batch
+                offset = len(features) - (stats['records'] - train_size)
+                stats['trained'] = train(seen(offset)[-train_size:])
+        while model.is_trained and offset < len(features):
+            chunk = features[offset:]
+            if retrain_every:
+                chunk = chunk[:retrain_every - since_training]
+            started = time.perf_counter()
+            _, flags = model.score_features(chunk)
+            stats['score_seconds'] += time.perf_counter() - started
+            stats['scored'] += len(chunk)
+            stats['alerts'] += int(flags.sum())
+            if model.cascade is not None:
+                # Every record also went through the forest, so cleared alerts are false negatives
+                started = time.perf_counter()
+                in_box, cleared = model.prefilter(model.scale(chunk))
+                stats['prefilter_seconds'] += time.perf_counter() - started
+                stats['cascade_box_passed'] += int(in_box.sum())
+                stats['cascade_cleared'] += int(cleared.sum())
+                stats['cascade_missed'] += int((cleared & flags).sum())
+            offset += len(chunk)
+            since_training += len(chunk)
+            if retrain_every and since_training >= retrain_every:
+                train(seen(offset)[-train_window:])
+                stats['retrains'] += 1
+                since_training = 0
+        history = history[-max(train_window, train_size):]
+        read_started = time.perf_counter()
+
+    stats['alert_rate'] = stats['alerts'] / stats['scored'] if stats['scored'] else 0.0
+    return stats
+
+
+def summarize(results, wall_seconds):
+    scored = sum(r['scored'] for r in results)
+    alerts = sum(r['alerts'] for r in results)
+    score_seconds = sum(r['score_seconds'] for r in results)
+    rates = sorted(r['alert_rate'] for r in results if r['scored'])
+    cleared = sum(r['cascade_cleared'] for r in results)
+    prefilter_seconds = sum(r['prefilter_seconds'] for r in results)
+    return {
+        'users': len(results),
+        'users_trained': sum(1 for r in results if r['trained']),
+        'records': sum(r['records'] for r in results),
+        'unpacked': sum(r['unpacked'] for r in results),
+        'scored': scored,
+        'alerts': alerts,
+        'alert_rate': alerts / scored if scored else 0.0,
+        'user_alert_rate_p50': statistics.median(rates) if rates else 0.0,
+        'user_alert_rate_p95': rates[min(len(rates) - 1, int(len(rates) * 0.95))] if rates else 0.0,
+        'retrains': sum(r['retrains'] for r in results),
+        'train_seconds': sum(r['train_seconds'] for r in results),
+        'score_seconds': score_seconds,
+        'scores_per_sec': scored / score_seconds if score_seconds else 0.0,
+        'cascade_box_pass_rate': sum(r['cascade_box_passed'] for r in results) / scored if scored else 0.0,
+        'cascade_clear_rate': cleared / scored if scored else 0.0,
+        'cascade_fn_rate': sum(r['cascade_missed'] for r in results) / alerts if alerts else 0.0,
+        # Forest only for records the prefilter did not clear
+        'cascade_seconds': prefilter_seconds + (score_seconds * (1 - cleared / scored) if scored else 0.0),
+        'wall_seconds': wall_seconds,
+        'records_per_sec_wall': sum(r['records'] for r in results) / wall_seconds if wall_seconds else 0.0
+    }
+
+
+def report(summary, config):
+    params = ', '.join(f'{name}={config[name]}' for name in MODEL_PARAMS)
+    print(f'\n{params}, train_size={config["train_size"]}, retrain_every={config["retrain_every"]}')
+    print(f"users {summary['users']} (trained {summary['users_trained']})  records {summary['records']}  "
+          f"scored {summary['scored']}  retrains {summary['retrains']}")
+    if summary['unpacked']:
+        print(f"computed features of {summary['unpacked']} records without packed ones "
+              f"(python migrate.py --backfill-features)")
+    print(f"alert rate {summary['alert_rate'] * 100:.2f}%  per user p50 {summary['user_alert_rate_p50'] * 100:.2f}%  "
+          f"p95 {summary['user_alert_rate_p95'] * 100:.2f}%")
+    print(f"scoring {summary['scores_per_sec']:.0f} records/s per process  "
+          f"train {summary['train_seconds']:.1f}s  wall {summary['wall_seconds']:.1f}s "
+          f"({summary['records_per_sec_wall']:.0f} records/s)")
+    print(f"cascade: box pass {summary['cascade_box_pass_rate'] * 100:.1f}%  "
+          f"cleared {summary['cascade_clear_rate'] * 100:.1f}%  "
+          f"false negatives {summary['cascade_fn_rate'] * 100:.2f}% of alerts "
+          f"(budget {config['cascade_fn_budget'] * 100:.2f}%)  "
+          f"est. scoring {summary['cascade_seconds']:.2f}s vs {summary['score_seconds']:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mongo-uri', default=None, help='defaults to MONGO_URI')
+    parser.add_argument('--database', default='tracker_db')
+    parser.add_argument('--users', help='comma-separated emails (default: every user with records)')
+    parser.add_argument('--max-users', type=int, default=0)
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--batch-size', type=int, default=2000)
+    parser.add_argument('--train-size', type=int, default=30)
+    parser.add_argument('--train-window', type=int, default=200)
+    parser.add_argument('--retrain-every', type=int, default=0, help='0 keeps the first model (production)')
+    parser.add_argument('--contamination', type=float, default=MODEL_CONTAMINATION)
+    parser.add_argument('--n-estimators', type=int, default=MODEL_N_ESTIMATORS)
+    parser.add_argument('--n-clusters', type=int, default=MODEL_N_CLUSTERS)
+    parser.add_argument('--threshold-percentile', type=float, default=MODEL_THRESHOLD_PERCENTILE)
+    parser.add_argument('--cascade-fn-budget', type=float, default=CASCADE_FN_BUDGET)
+    parser.add_argument('--output', help='write per-user results and the summary as JSON')
+    args = parser.parse_args()
+
+    load_dotenv()
+    mongo_uri = args.mongo_uri or os.getenv('MONGO_URI')
+    config = {name: getattr(args, name) for name in MODEL_PARAMS}
+    config.update(train_size=max(args.train_size, 1), train_window=args.train_window,
+                  retrain_every=args.retrain_every, batch_size=args.batch_size)
+
+    if args.users:
+        users = [email.strip() for email in args.users.split(',') if email.strip()]
+    else:
+        users = SyncMongoStore(pymongo.MongoClient(mongo_uri)[args.database]).get_behavior_users()
+    if args.max_users:
+        users = users[:args.max_users]
+
+    started = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=max(1, args.processes), mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker, initargs=(mongo_uri, args.database)) as pool:
+        futures = [pool.submit(_run_user, user_email, config) for user_email in users]
+        for done, future in enumerate(as_completed(futures), 1):
+            results.append(future.result())
+            print(f'\r{done}/{len(users)} users', end='', file=sys.stderr, flush=True)
+    print(file=sys.stderr)
+
+    summary = summarize(results, time.perf_counter() - started)
+    report(summary, config)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'config': config, 'summary': summary, 'users': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
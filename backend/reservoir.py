@@ -0,0 +1,176 @@
+"""Per-user stratified reservoir of behaviour records (``reservoirs`` collection).
+
+Every ingested behaviour record is offered to its user's reservoir, stratified
+by day of week x hour of day (168 strata) with reservoir sampling per stratum.
+The ``RESERVOIR_SIZE`` slots are shared equally by the strata the user has
+been seen in, so training gets an even sample of the whole routine however
+long the history is, instead of the last few minutes.
+
+A reservoir holds the records' packed feature vectors (see feature_store),
+stays in memory while its user is active and is written as one document::
+
+    rows           sampled feature vectors, concatenated
+    strata         stratum of each row (uint8)
+    seen           records offered per stratum (168 int32)
+    feature_version
+
+A user without a document is seeded once from their latest records.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from array import array
+from datetime import datetime
+
+from feature_store import FEATURE_SCHEMA_VERSION, ROW, features_from_bytes, packed_features
+
+RESERVOIR_SIZE = int(os.getenv('RESERVOIR_SIZE', 500))
+RESERVOIR_FLUSH_SECONDS = float(os.getenv('RESERVOIR_FLUSH_SECONDS', 30))
+# Reservoirs untouched this long are dropped from memory once written
+RESERVOIR_IDLE_SECONDS = float(os.getenv('RESERVOIR_IDLE_SECONDS', 600))
+STRATA = 7 * 24
+RESERVOIR_VERSION = 2
+
+logger = logging.getLogger(__name__)
+
+
+def stratum(record):
+    return int(record.get('day_of_week') or 0) % 7 * 24 + int(record.get('time_of_day') or 0) % 24
+
+
+class Reservoir:
+    """Fixed-size sample of one user's feature vectors, stratified by day and hour"""
+
+    def __init__(self, size=RESERVOIR_SIZE, rng=None):
+        self.size = size
+        self.rows = {}  # stratum -> [packed feature vector]
+        self.seen = [0] * STRATA
+        self.count = 0
+        self.rng = rng or random.Random()
+
+    def add(self, record):
+        """Offer one behaviour record (Algorithm R within its stratum)"""
+        key = stratum(record)
+        row = packed_features(record)
+        self.seen[key] += 1
+        rows = self.rows.setdefault(key, [])
+        if self.count < self.size or len(rows) < self.size // len(self.rows):
+            rows.append(row)
+            self.count += 1
+        else:
+            slot = self.rng.randrange(self.seen[key])
+            if slot < len(rows):
+                rows[slot] = row
+        # Strata below their equal share take slots from the fullest
+        while self.count > self.size:
+            fullest = max(self.rows.values(), key=len)
+            fullest.pop(self.rng.randrange(len(fullest)))
+            self.count -= 1
+
+    def features(self, limit=None):
+        """float32 feature matrix of the sample (at most limit random rows)"""
+        rows = [row for stratum_rows in self.rows.values() for row in stratum_rows]
+        if limit and len(rows) > limit:
+            rows = self.rng.sample(rows, limit)
+        return features_from_bytes(b''.join(rows))
+
+    def to_document(self):
+        strata = [key for key, rows in self.rows.items() for _ in rows]
+        return {
+            'version': RESERVOIR_VERSION,
+            'feature_version': FEATURE_SCHEMA_VERSION,
+            'rows': b''.join(row for rows in self.rows.values() for row in rows),
+            'strata': array('B', strata).tobytes(),
+            'seen': array('i', self.seen).tobytes(),
+            'records': self.count
+        }
+
+    @classmethod
+    def from_document(cls, document, size=RESERVOIR_SIZE):
+        """Reservoir from to_document() output, or None if the layout changed"""
+        if (document.get('version') != RESERVOIR_VERSION
+                or document.get('feature_version') != FEATURE_SCHEMA_VERSION):
+            return None
+        reservoir = cls(size)
+        strata, seen = array('B'), array('i')
+        strata.frombytes(document['strata'])
+        seen.frombytes(document['seen'])
+        rows = bytes(document['rows'])
+        for index, key in enumerate(strata):
+            reservoir.rows.setdefault(key, []).append(rows[index * ROW.size:(index + 1) * ROW.size])
+        reservoir.seen = list(seen)
+        reservoir.count = len(strata)
+        return reservoir
+
+
+class Reservoirs:
+    """Ingest-time training samples per user, written back in the background"""
+
+    def __init__(self, store, size=RESERVOIR_SIZE):
+        self.store = store
+        self.size = size
+        # user_email -> {'reservoir', 'dirty', 'used'}
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, user_email):
+        """(entry, seeded): the cached reservoir, loaded or seeded on first use"""
+        with self._lock:
+            entry = self._entries.get(user_email)
+        if entry is not None:
+            return entry, False
+        document = self.store.get_reservoir(user_email)
+        reservoir = Reservoir.from_document(document, self.size) if document else None
+        seeded = reservoir is None
+        if seeded:
+            reservoir = Reservoir(self.size)
+            for record in self.store.get_recent_behaviors(user_email, self.size):
+                reservoir.add(record)
+        with self._lock:
+            entry = self._entries.setdefault(user_email, {'reservoir': reservoir, 'dirty': seeded,
+                                                          'used': time.monotonic()})
+        return entry, seeded
+
+    def add(self, behavior_record, stored=True):
+        """Offer a new behaviour record to its user's reservoir"""
+        entry, seeded = self._entry(behavior_record['user_email'])
+        if seeded and stored:
+            # Seeded from stored records, which already include this one
+            return
+        with self._lock:
+            entry['reservoir'].add(behavior_record)
+            entry['dirty'] = True
+            entry['used'] = time.monotonic()
+
+    def features(self, user_email, limit=None):
+        """Training feature matrix for a user: one document read at most"""
+        entry, _ = self._entry(user_email)
+        with self._lock:
+            entry['used'] = time.monotonic()
+            return entry['reservoir'].features(limit)
+
+    def flush(self, max_idle=None):
+        """Write changed reservoirs; forget those idle for max_idle seconds"""
+        now = time.monotonic()
+        with self._lock:
+            pending = []
+            for user_email, entry in list(self._entries.items()):
+                if entry['dirty']:
+                    pending.append((user_email, entry['reservoir'].to_document()))
+                    entry['dirty'] = False
+                if max_idle is not None and now - entry['used'] >= max_idle:
+                    del self._entries[user_email]
+        for user_email, document in pending:
+            document['updated_at'] = datetime.utcnow()
+            self.store.save_reservoir(user_email, document)
+
+    def run_flusher(self, sleep=time.sleep, interval=RESERVOIR_FLUSH_SECONDS):
+        """Background loop writing reservoirs that changed"""
+        while True:
+            sleep(interval)
+            try:
+                self.flush(max_idle=RESERVOIR_IDLE_SECONDS)
+            except Exception:
+                logger.exception('reservoir flush failed')
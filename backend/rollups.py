@@ -0,0 +1,227 @@
+"""Incrementally maintained per-user statistics (``rollups`` collection).
+
+One document per user holds counters that dashboard queries would otherwise
+recompute from raw records::
+
+    devices.<device_id>.sections.<section_id>.visits              section entries
+    devices.<device_id>.sections.<section_id>.dwell               seconds spent in the section
+    devices.<device_id>.sections.<section_id>.hourly_dwell.<hour> those seconds per hour of day
+    devices.<device_id>.open                                      {section_id, entered_at} of the visit in progress
+    pairs.<device1>:<device2>.colocated_minutes                   minutes the pair was within CO_LOCATION_METERS
+    pairs.<device1>:<device2>.same_section_minutes                minutes the pair shared a section
+    pairs.<device1>:<device2>.recent                              last ROLLUP_RECENT_MINUTES per-minute buckets
+
+Section counters are fed by geofence transitions; dwell is added when a visit
+ends, and ``current_sections`` credits the open visit up to the device's last
+fix. Pair samples are accumulated in memory per minute and written once per
+pair and minute. ``python migrate.py --backfill-rollups`` rebuilds the section
+counters from the geofence event log.
+"""
+import copy
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+CO_LOCATION_METERS = float(os.getenv('CO_LOCATION_METERS', 15))
+ROLLUP_RECENT_MINUTES = int(os.getenv('ROLLUP_RECENT_MINUTES', 60))
+
+logger = logging.getLogger(__name__)
+
+
+def pair_key(device1_id, device2_id):
+    return ':'.join(sorted((device1_id, device2_id)))
+
+
+def split_hours(start, end):
+    """Seconds of [start, end] falling into each hour of day"""
+    seconds = {}
+    cursor = start
+    while cursor < end:
+        next_hour = cursor.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+        segment_end = min(next_hour, end)
+        seconds[cursor.hour] = seconds.get(cursor.hour, 0) + (segment_end - cursor).total_seconds()
+        cursor = segment_end
+    return seconds
+
+
+def add_dwell(section, entered_at, left_at):
+    """Credit a visit's seconds to a section's counters, in place"""
+    section['dwell'] = section.get('dwell', 0) + (left_at - entered_at).total_seconds()
+    hourly = section.setdefault('hourly_dwell', {})
+    for hour, seconds in split_hours(entered_at, left_at).items():
+        hourly[str(hour)] = hourly.get(str(hour), 0) + seconds
+
+
+def current_sections(device_rollup, last_seen=None):
+    """Section counters of a device, with the open visit credited up to last_seen"""
+    sections = copy.deepcopy(device_rollup.get('sections', {}))
+    visit = device_rollup.get('open')
+    if visit and last_seen and last_seen > visit['entered_at']:
+        add_dwell(sections.setdefault(str(visit['section_id']), {}), visit['entered_at'], last_seen)
+    return sections
+
+
+def section_counters(events):
+    """Rebuild {device_id: (sections, open visit)} from time-ordered geofence events"""
+    devices = {}
+    for event in events:
+        sections, visit = devices.get(event['device_id'], ({}, None))
+        section = sections.setdefault(str(event['section_id']), {})
+        if event['type'] == 'enter':
+            section['visits'] = section.get('visits', 0) + 1
+            visit = {'section_id': event['section_id'], 'entered_at': event['timestamp']}
+        elif event['type'] == 'exit':
+            add_dwell(section, event['timestamp'] - timedelta(seconds=event['duration']), event['timestamp'])
+            visit = None
+        devices[event['device_id']] = (sections, visit)
+    return devices
+
+
+class Rollups:
+    """Ingest-time counters per user, device, section, hour and device pair"""
+
+    def __init__(self, store):
+        self.store = store
+        # (user_email, pair) -> open per-minute bucket
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def record_section_events(self, user_email, records):
+        """Fold geofence event-log records into the user's rollup (one write)"""
+        increments = {}
+        # Open visit of each device after these records, None once it ended
+        visits = {}
+        for record in records:
+            prefix = f"devices.{record['device_id']}.sections.{record['section_id']}"
+            if record['type'] == 'enter':
+                key = f'{prefix}.visits'
+                increments[key] = increments.get(key, 0) + 1
+                visits[record['device_id']] = {'section_id': record['section_id'], 'entered_at': record['timestamp']}
+            elif record['type'] == 'exit':
+                section = {}
+                add_dwell(section, record['timestamp'] - timedelta(seconds=record['duration']), record['timestamp'])
+                increments[f'{prefix}.dwell'] = increments.get(f'{prefix}.dwell', 0) + section['dwell']
+                for hour, seconds in section['hourly_dwell'].items():
+                    key = f'{prefix}.hourly_dwell.{hour}'
+                    increments[key] = increments.get(key, 0) + seconds
+                visits[record['device_id']] = None
+        if not increments and not visits:
+            return
+        update = {'$set': {'updated_at': datetime.utcnow()}}
+        if increments:
+            update['$inc'] = increments
+        for device_id, visit in visits.items():
+            if visit:
+                update['$set'][f'devices.{device_id}.open'] = visit
+            else:
+                update.setdefault('$unset', {})[f'devices.{device_id}.open'] = ''
+        self.store.update_rollup(user_email, update)
+
+    def record_pair_sample(self, behavior_record):
+        """Add one pair behaviour sample to its per-minute bucket"""
+        user_email = behavior_record['user_email']
+        key = (user_email, pair_key(behavior_record['device1_id'], behavior_record['device2_id']))
+        minute = behavior_record['timestamp'].replace(second=0, microsecond=0)
+        closed = None
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket and bucket['minute'] != minute:
+                closed = self._buckets.pop(key)
+                bucket = None
+            if bucket is None:
+                bucket = {'minute': minute, 'samples': 0, 'distance_sum': 0.0,
+                          'same_section': 0, 'moving_together': 0, 'opened': time.monotonic()}
+                self._buckets[key] = bucket
+            bucket['samples'] += 1
+            bucket['distance_sum'] += behavior_record['distance_between_devices']
+            bucket['same_section'] += behavior_record['same_section']
+            bucket['moving_together'] += behavior_record['moving_together']
+        if closed:
+            self._write_bucket(key, closed)
+
+    def _write_bucket(self, key, bucket):
+        user_email, pair = key
+        prefix = f'pairs.{pair}'
+        avg_distance = bucket['distance_sum'] / bucket['samples']
+        self.store.update_rollup(user_email, {
+            '$inc': {
+                f'{prefix}.colocated_minutes': 1 if avg_distance <= CO_LOCATION_METERS else 0,
+                f'{prefix}.same_section_minutes': 1 if bucket['same_section'] * 2 > bucket['samples'] else 0,
+                f'{prefix}.samples': bucket['samples']
+            },
+            '$push': {f'{prefix}.recent': {
+                '$each': [{
+                    'minute': bucket['minute'],
+                    'samples': bucket['samples'],
+                    'distance_sum': bucket['distance_sum'],
+                    'same_section': bucket['same_section'],
+                    'moving_together': bucket['moving_together']
+                }],
+                '$slice': -ROLLUP_RECENT_MINUTES
+            }},
+            '$set': {'updated_at': datetime.utcnow()}
+        })
+
+    def flush(self, max_age=None):
+        """Write open pair buckets (all, or those older than max_age seconds); returns the users written"""
+        now = time.monotonic()
+        with self._lock:
+            ready = [key for key, bucket in self._buckets.items()
+                     if max_age is None or now - bucket['opened'] >= max_age]
+            buckets = [(key, self._buckets.pop(key)) for key in ready]
+        for key, bucket in buckets:
+            self._write_bucket(key, bucket)
+        return {user_email for (user_email, _), _ in buckets}
+
+    def run_flusher(self, sleep=time.sleep, interval=30, on_flush=None):
+        """Background loop closing buckets of pairs that stopped reporting
+        
+        on_flush is called with the users whose rollups changed.
+        """
+        while True:
+            sleep(interval)
+            try:
+                users = self.flush(max_age=60)
+                if users and on_flush is not None:
+                    on_flush(users)
+            except Exception:
+                logger.exception('rollup flush failed')
+
+    def get(self, user_email):
+        return self.store.get_rollup(user_email) or {}
+
+    def recent_pair_summary(self, user_email, minutes=10):
+        """Per-pair averages over the last minutes, from minute buckets"""
+        cutoff = datetime.utcnow().replace(second=0, microsecond=0) - timedelta(minutes=minutes)
+        totals = {}
+
+        def add(pair, bucket):
+            if bucket['minute'] < cutoff:
+                return
+            total = totals.setdefault(pair, {'samples': 0, 'distance_sum': 0.0,
+                                             'same_section': 0, 'moving_together': 0})
+            for field in total:
+                total[field] += bucket[field]
+
+        for pair, stats in self.get(user_email).get('pairs', {}).items():
+            for bucket in stats.get('recent', []):
+                add(pair, bucket)
+        with self._lock:
+            open_buckets = [(pair, dict(bucket)) for (email, pair), bucket in self._buckets.items()
+                            if email == user_email]
+        for pair, bucket in open_buckets:
+            add(pair, bucket)
+
+        results = []
+        for pair, total in totals.items():
+            device1, device2 = pair.split(':')
+            results.append({
+                '_id': {'device1': device1, 'device2': device2},
+                'avg_distance': total['distance_sum'] / total['samples'],
+                'same_section_count': total['same_section'],
+                'moving_together_count': total['moving_together'],
+                'total_samples': total['samples']
+            })
+        return results
@@ -0,0 +1,169 @@
+"""Multi-worker support: shared Socket.IO message queue and user affinity.
+
+Socket.IO rooms are shared between workers through a message queue
+(``SOCKETIO_MESSAGE_QUEUE``). Redis/AMQP/Kafka URLs are handed to
+Flask-SocketIO as-is; ``local://host:port`` selects a small in-box broker
+(``python scaling.py broker``) that stands in for Redis in development and
+load tests.
+
+Each user is owned by exactly one worker, chosen by consistent hashing of
+``user_email`` over ``WORKER_NODES``, so a user's model and device state
+only ever live in one process.
+"""
+import bisect
+import hashlib
+import logging
+import os
+import sys
+import threading
+from multiprocessing.connection import Client, Listener
+
+import socketio
+
+SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE')
+# Shared secret of the local broker; connections unpickle what they receive
+SOCKETIO_BROKER_AUTHKEY = os.getenv('SOCKETIO_BROKER_AUTHKEY')
+
+# Public URL of every worker, e.g. "http://10.0.0.5:5001,http://10.0.0.5:5002"
+WORKER_NODES = [node.strip() for node in os.getenv('WORKER_NODES', '').split(',') if node.strip()]
+# URL of this worker; must be one of WORKER_NODES
+WORKER_ID = os.getenv('WORKER_ID', WORKER_NODES[0] if WORKER_NODES else 'local')
+HASH_RING_REPLICAS = int(os.getenv('HASH_RING_REPLICAS', 160))
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(key):
+    return int(hashlib.md5(key.encode()).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """Consistent hash ring mapping user emails to worker nodes"""
+
+    def __init__(self, nodes, replicas=HASH_RING_REPLICAS):
+        self.nodes = list(nodes)
+        self.replicas = replicas
+        self._keys = []
+        self._owners = {}
+        for node in self.nodes:
+            for i in range(replicas):
+                point = _hash(f"{node}#{i}")
+                self._owners[point] = node
+                bisect.insort(self._keys, point)
+
+    def get_node(self, key):
+        """Return the node owning key"""
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._owners[self._keys[index]]
+
+
+worker_ring = HashRing(WORKER_NODES)
+
+
+def owner_for(user_email):
+    """Return the worker URL that owns user_email (None when running single-worker)"""
+    return worker_ring.get_node(user_email)
+
+
+def owns_user(user_email):
+    """Check whether this worker should hold state for user_email"""
+    if len(WORKER_NODES) < 2:
+        return True
+    return owner_for(user_email) == WORKER_ID
+
+
+class LocalQueueManager(socketio.PubSubManager):
+    """Socket.IO client manager backed by the local broker (``local://host:port``)"""
+    name = 'local'
+
+    def __init__(self, url, channel='flask-socketio', write_only=False, logger=None):
+        host, port = url[len('local://'):].rsplit(':', 1)
+        self.address = (host or '127.0.0.1', int(port))
+        self.authkey = broker_authkey()
+        self._publisher = None
+        self._publish_lock = threading.Lock()
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+
+    def _connect(self, role):
+        conn = Client(self.address, authkey=self.authkey)
+        conn.send({'role': role, 'channel': self.channel})
+        return conn
+
+    def _publish(self, data):
+        with self._publish_lock:
+            try:
+                if self._publisher is None:
+                    self._publisher = self._connect('pub')
+                self._publisher.send(data)
+            except (OSError, EOFError):
+                # Broker restarted, reconnect once and retry
+                self._publisher = self._connect('pub')
+                self._publisher.send(data)
+
+    def _listen(self):
+        while True:
+            try:
+                conn = self._connect('sub')
+                while True:
+                    yield conn.recv()
+            except (OSError, EOFError):
+                self.server.sleep(1)
+
+
+def broker_authkey():
+    """Authkey of the local broker, which must not run without one"""
+    if not SOCKETIO_BROKER_AUTHKEY:
+        raise RuntimeError('SOCKETIO_BROKER_AUTHKEY must be set to use the local broker')
+    return SOCKETIO_BROKER_AUTHKEY.encode()
+
+
+def create_client_manager(url=SOCKETIO_MESSAGE_QUEUE):
+    """Build the SocketIO keyword arguments for the configured message queue"""
+    if not url:
+        return {}
+    if url.startswith('local://'):
+        return {'client_manager': LocalQueueManager(url)}
+    return {'message_queue': url}
+
+
+def run_local_broker(address=('127.0.0.1', 6380)):
+    """Fan every published message out to all subscribers of the same channel"""
+    listener = Listener(address, authkey=broker_authkey())
+    subscribers = {}
+    lock = threading.Lock()
+
+    def serve_publisher(conn, channel):
+        try:
+            while True:
+                message = conn.recv()
+                # Sends are serialized so frames from different publishers never interleave
+                with lock:
+                    for sub in list(subscribers.get(channel, [])):
+                        try:
+                            sub.send(message)
+                        except OSError:
+                            subscribers[channel].remove(sub)
+        except (OSError, EOFError):
+            conn.close()
+
+    logger.info('local Socket.IO broker listening', extra={'host': address[0], 'port': address[1]})
+    while True:
+        conn = listener.accept()
+        hello = conn.recv()
+        if hello.get('role') == 'sub':
+            with lock:
+                subscribers.setdefault(hello['channel'], []).append(conn)
+        else:
+            threading.Thread(target=serve_publisher, args=(conn, hello['channel']), daemon=True).start()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'broker':
+        from log_config import configure_logging
+        configure_logging()
+        host, port = (sys.argv[2] if len(sys.argv) > 2 else '127.0.0.1:6380').rsplit(':', 1)
+        run_local_broker((host, int(port)))
+    else:
+        print("Usage: python scaling.py broker [host:port]")
@@ -0,0 +1,78 @@
+"""Cheap system status for /api/system-status and /api/health.
+
+Collection sizes come from ``estimated_document_count`` (collection metadata,
+no scan) and the saved model count from a directory listing, both cached and
+refreshed every ``STATUS_REFRESH_SECONDS`` by a background loop. Counters
+maintained at ingest time report this process's activity since start.
+"""
+import logging
+import os
+import threading
+import time
+
+STATUS_REFRESH_SECONDS = float(os.getenv('STATUS_REFRESH_SECONDS', 30))
+STATUS_COLLECTIONS = ('users', 'devices', 'locations', 'device_behaviors')
+
+logger = logging.getLogger(__name__)
+
+
+def count_models(models_dir):
+    if not os.path.exists(models_dir):
+        return 0
+    return len([f for f in os.listdir(models_dir) if f.endswith('.pkl')])
+
+
+class StatusSnapshot:
+    """Periodically refreshed collection and model counts plus process counters"""
+
+    def __init__(self, store, models_dir='models', refresh_seconds=STATUS_REFRESH_SECONDS):
+        self.store = store
+        self.models_dir = models_dir
+        self.refresh_seconds = refresh_seconds
+        self._snapshot = None
+        self._refreshed_at = 0.0
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def refresh(self):
+        snapshot = {
+            'counts': {name: self.store.estimated_count(name) for name in STATUS_COLLECTIONS},
+            'trained_models': count_models(self.models_dir)
+        }
+        with self._lock:
+            self._snapshot = snapshot
+            self._refreshed_at = time.monotonic()
+        return snapshot
+
+    def mark_stale(self):
+        """Force the next get() to refresh (e.g. after a model was saved)"""
+        with self._lock:
+            self._refreshed_at = 0.0
+
+    def get(self):
+        """Return (snapshot, age in seconds), refreshing inline only when stale"""
+        with self._lock:
+            snapshot, age = self._snapshot, time.monotonic() - self._refreshed_at
+        if snapshot is None or age > self.refresh_seconds * 2:
+            snapshot, age = self.refresh(), 0.0
+        return snapshot, age
+
+    def exact_counts(self):
+        """Exact collection sizes; scans, only for explicit requests"""
+        return {name: self.store.count(name) for name in STATUS_COLLECTIONS}
+
+    def run_refresher(self, sleep=time.sleep):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('status refresh failed')
+            sleep(self.refresh_seconds)
@@ -0,0 +1,229 @@
+"""Streaming anomaly detector: half-space trees (Tan, Ting & Liu, 2011).
+
+``StreamingBehaviorModel`` is a drop-in alternative to the batch
+``DeviceBehaviorModel`` for users who opt in. It scores every behaviour
+record and then learns from it ("test-then-train"), so there is no training
+phase and no retraining. Each record costs ``n_trees * height`` array lookups
+and memory is fixed by the tree shape.
+
+Each tree splits a randomly perturbed feature workspace, derived from the
+first window of records, at the midpoint of a random feature per level.
+Nodes count how many records passed through them in the latest window
+(``latest``) and in the window before (``reference``). A record's score is
+the sum over trees of ``reference mass * 2 ** depth`` at the first node on
+its path whose reference mass is at most ``size_limit`` (the leaf if none
+is). Low scores mean
+sparsely visited regions. Records scoring below the
+``MODEL_THRESHOLD_PERCENTILE`` of recent scores are flagged.
+"""
+import logging
+import os
+import pickle
+
+from ml_model import MODEL_THRESHOLD_PERCENTILE, N_FEATURES, DeviceBehaviorModel
+
+STREAM_TREES = int(os.getenv('STREAM_TREES', 25))
+STREAM_HEIGHT = int(os.getenv('STREAM_HEIGHT', 8))
+STREAM_WINDOW = int(os.getenv('STREAM_WINDOW', 250))
+# Recent scores kept for the alert threshold
+STREAM_SCORE_HISTORY = int(os.getenv('STREAM_SCORE_HISTORY', 1000))
+
+logger = logging.getLogger(__name__)
+
+
+class HalfSpaceTrees:
+    """Fixed-size half-space tree ensemble over dense feature vectors"""
+
+    def __init__(self, n_features, n_trees=STREAM_TREES, height=STREAM_HEIGHT, window_size=STREAM_WINDOW,
+                 seed=None):
+        import numpy as np
+        self.n_features = n_features
+        self.n_trees = n_trees
+        self.height = height
+        self.window_size = window_size
+        self.size_limit = 0.1 * window_size
+        self.seed = seed
+        internal = 2 ** height - 1
+        nodes = 2 ** (height + 1) - 1
+        self.split_dim = np.zeros((n_trees, internal), dtype=np.int16)
+        self.split_value = np.zeros((n_trees, internal))
+        self.reference = np.zeros((n_trees, nodes), dtype=np.int32)
+        self.latest = np.zeros((n_trees, nodes), dtype=np.int32)
+        self._trees = np.arange(n_trees)
+        self._depth_weight = 2.0 ** np.arange(height + 1)
+        self._first_window = []
+        self.built = False
+        self.seen = 0
+
+    @property
+    def ready(self):
+        """True once a full reference window has been learned"""
+        return self.built
+
+    def _build(self, sample):
+        """Random splits over a workspace perturbed around the first window's range"""
+        import numpy as np
+        rng = np.random.default_rng(self.seed)
+        mins, maxs = sample.min(axis=0), sample.max(axis=0)
+        for tree in range(self.n_trees):
+            pivot = rng.uniform(mins, maxs)
+            spread = np.maximum(2 * np.maximum(pivot - mins, maxs - pivot), 1e-9)
+            stack = [(0, pivot - spread, pivot + spread)]
+            while stack:
+                node, low, high = stack.pop()
+                if node >= len(self.split_dim[tree]):
+                    continue
+                dim = rng.integers(self.n_features)
+                middle = (low[dim] + high[dim]) / 2
+                self.split_dim[tree, node] = dim
+                self.split_value[tree, node] = middle
+                left_high, right_low = high.copy(), low.copy()
+                left_high[dim] = middle
+                right_low[dim] = middle
+                stack.append((2 * node + 1, low, left_high))
+                stack.append((2 * node + 2, right_low, high))
+        self.built = True
+
+    def _path(self, x):
+        """Node index per level (height + 1, n_trees) for one record"""
+        import numpy as np
+        nodes = np.zeros(self.n_trees, dtype=np.int64)
+        path = [nodes]
+        for _ in range(self.height):
+            dims = self.split_dim[self._trees, nodes]
+            nodes = 2 * nodes + 1 + (x[dims] > self.split_value[self._trees, nodes])
+            path.append(nodes)
+        return np.stack(path)
+
+    def score(self, x):
+        """Mass score of one record (higher = more normal)"""
+        import numpy as np
+        masses = self.reference[self._trees, self._path(x)]
+        small = masses <= self.size_limit
+        depth = np.where(small.any(axis=0), small.argmax(axis=0), self.height)
+        return float((masses[depth, self._trees] * self._depth_weight[depth]).sum())
+
+    def max_score(self):
+        return float(self.n_trees * self.window_size * 2.0 ** self.height)
+
+    def learn(self, x):
+        """Count the record in the latest window; swap windows every window_size records"""
+        import numpy as np
+        self.seen += 1
+        if not self.built:
+            self._first_window.append(x)
+            if len(self._first_window) < self.window_size:
+                return
+            sample = np.array(self._first_window)
+            self._first_window = []
+            self._build(sample)
+            for row in sample:
+                self.latest[self._trees, self._path(row)] += 1
+        else:
+            self.latest[self._trees, self._path(x)] += 1
+        if self.seen % self.window_size == 0:
+            self.reference, self.latest = self.latest, np.zeros_like(self.latest)
+
+
+class StreamingBehaviorModel(DeviceBehaviorModel):
+    """DeviceBehaviorModel interface backed by half-space trees that learn online"""
+
+    kind = 'streaming'
+
+    def __init__(self, user_email, n_trees=STREAM_TREES, height=STREAM_HEIGHT, window_size=STREAM_WINDOW,
+                 threshold_percentile=MODEL_THRESHOLD_PERCENTILE, seed=None):
+        import numpy as np
+        super().__init__(user_email, threshold_percentile=threshold_percentile)
+        self.detector = HalfSpaceTrees(N_FEATURES, n_trees, height, window_size, seed)
+        self.recent_scores = np.zeros(STREAM_SCORE_HISTORY)
+        self.recent_count = 0
+        self.records_since_snapshot = 0
+
+    def _threshold(self):
+        import numpy as np
+        filled = min(self.recent_count, len(self.recent_scores))
+        if filled < self.detector.window_size:
+            return None
+        return float(np.percentile(self.recent_scores[:filled], self.threshold_percentile))
+
+    def learn_one(self, current_behavior):
+        """Learn a record without scoring it"""
+        self.detector.learn(self.extract_features([current_behavior])[0].astype(float))
+        self.records_since_snapshot += 1
+        self.is_trained = self.detector.ready
+
+    def predict_anomaly(self, current_behavior):
+        """Score the record against the reference window, then learn it"""
+        x = self.extract_features([current_behavior])[0].astype(float)
+        if not self.detector.ready:
+            self.detector.learn(x)
+            self.records_since_snapshot += 1
+            self.is_trained = self.detector.ready
+            return False, 0.0, "Learning first window", {}
+
+        score = self.detector.score(x)
+        threshold = self._threshold()
+        is_anomaly = threshold is not None and score < threshold
+        self.recent_scores[self.recent_count % len(self.recent_scores)] = score
+        self.recent_count += 1
+        self.detector.learn(x)
+        self.records_since_snapshot += 1
+
+        confidence = 1.0 - score / self.detector.max_score()
+        return is_anomaly, confidence, "Prediction successful", {
+            'score': score,
+            'threshold': threshold if threshold is not None else 0.0,
+            'is_anomaly': bool(is_anomaly),
+            'confidence': float(confidence),
+            'cascade': 'streaming',
+            'features': self.feature_summary(current_behavior)
+        }
+
+    def save_model(self, filepath):
+        """Snapshot the detector state to disk"""
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        tmp_path = filepath + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({
+                'kind': self.kind,
+                'user_email': self.user_email,
+                'detector': self.detector,
+                'recent_scores': self.recent_scores,
+                'recent_count': self.recent_count,
+                'threshold_percentile': self.threshold_percentile
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, filepath)
+        self.records_since_snapshot = 0
+        logger.debug('streaming snapshot saved', extra={'path': filepath})
+
+    def load_model(self, filepath):
+        """Restore a snapshot written by save_model"""
+        if not os.path.exists(filepath):
+            return False
+        try:
+            with open(filepath, 'rb') as f:
+                state = pickle.load(f)
+            if state.get('kind') != self.kind:
+                return False
+            self.detector = state['detector']
+            self.recent_scores = state['recent_scores']
+            self.recent_count = state['recent_count']
+            self.threshold_percentile = state.get('threshold_percentile', self.threshold_percentile)
+            self.is_trained = self.detector.ready
+            self.records_since_snapshot = 0
+            logger.debug('streaming snapshot loaded', extra={'path': filepath})
+            return True
+        except Exception as e:
+            logger.warning('streaming snapshot load failed', extra={'path': filepath, 'error': str(e)})
+            return False
+
+    def get_model_info(self):
+        return {
+            "status": "Trained" if self.is_trained else "Learning",
+            "model_type": "Half-space trees (streaming)",
+            "records_seen": self.detector.seen,
+            "trees": self.detector.n_trees,
+            "height": self.detector.height,
+            "window_size": self.detector.window_size,
+            "anomaly_threshold": self._threshold()
+        }
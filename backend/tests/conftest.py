@@ -0,0 +1,14 @@
+import os
+import sys
+
+import pytest
+
+# Backend modules are imported as top-level modules, as the app does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def store():
+    import mongomock
+    from data_access import SyncMongoStore
+    return SyncMongoStore(mongomock.MongoClient().tracker_db)
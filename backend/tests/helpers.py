@@ -0,0 +1,34 @@
+import datetime
+import random
+
+START = datetime.datetime(2026, 10, 5, 8, 0)  # a Monday
+
+
+def behavior_records(count, user_email='a@x.com', seed=1, start=START, step=datetime.timedelta(minutes=1)):
+    """Synthetic behaviour records as analyze_device_pair stores them (without packed features)"""
+    rng = random.Random(seed)
+    records = []
+    for i in range(count):
+        timestamp = start + i * step
+        section1, section2 = rng.choice([1, 2, 3]), rng.choice([0, 1, 2, 3])
+        speed1, speed2 = rng.uniform(0, 2), rng.uniform(0, 2)
+        records.append({
+            'user_email': user_email,
+            'device1_id': 'd1',
+            'device2_id': 'd2',
+            'distance_between_devices': rng.uniform(0, 40),
+            'device1_section_id': section1,
+            'device2_section_id': section2,
+            'both_inside_campus': int(section1 > 0 and section2 > 0),
+            'movement_speed_device1': speed1,
+            'movement_speed_device2': speed2,
+            'time_of_day': timestamp.hour,
+            'day_of_week': timestamp.weekday(),
+            'same_section': int(section1 == section2),
+            'device1_outside': int(section1 == 0),
+            'device2_outside': int(section2 == 0),
+            'moving_together': 0,
+            'section_difference': abs(section1 - section2),
+            'timestamp': timestamp
+        })
+    return records
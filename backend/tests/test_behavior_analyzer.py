@@ -0,0 +1,43 @@
+import datetime
+
+from behavior_analyzer import BehaviorAnalyzer, PairBatch
+from tests.helpers import START
+
+
+def test_pattern_cache_invalidated_by_pattern_updates(store):
+    analyzer = BehaviorAnalyzer(store)
+    store.upsert_device_pattern('a@x.com', 'd1', {'$set': {'companion_devices': []}})
+    assert analyzer.get_device_patterns_bulk('a@x.com', ['d1'])['d1']['companion_devices'] == []
+    analyzer.update_device_pattern('a@x.com', 'd1', {'speed': 0, 'timestamp': None, 'section_id': 1,
+                                                     'with_other_device': 'd2'})
+    assert analyzer.get_device_patterns_bulk('a@x.com', ['d1'])['d1']['companion_devices'] == ['d2']
+
+
+def test_uncached_patterns_see_writes_from_other_processes(store):
+    analyzer = BehaviorAnalyzer(store)
+    store.upsert_device_pattern('a@x.com', 'd1', {'$set': {'companion_devices': []}})
+    analyzer.get_device_patterns_bulk('a@x.com', ['d1'])
+    # Written by the owning worker, this process's cache is not invalidated
+    store.upsert_device_pattern('a@x.com', 'd1', {'$set': {'companion_devices': ['d2']}})
+    assert analyzer.get_device_patterns_bulk('a@x.com', ['d1'])['d1']['companion_devices'] == []
+    assert analyzer.get_device_patterns_bulk('a@x.com', ['d1'], use_cache=False)['d1']['companion_devices'] == ['d2']
+    assert len(analyzer.pattern_cache) == 1
+
+
+def test_batch_writes_records_and_patterns_once(store):
+    analyzer = BehaviorAnalyzer(store)
+    batch = PairBatch()
+    for i in range(3):
+        device1 = {'device_id': 'd1', 'latitude': 6.9271 + i * 1e-4, 'longitude': 79.8612, 'current_section': 'Library'}
+        device2 = {'device_id': 'd2', 'latitude': 6.9271, 'longitude': 79.8612, 'current_section': 'Canteen'}
+        analyzer.analyze_device_pair('a@x.com', device1, device2, START + datetime.timedelta(seconds=10 * i), batch)
+    assert store.count('device_behaviors') == 0 and store.count('device_patterns') == 0
+    # Speeds come from the previous record in the batch: ~11 m in 10 s for d1, still for d2
+    assert [round(record['movement_speed_device1'], 1) for record in batch.records] == [0, 1.1, 1.1]
+    assert [record['movement_speed_device2'] for record in batch.records] == [0, 0, 0]
+
+    analyzer.flush_batch('a@x.com', batch)
+    assert store.count('device_behaviors') == 3
+    pattern = store.get_device_pattern('a@x.com', 'd1')
+    assert [entry['section_id'] for entry in pattern['movement_patterns']] == [2, 2, 2]
+    assert pattern['companion_devices'] == ['d2']
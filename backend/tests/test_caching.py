@@ -0,0 +1,71 @@
+import caching
+from caching import ChangeTracker, TokenCache, TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(caching.time, 'monotonic', clock)
+    cache = TTLCache(maxsize=10, ttl=30)
+    cache.set('a', 1)
+    cache.set('b', 2, ttl=60)
+    cache.set('c', 3, ttl=0)
+    clock.now += 31
+    assert (cache.get('a'), cache.get('b'), cache.get('c', 'missing')) == (None, 2, 'missing')
+    assert (cache.hits, cache.misses, len(cache)) == (1, 2, 1)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (1, None, 3)
+    cache.pop('a')
+    cache.pop('missing')
+    assert len(cache) == 1
+
+
+def test_token_cache_invalidates_all_tokens_of_a_user():
+    cache = TokenCache(maxsize=2, ttl=60)
+    cache.set('t1', {'email': 'a@x.com'})
+    cache.set('t2', {'email': 'a@x.com'})
+    cache.set('t3', {'email': 'b@x.com'})
+    # t1 was evicted, and no longer indexed under its user
+    assert cache._tokens_by_email == {'a@x.com': {'t2'}, 'b@x.com': {'t3'}}
+    cache.invalidate_user('a@x.com')
+    assert (cache.get('t2'), cache.get('t3')) == (None, {'email': 'b@x.com'})
+    cache.clear()
+    assert cache._tokens_by_email == {}
+
+
+def test_etag_changes_only_with_its_scope(store):
+    tracker = ChangeTracker(store)
+    tracker.bump('a@x.com', 'ml')
+    devices, patterns = tracker.etag('a@x.com', 'devices'), tracker.etag('a@x.com', 'patterns', 60)
+    tracker.bump('a@x.com', 'devices', 'locations')
+    assert tracker.etag('a@x.com', 'devices') != devices
+    assert tracker.etag('a@x.com', 'patterns', 60) == patterns != tracker.etag('a@x.com', 'patterns', 30)
+    assert (tracker.version('a@x.com', 'locations'), tracker.version('b@x.com', 'devices')) == (1, 0)
+
+
+def test_etags_are_shared_between_workers_and_differ_per_user(store):
+    tracker, other_worker = ChangeTracker(store), ChangeTracker(store)
+    tracker.bump('a@x.com', 'devices')
+    # A write on one worker invalidates the tags every worker issues
+    assert other_worker.etag('a@x.com', 'devices') == tracker.etag('a@x.com', 'devices')
+    assert tracker.etag('a@x.com', 'devices') != tracker.etag('b@x.com', 'devices')
+    assert 'a@x.com' not in tracker.etag('a@x.com', 'devices')
+    # Counters that were lost restart under a new epoch, so old tags do not match
+    etag = tracker.etag('a@x.com', 'devices')
+    store.change_versions.delete_many({})
+    tracker.bump('a@x.com', 'devices')
+    assert tracker.version('a@x.com', 'devices') == 1 and tracker.etag('a@x.com', 'devices') != etag
@@ -0,0 +1,183 @@
+import asyncio
+import datetime
+
+import pytest
+
+from data_access import MongoStore, SyncMongoStore
+
+NOW = datetime.datetime(2026, 10, 19, 12, 0)
+
+
+def test_store_needs_a_backend():
+    with pytest.raises(TypeError):
+        MongoStore(None)
+
+
+def test_ensure_indexes_creates_unique_keys(store):
+    store.ensure_indexes()
+    store.create_user({'email': 'a@x.com'})
+    with pytest.raises(Exception):
+        store.create_user({'email': 'a@x.com'})
+    assert 'device_id_1' in store.devices.index_information()
+
+
+def test_users(store):
+    store.create_user({'email': 'a@x.com', 'devices': []})
+    store.update_user('a@x.com', {'$push': {'devices': 'd1'}})
+    assert store.get_user('a@x.com')['devices'] == ['d1']
+    assert set(store.get_user('a@x.com', {'_id': 0, 'email': 1})) == {'email'}
+    assert store.get_user('b@x.com') is None
+
+
+def test_devices(store):
+    store.create_device({'device_id': 'd1', 'user_email': 'a@x.com'})
+    store.create_device({'device_id': 'd2', 'user_email': 'a@x.com'})
+    store.update_device('d1', {'last_seen': NOW})
+    store.update_devices({'d1': {'current_section': 'Library'}, 'd2': {'last_seen': NOW}})
+    assert store.get_device('d1')['current_section'] == 'Library'
+    assert store.get_device('d1', user_email='b@x.com') is None
+    assert {d['device_id'] for d in store.get_devices(['d1', 'd2', 'd3'])} == {'d1', 'd2'}
+
+
+def test_active_users_newest_first(store):
+    store.create_device({'device_id': 'd1', 'user_email': 'a@x.com', 'last_seen': NOW})
+    store.create_device({'device_id': 'd2', 'user_email': 'b@x.com', 'last_seen': NOW + datetime.timedelta(minutes=1)})
+    store.create_device({'device_id': 'd3', 'user_email': 'c@x.com', 'last_seen': NOW - datetime.timedelta(days=2)})
+    active = store.get_active_users(NOW - datetime.timedelta(hours=1), limit=10)
+    assert [user['_id'] for user in active] == ['b@x.com', 'a@x.com']
+    assert len(store.get_active_users(NOW - datetime.timedelta(hours=1), limit=1)) == 1
+
+
+def test_locations_upsert(store):
+    store.upsert_location('d1', {'latitude': 1.0, 'timestamp': NOW})
+    store.upsert_location('d1', {'latitude': 2.0})
+    store.upsert_locations({'d2': {'latitude': 3.0}, 'd1': {'longitude': 4.0}})
+    assert store.locations.count_documents({}) == 2
+    location = store.get_location('d1')
+    assert (location['latitude'], location['longitude'], location['timestamp']) == (2.0, 4.0, NOW)
+    assert {loc['device_id'] for loc in store.get_locations(['d1', 'd2'])} == {'d1', 'd2'}
+
+
+def test_behaviors(store):
+    records = [{'user_email': 'a@x.com', 'timestamp': NOW + datetime.timedelta(seconds=i), 'n': i} for i in range(5)]
+    store.insert_behavior(records[0])
+    store.insert_behaviors(records[1:])
+    store.insert_behavior({'user_email': 'b@x.com', 'timestamp': NOW})
+    recent = store.get_recent_behaviors('a@x.com', 3)
+    assert [r['n'] for r in recent] == [4, 3, 2] and '_id' not in recent[0]
+    assert [r['n'] for r in store.iter_behaviors('a@x.com', {'n': 1})] == [0, 1, 2, 3, 4]
+    assert sorted(store.get_behavior_users()) == ['a@x.com', 'b@x.com']
+
+
+def test_behavior_features_backfill(store):
+    store.insert_behaviors([{'user_email': 'a@x.com', 'n': i} for i in range(3)]
+                           + [{'user_email': 'a@x.com', 'n': 3, 'feature_version': 1}])
+    stale = list(store.iter_stale_feature_behaviors(1, {'_id': 1}))
+    assert len(stale) == 3
+    store.set_behavior_features([(record['_id'], {'features': b'x', 'feature_version': 1}) for record in stale])
+    assert list(store.iter_stale_feature_behaviors(1)) == []
+
+
+def test_device_patterns(store):
+    store.upsert_device_pattern('a@x.com', 'd1', {'$addToSet': {'companion_devices': 'd2'}})
+    store.upsert_device_pattern('a@x.com', 'd1', {'$addToSet': {'companion_devices': 'd2'}})
+    store.upsert_device_pattern('b@x.com', 'd1', {'$set': {'x': 1}})
+    assert store.get_device_pattern('a@x.com', 'd1')['companion_devices'] == ['d2']
+    assert len(store.get_device_patterns('a@x.com', ['d1', 'd2'])) == 1
+
+
+def test_training_status(store):
+    store.update_training_status('a@x.com', {'is_trained': True})
+    store.update_training_status('b@x.com', {'is_trained': False})
+    store.update_training_status('a@x.com', {'training_samples': 30})
+    assert store.get_training_status('a@x.com')['training_samples'] == 30
+    trained = store.get_trained_statuses(['a@x.com', 'b@x.com'], {'_id': 0, 'user_email': 1})
+    assert trained == [{'user_email': 'a@x.com'}]
+
+
+def test_calibrations_and_reservoirs(store):
+    assert store.get_calibration('a@x.com') is None
+    store.save_calibration('a@x.com', {'data': b'\x01', 'samples': 10})
+    store.save_calibration('a@x.com', {'samples': 20})
+    assert store.get_calibration('a@x.com') == {'user_email': 'a@x.com', 'data': b'\x01', 'samples': 20}
+    store.save_reservoir('a@x.com', {'rows': b'', 'records': 0})
+    assert store.get_reservoir('a@x.com')['records'] == 0
+
+
+def test_trajectory_blocks(store):
+    hour = NOW.replace(minute=0)
+    store.push_trajectory_block('d1', 'a@x.com', hour, b'one', 2, NOW, NOW + datetime.timedelta(minutes=5))
+    store.push_trajectory_block('d1', 'a@x.com', hour, b'two', 3, NOW - datetime.timedelta(minutes=1), NOW)
+    store.push_trajectory_block('d1', 'a@x.com', hour + datetime.timedelta(hours=1), b'three', 1, NOW, NOW)
+    document = store.trajectories.find_one({'device_id': 'd1', 'hour': hour})
+    assert (document['count'], document['start'], document['end']) == (
+        5, NOW - datetime.timedelta(minutes=1), NOW + datetime.timedelta(minutes=5))
+    chunks = store.get_trajectory_chunks('d1', hour, hour + datetime.timedelta(hours=1))
+    assert [chunk['blocks'] for chunk in chunks] == [[b'one', b'two'], [b'three']]
+    assert store.get_trajectory_chunks('d1', hour + datetime.timedelta(hours=2), hour + datetime.timedelta(hours=3)) == []
+
+
+def test_geofence_events(store):
+    store.insert_geofence_events([
+        {'user_email': 'a@x.com', 'device_id': 'd%d' % (i % 2), 'timestamp': NOW + datetime.timedelta(minutes=i)}
+        for i in range(6)
+    ])
+    events = store.get_geofence_events('a@x.com')
+    assert [event['timestamp'].minute for event in events] == [5, 4, 3, 2, 1, 0]
+    assert {event['device_id'] for event in store.get_geofence_events('a@x.com', device_id='d1')} == {'d1'}
+    assert len(store.get_geofence_events('a@x.com', since=NOW + datetime.timedelta(minutes=4))) == 2
+    assert len(store.get_geofence_events('a@x.com', limit=2)) == 2
+
+
+def test_rollups_and_counts(store):
+    store.update_rollup('a@x.com', {'$inc': {'devices.d1.visits.2': 1}})
+    store.update_rollup('a@x.com', {'$inc': {'devices.d1.visits.2': 2}})
+    assert store.get_rollup('a@x.com')['devices']['d1']['visits']['2'] == 3
+    assert store.count('rollups') == 1
+    assert store.estimated_count('rollups') == 1
+
+
+def test_sync_store_returns_lists(store):
+    assert isinstance(store, SyncMongoStore)
+    assert store.get_locations([]) == []
+
+
+def test_use_database_rebinds_every_collection(store):
+    import mongomock
+    store.create_user({'email': 'a@x.com'})
+    db = mongomock.MongoClient().tracker_db
+    store.use_database(db)
+    assert store.get_user('a@x.com') is None
+    store.upsert_location('d1', {'latitude': 1.0})
+    assert db.locations.count_documents({}) == 1
+
+
+def async_store():
+    mongomock_motor = pytest.importorskip('mongomock_motor')
+    from data_access import AsyncMongoStore
+    return AsyncMongoStore(mongomock_motor.AsyncMongoMockClient().tracker_db)
+
+
+def test_async_store_shares_the_queries():
+    store = async_store()
+
+    async def run():
+        names = await store.ensure_indexes()
+        await store.create_user({'email': 'a@x.com', 'devices': ['d1', 'd2']})
+        await store.upsert_locations({'d1': {'timestamp': NOW}, 'd2': {'timestamp': NOW}})
+        # Independent queries overlap on the event loop
+        user, locations = await asyncio.gather(store.get_user('a@x.com'), store.get_locations(['d1', 'd2']))
+        return names, user, locations
+
+    names, user, locations = asyncio.run(run())
+    assert 'device_id_1' in names and len(names) == len(store.index_specs())
+    assert user['devices'] == ['d1', 'd2']
+    assert sorted(location['device_id'] for location in locations) == ['d1', 'd2']
+
+
+def test_create_async_store_without_motor(monkeypatch):
+    import sys
+    from data_access import create_async_store
+    monkeypatch.setitem(sys.modules, 'motor.motor_asyncio', None)
+    with pytest.raises(RuntimeError, match='motor is not installed'):
+        create_async_store('mongodb://localhost')
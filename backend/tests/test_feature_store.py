@@ -0,0 +1,38 @@
+import numpy as np
+
+from feature_store import (FEATURE_SCHEMA_VERSION, ROW, features_from_bytes, features_from_records,
+                           has_packed_features, pack_features, packed_features)
+from ml_model import N_FEATURES, feature_row
+from tests.helpers import behavior_records
+
+
+def test_pack_round_trip():
+    record = behavior_records(1)[0]
+    packed = pack_features(record)
+    assert len(packed) == ROW.size == 4 * N_FEATURES
+    assert np.allclose(features_from_bytes(packed)[0], feature_row(record), rtol=1e-6)
+
+
+def test_missing_fields_pack_as_zero():
+    assert features_from_bytes(pack_features({})).tolist() == [[0.0] * N_FEATURES]
+
+
+def test_packed_vector_is_used_only_when_current():
+    record = behavior_records(1)[0]
+    stored = dict(record, features=b'\x00' * ROW.size, feature_version=FEATURE_SCHEMA_VERSION)
+    assert has_packed_features(stored) and packed_features(stored) == b'\x00' * ROW.size
+    stale = dict(stored, feature_version=FEATURE_SCHEMA_VERSION - 1)
+    assert not has_packed_features(stale)
+    assert packed_features(stale) == pack_features(record)
+    assert not has_packed_features(dict(stored, features=b''))
+
+
+def test_features_from_mixed_records():
+    records = behavior_records(5)
+    for record in records[::2]:
+        record['features'] = pack_features(record)
+        record['feature_version'] = FEATURE_SCHEMA_VERSION
+    features = features_from_records(records)
+    assert features.shape == (5, N_FEATURES) and features.dtype == np.float32
+    assert np.allclose(features, [feature_row(record) for record in records], rtol=1e-6)
+    assert features_from_records([]).shape == (0, N_FEATURES)
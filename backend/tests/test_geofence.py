@@ -0,0 +1,88 @@
+import datetime
+
+import caching
+from geofence import OUTSIDE, METERS_PER_DEGREE, GeofenceEngine, raw_section
+from tests.helpers import START
+
+# Two 12 m sections side by side along the latitude axis
+STEP = 12 / METERS_PER_DEGREE
+SECTIONS = [
+    {'name': 'Library', 'bounds': {'min_lat': 0.0, 'max_lat': STEP, 'min_lon': 0.0, 'max_lon': STEP}},
+    {'name': 'Canteen', 'bounds': {'min_lat': STEP, 'max_lat': 2 * STEP, 'min_lon': 0.0, 'max_lon': STEP}},
+]
+LIBRARY = 0.5 * STEP
+CANTEEN = 1.5 * STEP
+# 1 m past the shared edge, inside the 2 m margin
+EDGE_JITTER = STEP + 1 / METERS_PER_DEGREE
+
+
+def feed(engine, latitudes, start=START, step=10):
+    """Feed fixes every step seconds; return the confirmed sections and all events"""
+    sections, events = [], []
+    for i, latitude in enumerate(latitudes):
+        section, new_events = engine.update('d1', latitude, STEP / 2, start + datetime.timedelta(seconds=i * step),
+                                            SECTIONS)
+        sections.append(section)
+        events.extend(new_events)
+    return sections, events
+
+
+def test_first_fix_adopts_raw_section_silently():
+    assert raw_section(LIBRARY, STEP / 2, SECTIONS) == 'Library'
+    assert raw_section(-STEP, STEP / 2, SECTIONS) == OUTSIDE
+    sections, events = feed(GeofenceEngine(confirm_fixes=2, dwell_seconds=600), [LIBRARY])
+    assert sections == ['Library'] and events == []
+
+
+def test_restored_state_continues_the_stored_visit():
+    engine = GeofenceEngine(confirm_fixes=1, dwell_seconds=60)
+    restore = {'section': 'Library', 'entered_at': START - datetime.timedelta(seconds=50), 'dwell_sent': False}
+    section, events = engine.update('d1', CANTEEN, STEP / 2, START, SECTIONS, restore)
+    # The exit covers the visit since its stored start; a stale restore is ignored once state exists
+    assert section == 'Canteen'
+    assert [(e['type'], e['section'], e.get('duration')) for e in events] == [
+        ('exit', 'Library', 50), ('enter', 'Canteen', None)
+    ]
+    assert engine.update('d1', CANTEEN, STEP / 2, START, SECTIONS, restore) == ('Canteen', [])
+
+
+def test_state_is_bounded_per_device(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(caching.time, 'monotonic', lambda: now[0])
+    engine = GeofenceEngine(max_devices=2, idle_seconds=60)
+    for device_id in ('d1', 'd2', 'd3'):
+        engine.update(device_id, LIBRARY, STEP / 2, START, SECTIONS)
+    assert [engine.current_section(device_id) for device_id in ('d1', 'd2', 'd3')] == [None, 'Library', 'Library']
+    now[0] += 50
+    engine.update('d2', LIBRARY, STEP / 2, START, SECTIONS)
+    now[0] += 20
+    # Every fix renews the device's idle timeout
+    assert (engine.current_section('d2'), engine.current_section('d3')) == ('Library', None)
+
+
+def test_margin_absorbs_jitter_across_the_edge():
+    engine = GeofenceEngine(margin_m=2.0, confirm_fixes=2, dwell_seconds=600)
+    sections, events = feed(engine, [LIBRARY, EDGE_JITTER, LIBRARY, EDGE_JITTER, EDGE_JITTER])
+    assert sections == ['Library'] * 5 and events == []
+
+
+def test_transition_needs_consecutive_fixes():
+    engine = GeofenceEngine(margin_m=2.0, confirm_fixes=2, dwell_seconds=600)
+    sections, events = feed(engine, [LIBRARY, CANTEEN, LIBRARY, CANTEEN, CANTEEN])
+    assert sections == ['Library', 'Library', 'Library', 'Library', 'Canteen']
+    exit_event, enter_event = events
+    # Dated at the first fix seen in the new section
+    assert (exit_event['type'], exit_event['section'], exit_event['duration']) == ('exit', 'Library', 30)
+    assert (enter_event['type'], enter_event['section']) == ('enter', 'Canteen')
+    assert enter_event['timestamp'] == START + datetime.timedelta(seconds=30)
+
+
+def test_one_dwell_event_per_visit():
+    engine = GeofenceEngine(confirm_fixes=1, dwell_seconds=60)
+    _, events = feed(engine, [LIBRARY] * 10 + [-STEP] + [LIBRARY] * 8, step=10)
+    assert [(e['type'], e['section']) for e in events] == [
+        ('dwell', 'Library'), ('exit', 'Library'), ('enter', 'Library'), ('dwell', 'Library')
+    ]
+    assert engine.current_section('d1') == 'Library'
+    engine.forget('d1')
+    assert engine.current_section('d1') is None
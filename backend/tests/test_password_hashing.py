@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from password_hashing import PasswordHasher
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _die(submitted_at):
+    os._exit(1)
+
+
+def test_hash_and_check():
+    hasher = PasswordHasher(workers=1, rounds=4)
+    pw_hash = hasher.generate_password_hash('secret')
+    assert pw_hash.startswith('$2b$04$')
+    assert hasher.check_password_hash(pw_hash, 'secret') and not hasher.check_password_hash(pw_hash, 'other')
+    assert hasher.stats()['completed'] == 3
+
+
+def test_broken_pool_is_replaced():
+    hasher = PasswordHasher(workers=1, rounds=4)
+    # Retried once on a new pool, then reported
+    with pytest.raises(BrokenProcessPool):
+        hasher._run(_die)
+    assert hasher._executor is None
+    assert hasher.check_password_hash(hasher.generate_password_hash('secret'), 'secret')
+
+
+def test_entry_scripts_do_not_import_the_app_in_spawned_workers():
+    # Spawned workers re-run the main script as __mp_main__
+    code = ("import runpy, sys\n"
+            "for script in ('wsgi.py', 'dev_server.py'):\n"
+            "    runpy.run_path(script, run_name='__mp_main__')\n"
+            "print('app' in sys.modules)\n")
+    result = subprocess.run([sys.executable, '-c', code], cwd=BACKEND, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == 'False'
@@ -0,0 +1,18 @@
+import replay
+from feature_store import FEATURE_SCHEMA_VERSION, pack_features
+from tests.helpers import behavior_records
+
+CONFIG = dict(contamination=0.1, n_estimators=20, n_clusters=3, threshold_percentile=10, cascade_fn_budget=0.01,
+              train_size=30, train_window=100, retrain_every=0, batch_size=25)
+
+
+def test_replay_computes_features_of_unpacked_records(store):
+    records = behavior_records(80)
+    for record in records[40:]:
+        record['features'] = pack_features(record)
+        record['feature_version'] = FEATURE_SCHEMA_VERSION
+    store.insert_behaviors(records)
+    stats = replay.replay_user(store, 'a@x.com', CONFIG)
+    assert stats['records'] == 80
+    assert stats['unpacked'] == 40
+    assert stats['trained'] and stats['scored'] == 50
@@ -0,0 +1,62 @@
+import datetime
+import random
+
+import numpy as np
+
+from feature_store import FEATURE_SCHEMA_VERSION, pack_features
+from ml_model import N_FEATURES
+from reservoir import Reservoir, Reservoirs, stratum
+from tests.helpers import START, behavior_records
+
+WEEK = datetime.timedelta(days=7)
+
+
+def test_stratum_is_day_and_hour():
+    monday_8, tuesday_9 = behavior_records(2, step=datetime.timedelta(hours=25))
+    assert (stratum(monday_8), stratum(tuesday_9)) == (8, 24 + 9)
+    assert stratum({}) == 0
+
+
+def test_new_strata_take_slots_from_the_fullest():
+    reservoir = Reservoir(size=20, rng=random.Random(1))
+    for record in behavior_records(100, step=WEEK):
+        reservoir.add(record)
+    assert reservoir.count == 20 and list(reservoir.rows) == [8]
+    # Records of a new hour take slots until both strata hold an equal share
+    for record in behavior_records(100, start=START + datetime.timedelta(hours=1), step=WEEK):
+        reservoir.add(record)
+    assert reservoir.count == 20
+    assert {key: len(rows) for key, rows in reservoir.rows.items()} == {8: 10, 9: 10}
+    assert reservoir.seen[8] == reservoir.seen[9] == 100
+    assert reservoir.features().shape == (20, N_FEATURES)
+    assert reservoir.features(limit=5).shape == (5, N_FEATURES)
+
+
+def test_document_round_trip():
+    reservoir = Reservoir(size=30, rng=random.Random(2))
+    for record in behavior_records(90, step=datetime.timedelta(minutes=7)):
+        reservoir.add(record)
+    restored = Reservoir.from_document(reservoir.to_document(), size=30)
+    assert restored.count == reservoir.count and restored.seen == reservoir.seen
+    assert {key: rows for key, rows in restored.rows.items()} == reservoir.rows
+    assert np.array_equal(restored.features(), reservoir.features())
+    stale = dict(reservoir.to_document(), feature_version=FEATURE_SCHEMA_VERSION - 1)
+    assert Reservoir.from_document(stale) is None
+
+
+def test_seeded_once_from_stored_records_and_flushed(store):
+    records = behavior_records(15)
+    store.insert_behaviors([dict(record) for record in records[:10]])
+    reservoirs = Reservoirs(store, size=50)
+    # Seeding reads the stored records, which include this one
+    reservoirs.add(records[9])
+    assert reservoirs.features('a@x.com').shape == (10, N_FEATURES)
+    for record in records[10:]:
+        reservoirs.add(dict(record, features=pack_features(record), feature_version=FEATURE_SCHEMA_VERSION),
+                       stored=False)
+    reservoirs.flush(max_idle=0)
+    document = store.get_reservoir('a@x.com')
+    assert document['records'] == 15
+    # Idle entries are dropped from memory once written; the next read loads the document
+    assert not reservoirs._entries
+    assert reservoirs.features('a@x.com').shape == (15, N_FEATURES)
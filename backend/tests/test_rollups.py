@@ -0,0 +1,101 @@
+import datetime
+
+import pytest
+
+from rollups import Rollups, current_sections, pair_key, split_hours
+from tests.helpers import START
+
+
+class StopLoop(Exception):
+    pass
+
+
+def sample(minute, distance=5.0, same_section=1, device1='d2', device2='d1'):
+    return {'user_email': 'a@x.com', 'device1_id': device1, 'device2_id': device2,
+            'timestamp': START + datetime.timedelta(minutes=minute, seconds=10),
+            'distance_between_devices': distance, 'same_section': same_section, 'moving_together': 0}
+
+
+def test_split_hours():
+    start = START.replace(minute=50)
+    assert split_hours(start, start + datetime.timedelta(minutes=20)) == {8: 600.0, 9: 600.0}
+    assert split_hours(start, start) == {}
+
+
+def test_pair_samples_written_once_per_minute(store):
+    rollups = Rollups(store)
+    rollups.record_pair_sample(sample(0, distance=5))
+    rollups.record_pair_sample(sample(0, distance=45, device1='d1', device2='d2'))
+    assert store.get_rollup('a@x.com') is None
+    # The next minute closes the first bucket
+    rollups.record_pair_sample(sample(1, distance=50, same_section=0))
+    pair = store.get_rollup('a@x.com')['pairs'][pair_key('d1', 'd2')]
+    assert (pair['samples'], pair['colocated_minutes'], pair['same_section_minutes']) == (2, 0, 1)
+    assert rollups.flush() == {'a@x.com'}
+    pair = store.get_rollup('a@x.com')['pairs'][pair_key('d1', 'd2')]
+    assert pair['samples'] == 3 and len(pair['recent']) == 2
+    assert rollups.flush() == set()
+
+
+def test_background_flush_reports_changed_users(store):
+    rollups = Rollups(store)
+    rollups.record_pair_sample(sample(0))
+    flushed = []
+    sleeps = []
+
+    def sleep(seconds):
+        if sleeps:
+            raise StopLoop
+        sleeps.append(seconds)
+        rollups._buckets[('a@x.com', 'd1:d2')]['opened'] -= 120
+
+    with pytest.raises(StopLoop):
+        rollups.run_flusher(sleep, on_flush=flushed.append)
+    assert flushed == [{'a@x.com'}]
+
+
+def test_section_events(store):
+    rollups = Rollups(store)
+    exit_time = START.replace(minute=30)
+    rollups.record_section_events('a@x.com', [
+        {'device_id': 'd1', 'type': 'enter', 'section_id': 2, 'timestamp': START},
+        {'device_id': 'd1', 'type': 'exit', 'section_id': 2, 'timestamp': exit_time, 'duration': 2400.0},
+        {'device_id': 'd1', 'type': 'enter', 'section_id': 4, 'timestamp': exit_time},
+        {'device_id': 'd1', 'type': 'dwell', 'section_id': 4, 'timestamp': exit_time},
+    ])
+    device = store.get_rollup('a@x.com')['devices']['d1']
+    assert device['sections'] == {'2': {'visits': 1, 'dwell': 2400.0, 'hourly_dwell': {'7': 600.0, '8': 1800.0}},
+                                  '4': {'visits': 1}}
+    assert device['open'] == {'section_id': 4, 'entered_at': exit_time}
+    # The visit in progress counts up to the device's last fix
+    sections = current_sections(device, exit_time + datetime.timedelta(minutes=40))
+    assert sections['4'] == {'visits': 1, 'dwell': 2400.0, 'hourly_dwell': {'8': 1800.0, '9': 600.0}}
+    assert current_sections(device, exit_time - datetime.timedelta(minutes=1)) == device['sections']
+    rollups.record_section_events('a@x.com', [
+        {'device_id': 'd1', 'type': 'exit', 'section_id': 4, 'timestamp': exit_time, 'duration': 0.0},
+    ])
+    assert 'open' not in store.get_rollup('a@x.com')['devices']['d1']
+
+
+def test_backfill_rebuilds_section_counters(store):
+    from migrate import backfill_rollups
+    exit_time = START.replace(minute=30)
+    store.insert_geofence_events([
+        {'user_email': 'a@x.com', 'device_id': 'd1', 'type': 'enter', 'section_id': 2, 'timestamp': START},
+        {'user_email': 'a@x.com', 'device_id': 'd1', 'type': 'exit', 'section_id': 2, 'timestamp': exit_time,
+         'duration': 1800.0},
+        {'user_email': 'a@x.com', 'device_id': 'd1', 'type': 'enter', 'section_id': 3, 'timestamp': exit_time},
+    ])
+    store.upsert_device_pattern('a@x.com', 'd1', {'$set': {'section_visits': {'2': 9}}})
+    store.upsert_device_pattern('a@x.com', 'd2', {'$set': {'section_visits': {'5': 3},
+                                                           'section_dwell_seconds': {'5': 60.0}}})
+    # Counters of the previous layout are replaced
+    store.update_rollup('a@x.com', {'$set': {'devices.d1.visits': {'2': 1}, 'devices.d1.hourly_dwell': {'8': 5}}})
+    for _ in range(2):
+        assert backfill_rollups(store) == 2
+    devices = store.get_rollup('a@x.com')['devices']
+    assert devices['d1'] == {
+        'sections': {'2': {'visits': 1, 'dwell': 1800.0, 'hourly_dwell': {'8': 1800.0}}, '3': {'visits': 1}},
+        'open': {'section_id': 3, 'entered_at': exit_time}
+    }
+    assert devices['d2'] == {'sections': {'5': {'visits': 3, 'dwell': 60.0}}}
@@ -0,0 +1,38 @@
+import random
+
+from trajectory_simplify import SIMPLIFIERS, decode_polyline, douglas_peucker, encode_polyline, visvalingam
+
+
+def test_polyline_matches_reference_encoding():
+    # Example from Google's polyline algorithm documentation
+    points = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+    assert encode_polyline(points) == '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+    assert decode_polyline('_p~iF~ps|U_ulLnnqC_mqNvxq`@') == points
+
+
+def test_polyline_round_trip_at_precision():
+    rng = random.Random(3)
+    points = [(6.9271 + rng.uniform(-0.01, 0.01), 79.8612 + rng.uniform(-0.01, 0.01)) for _ in range(50)]
+    for precision in (5, 6):
+        decoded = decode_polyline(encode_polyline(points, precision), precision)
+        assert len(decoded) == len(points)
+        assert all(abs(a - b) <= 0.5 / 10 ** precision + 1e-12
+                   for point, other in zip(points, decoded) for a, b in zip(point, other))
+    assert encode_polyline([]) == '' and decode_polyline('') == []
+
+
+def test_simplifiers_drop_collinear_points_and_keep_corners():
+    # ~11 m steps east along a line, then north: only the ends and the corner matter
+    path = [(6.9271, 79.8612 + i * 1e-4) for i in range(10)] + [(6.9271 + i * 1e-4, 79.8621) for i in range(1, 10)]
+    for simplify in SIMPLIFIERS.values():
+        assert simplify(path, 1.0) == [path[0], path[9], path[-1]]
+        assert simplify(path[:2], 100.0) == path[:2]
+
+
+def test_tolerance_bounds_douglas_peucker_error():
+    rng = random.Random(5)
+    path = [(6.9271 + i * 1e-5, 79.8612 + rng.uniform(-5e-5, 5e-5)) for i in range(200)]
+    loose, tight = douglas_peucker(path, 10.0), douglas_peucker(path, 1.0)
+    assert len(loose) < len(tight) < len(path)
+    assert set(loose) <= set(path) and (loose[0], loose[-1]) == (path[0], path[-1])
+    assert len(visvalingam(path, 10.0)) < len(visvalingam(path, 1.0)) < len(path)
@@ -0,0 +1,50 @@
+import datetime
+
+from trajectory_store import (TrajectoryStore, _read_varint, _unzigzag, _write_varint, _zigzag, decode_block,
+                              encode_block, pack_accuracy, to_millis)
+from tests.helpers import START
+
+
+def test_varint_round_trip():
+    for value in (0, 1, 127, 128, 300, 2 ** 32, 2 ** 63 - 1):
+        out = bytearray()
+        _write_varint(out, value)
+        assert len(out) == max(1, (value.bit_length() + 6) // 7)
+        assert _read_varint(bytes(out) + b'\xff', 0) == (value, len(out))
+
+
+def test_zigzag_keeps_small_deltas_small():
+    assert [_zigzag(value) for value in (0, -1, 1, -2, 2)] == [0, 1, 2, 3, 4]
+    for value in (-2 ** 40, -123456, -1, 0, 99, 2 ** 40):
+        assert _unzigzag(_zigzag(value)) == value
+
+
+def test_block_round_trip():
+    fixes = [(1_000_000, 6_927_100, 79_861_200, pack_accuracy(3.3)),
+             (1_001_500, 6_927_085, 79_861_230, pack_accuracy(2.0)),
+             (1_003_000, 6_927_120, 79_861_180, pack_accuracy(70))]
+    block = encode_block(fixes)
+    # 17-byte header, then one byte per delta and the accuracy byte
+    assert len(block) == 17 + 2 * 5
+    decoded = decode_block(block)
+    assert [fix[0] for fix in decoded] == [1_000_000, 1_001_500, 1_003_000]
+    assert [(fix[1], fix[2]) for fix in decoded] == [(6.9271, 79.8612), (6.927085, 79.86123), (6.92712, 79.86118)]
+    assert [fix[3] for fix in decoded] == [3.25, 2.0, 63.75]
+
+
+def test_buffers_flush_by_count_hour_and_range(store):
+    trajectories = TrajectoryStore(store, flush_fixes=3, flush_seconds=30)
+    for i in range(4):
+        trajectories.append('a@x.com', 'd1', 6.9271 + i * 1e-5, 79.8612, 2, START + datetime.timedelta(seconds=i))
+    # Three fixes filled a block, the fourth is still buffered
+    assert store.trajectories.find_one({'device_id': 'd1'})['count'] == 3
+    # A fix in the next hour writes the open block to its own hour's chunk
+    trajectories.append('a@x.com', 'd1', 6.93, 79.87, 2, START + datetime.timedelta(hours=1))
+    chunk = store.trajectories.find_one({'device_id': 'd1'})
+    assert (chunk['hour'], chunk['count'], len(chunk['blocks'])) == (START, 4, 2)
+
+    fixes = trajectories.get_range('d1', START, START + datetime.timedelta(hours=2))
+    assert [fix[0] - to_millis(START) for fix in fixes] == [0, 1000, 2000, 3000, 3_600_000]
+    assert round(fixes[3][1], 6) == 6.92713
+    assert trajectories.get_range('d1', START + datetime.timedelta(seconds=1), START + datetime.timedelta(seconds=2)) \
+        == fixes[1:3]
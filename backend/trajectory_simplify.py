@@ -0,0 +1,137 @@
+"""Path simplification and polyline encoding for trajectory queries.
+
+Points are (lat, lon) pairs. Both simplifiers work on a local equirectangular
+projection in meters, which is exact enough at campus scale, and always keep
+the first and last point.
+"""
+import heapq
+import math
+
+EARTH_RADIUS = 6371000
+# Web Mercator meters per pixel at zoom 0 on the equator
+METERS_PER_PIXEL_Z0 = 156543.03392
+
+
+def zoom_tolerance(zoom, latitude, pixels=1.0):
+    """Ground distance (meters) covered by `pixels` screen pixels at a map zoom level"""
+    return pixels * METERS_PER_PIXEL_Z0 * math.cos(math.radians(latitude)) / (2 ** zoom)
+
+
+def _project(points):
+    if not points:
+        return []
+    lat0 = math.radians(points[0][0])
+    scale_x = EARTH_RADIUS * math.cos(lat0)
+    return [(math.radians(lon) * scale_x, math.radians(lat) * EARTH_RADIUS) for lat, lon in points]
+
+
+def _segment_distance(px, py, ax, ay, bx, by):
+    dx, dy = bx - ax, by - ay
+    length_sq = dx * dx + dy * dy
+    if length_sq == 0:
+        return math.hypot(px - ax, py - ay)
+    t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / length_sq))
+    return math.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+
+def douglas_peucker(points, tolerance):
+    """Keep points deviating more than tolerance meters from the simplified path"""
+    if len(points) < 3:
+        return list(points)
+    xy = _project(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        ax, ay = xy[first]
+        bx, by = xy[last]
+        max_distance, index = 0.0, None
+        for i in range(first + 1, last):
+            distance = _segment_distance(xy[i][0], xy[i][1], ax, ay, bx, by)
+            if distance > max_distance:
+                max_distance, index = distance, i
+        if index is not None and max_distance > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def visvalingam(points, tolerance):
+    """Drop points whose effective triangle area is below tolerance squared"""
+    if len(points) < 3:
+        return list(points)
+    xy = _project(points)
+    min_area = tolerance * tolerance
+    prev = list(range(-1, len(points) - 1))
+    nxt = list(range(1, len(points) + 1))
+    removed = [False] * len(points)
+
+    def area(i):
+        (ax, ay), (bx, by), (cx, cy) = xy[prev[i]], xy[i], xy[nxt[i]]
+        return abs((bx - ax) * (cy - ay) - (cx - ax) * (by - ay)) / 2
+
+    heap = [(area(i), i) for i in range(1, len(points) - 1)]
+    heapq.heapify(heap)
+    current = {i: a for a, i in heap}
+    while heap:
+        a, i = heapq.heappop(heap)
+        if removed[i] or current.get(i) != a:
+            continue
+        if a >= min_area:
+            break
+        removed[i] = True
+        left, right = prev[i], nxt[i]
+        nxt[left], prev[right] = right, left
+        # Neighbours never get a smaller area than the point just removed
+        for j in (left, right):
+            if 0 < j < len(points) - 1:
+                current[j] = max(area(j), a)
+                heapq.heappush(heap, (current[j], j))
+    return [point for point, gone in zip(points, removed) if not gone]
+
+
+SIMPLIFIERS = {
+    'dp': douglas_peucker,
+    'vw': visvalingam
+}
+
+
+def encode_polyline(points, precision=5):
+    """Encode (lat, lon) points with the Google polyline algorithm"""
+    factor = 10 ** precision
+    out = []
+    last_lat = last_lon = 0
+    for lat, lon in points:
+        lat_i, lon_i = int(round(lat * factor)), int(round(lon * factor))
+        for delta in (lat_i - last_lat, lon_i - last_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                out.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            out.append(chr(value + 63))
+        last_lat, last_lon = lat_i, lon_i
+    return ''.join(out)
+
+
+def decode_polyline(encoded, precision=5):
+    factor = 10 ** precision
+    points = []
+    index = lat = lon = 0
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        points.append((lat / factor, lon / factor))
+    return points
@@ -0,0 +1,178 @@
+"""Append-only location history in compact per-device, per-hour chunks.
+
+``locations`` only keeps the latest fix of each device. Every accepted fix is
+also buffered here and flushed as a binary block into the device's chunk for
+that hour (``trajectories`` collection, unique on device_id + hour).
+
+Block layout (little endian)::
+
+    header  int32 lat_e6, int32 lon_e6, int64 timestamp_ms, uint8 accuracy
+    per fix zigzag-varint dlat_e6, zigzag-varint dlon_e6, varint dt_ms, uint8 accuracy
+
+Coordinates are micro-degrees (~0.11 m), accuracy is packed in 0.25 m steps
+(0-63.75 m, above MAX_ACCEPTABLE_ACCURACY anyway). A walking fix costs
+~6 bytes instead of ~150 for a JSON/BSON document.
+"""
+import datetime
+import logging
+import os
+import struct
+import threading
+import time
+
+from bson.binary import Binary
+
+TRAJECTORY_FLUSH_FIXES = int(os.getenv('TRAJECTORY_FLUSH_FIXES', 32))
+TRAJECTORY_FLUSH_SECONDS = float(os.getenv('TRAJECTORY_FLUSH_SECONDS', 30))
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('<iiqB')
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def to_millis(timestamp):
+    return int((timestamp - _EPOCH).total_seconds() * 1000)
+
+
+def from_millis(millis):
+    return _EPOCH + datetime.timedelta(milliseconds=millis)
+
+
+def hour_of(timestamp):
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def pack_accuracy(accuracy):
+    return max(0, min(255, int(round(accuracy * 4))))
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def encode_block(fixes):
+    """Encode (timestamp_ms, lat_e6, lon_e6, accuracy_byte) tuples in time order"""
+    ts, lat, lon, acc = fixes[0]
+    out = bytearray(_HEADER.pack(lat, lon, ts, acc))
+    for next_ts, next_lat, next_lon, next_acc in fixes[1:]:
+        _write_varint(out, _zigzag(next_lat - lat))
+        _write_varint(out, _zigzag(next_lon - lon))
+        _write_varint(out, next_ts - ts)
+        out.append(next_acc)
+        ts, lat, lon = next_ts, next_lat, next_lon
+    return bytes(out)
+
+
+def decode_block(data):
+    """Decode a block back to (timestamp_ms, lat, lon, accuracy_m) tuples"""
+    lat, lon, ts, acc = _HEADER.unpack_from(data, 0)
+    fixes = [(ts, lat / 1e6, lon / 1e6, acc / 4.0)]
+    pos = _HEADER.size
+    end = len(data)
+    while pos < end:
+        dlat, pos = _read_varint(data, pos)
+        dlon, pos = _read_varint(data, pos)
+        dt, pos = _read_varint(data, pos)
+        lat += _unzigzag(dlat)
+        lon += _unzigzag(dlon)
+        ts += dt
+        fixes.append((ts, lat / 1e6, lon / 1e6, data[pos] / 4.0))
+        pos += 1
+    return fixes
+
+
+class TrajectoryStore:
+    """Buffers fixes per device and flushes them as encoded blocks"""
+
+    def __init__(self, store, flush_fixes=TRAJECTORY_FLUSH_FIXES, flush_seconds=TRAJECTORY_FLUSH_SECONDS):
+        self.store = store
+        self.flush_fixes = flush_fixes
+        self.flush_seconds = flush_seconds
+        self._buffers = {}
+        self._lock = threading.Lock()
+        # Fixes appended per device since start, used to key derived caches
+        self.versions = {}
+
+    def append(self, user_email, device_id, latitude, longitude, accuracy, timestamp):
+        fix = (to_millis(timestamp), int(round(latitude * 1e6)), int(round(longitude * 1e6)),
+               pack_accuracy(accuracy))
+        hour = hour_of(timestamp)
+        to_write = []
+        with self._lock:
+            self.versions[device_id] = self.versions.get(device_id, 0) + 1
+            buffer = self._buffers.get(device_id)
+            # A new hour, or a fix older than the last one, starts a new block
+            if buffer and (buffer['hour'] != hour or fix[0] < buffer['fixes'][-1][0]):
+                to_write.append(self._buffers.pop(device_id))
+                buffer = None
+            if buffer is None:
+                buffer = {'user_email': user_email, 'hour': hour, 'fixes': [], 'opened': time.monotonic()}
+                self._buffers[device_id] = buffer
+            buffer['fixes'].append(fix)
+            if len(buffer['fixes']) >= self.flush_fixes:
+                to_write.append(self._buffers.pop(device_id))
+        for full_buffer in to_write:
+            self._write(device_id, full_buffer)
+
+    def _write(self, device_id, buffer):
+        fixes = buffer['fixes']
+        self.store.push_trajectory_block(
+            device_id, buffer['user_email'], buffer['hour'], Binary(encode_block(fixes)),
+            len(fixes), from_millis(fixes[0][0]), from_millis(fixes[-1][0])
+        )
+
+    def flush(self, device_id=None, max_age=None):
+        """Write buffered fixes (of one device, or older than max_age seconds)"""
+        now = time.monotonic()
+        with self._lock:
+            ready = [
+                key for key, buffer in self._buffers.items()
+                if (device_id is None or key == device_id)
+                and (max_age is None or now - buffer['opened'] >= max_age)
+            ]
+            buffers = [(key, self._buffers.pop(key)) for key in ready]
+        for key, buffer in buffers:
+            self._write(key, buffer)
+
+    def run_flusher(self, sleep=time.sleep):
+        """Background loop that bounds how long fixes stay buffered"""
+        while True:
+            sleep(self.flush_seconds / 2)
+            try:
+                self.flush(max_age=self.flush_seconds)
+            except Exception:
+                logger.exception('trajectory flush failed')
+
+    def get_range(self, device_id, start, end):
+        """Return (timestamp_ms, lat, lon, accuracy) fixes of a device within [start, end]"""
+        self.flush(device_id)
+        start_ms, end_ms = to_millis(start), to_millis(end)
+        fixes = []
+        for chunk in self.store.get_trajectory_chunks(device_id, hour_of(start), end):
+            for block in chunk['blocks']:
+                fixes.extend(fix for fix in decode_block(block) if start_ms <= fix[0] <= end_ms)
+        fixes.sort(key=lambda fix: fix[0])
+        return fixes
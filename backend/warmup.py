@@ -0,0 +1,107 @@
+"""Boot-time model warm-up for recently active users.
+
+A cold worker would otherwise unpickle each trained user's model inside the
+socket handler of that user's first fix. ``ModelWarmup`` looks up users with a
+device seen in the last ``WARMUP_ACTIVE_HOURS``, keeps those with a trained
+model in ``training_status`` and loads their models with at most
+``WARMUP_CONCURRENCY`` loads in flight, newest activity first. Until it
+finishes ``ready`` is False and ``/api/health`` answers 503.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+WARMUP_ACTIVE_HOURS = float(os.getenv('WARMUP_ACTIVE_HOURS', 24))
+WARMUP_CONCURRENCY = int(os.getenv('WARMUP_CONCURRENCY', 4))
+WARMUP_MAX_MODELS = int(os.getenv('WARMUP_MAX_MODELS', 1000))
+
+logger = logging.getLogger(__name__)
+
+
+class ModelWarmup:
+    """Preloads models of recently active users and reports readiness"""
+
+    def __init__(self, store, load_model, accept_user=None, active_hours=WARMUP_ACTIVE_HOURS,
+                 concurrency=WARMUP_CONCURRENCY, max_models=WARMUP_MAX_MODELS):
+        self.store = store
+        # load_model(user_email, model_path) -> True if loaded (or already in memory)
+        self.load_model = load_model
+        self.accept_user = accept_user or (lambda user_email: True)
+        self.active_hours = active_hours
+        self.concurrency = max(1, concurrency)
+        self.max_models = max_models
+        self._lock = threading.Lock()
+        self._state = {'state': 'pending', 'planned': 0, 'loaded': 0, 'failed': 0,
+                       'started_at': None, 'seconds': None}
+
+    @property
+    def ready(self):
+        return self._state['state'] in ('ready', 'disabled')
+
+    def status(self):
+        with self._lock:
+            return dict(self._state)
+
+    def _update(self, **fields):
+        with self._lock:
+            self._state.update(fields)
+
+    def _count(self, field):
+        with self._lock:
+            self._state[field] += 1
+
+    def plan(self):
+        """(user_email, model_path) to load, most recently active first"""
+        since = datetime.utcnow() - timedelta(hours=self.active_hours)
+        active = [row['_id'] for row in self.store.get_active_users(since, self.max_models)
+                  if row['_id'] and self.accept_user(row['_id'])]
+        if not active:
+            return []
+        paths = {status['user_email']: status.get('model_path') or f"models/{status['user_email']}_model.pkl"
+                 for status in self.store.get_trained_statuses(active, {'user_email': 1, 'model_path': 1})}
+        return [(user_email, paths[user_email]) for user_email in active if user_email in paths]
+
+    def run(self, spawn, sleep=time.sleep):
+        """Warm up with concurrency workers started through spawn(func)"""
+        if self.active_hours <= 0 or self.max_models <= 0:
+            self._update(state='disabled')
+            return
+        started = time.monotonic()
+        self._update(state='running', started_at=datetime.utcnow().isoformat())
+        try:
+            pending = self.plan()
+        except Exception:
+            # Serve anyway; models then load on first use as before
+            logger.exception('model warm-up planning failed')
+            self._update(state='ready', seconds=round(time.monotonic() - started, 3))
+            return
+        self._update(planned=len(pending))
+        queue = iter(pending)
+        running = [0]
+
+        def worker():
+            try:
+                while True:
+                    with self._lock:
+                        item = next(queue, None)
+                    if item is None:
+                        return
+                    try:
+                        self._count('loaded' if self.load_model(*item) else 'failed')
+                    except Exception:
+                        self._count('failed')
+                        logger.warning('model warm-up load failed', extra={'user_email': item[0]})
+            finally:
+                with self._lock:
+                    running[0] -= 1
+
+        workers = min(self.concurrency, len(pending))
+        running[0] = workers
+        for _ in range(workers):
+            spawn(worker)
+        while running[0]:
+            sleep(0.05)
+        self._update(state='ready', seconds=round(time.monotonic() - started, 3))
+        logger.info('model warm-up finished', extra=self.status())
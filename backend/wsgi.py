@@ -1,4 +1,16 @@
-from app import app, socketio
+import os
+
+from engine import ASYNC_MODE
 
 if __name__ == "__main__":
-    socketio.run(app, debug=True)
\ No newline at end of file
+    # Imported here only: spawned password-pool workers re-run this script as __mp_main__
+    from app import app, socketio
+    options = {}
+    if ASYNC_MODE == 'threading':
+        # The threading engine serves through Werkzeug; use eventlet/gevent in production
+        options['allow_unsafe_werkzeug'] = True
+    socketio.run(app,
+                 host=os.getenv('HOST', '127.0.0.1'),
+                 port=int(os.getenv('PORT', 5000)),
+                 debug=os.getenv('FLASK_DEBUG') == '1',
+                 **options)
@@ -5,6 +5,7 @@ import DeviceForm from './DeviceForm';
 import LocationPermission from './LocationPermission';
 import MapComponent from './MapComponent';
 import io from 'socket.io-client';
+import { clearQueuedFixes, enqueueFix, flushQueuedFixes, queuedFixCount } from '../offlineQueue';
 
 const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:5000';
 
@@ -32,9 +33,11 @@ const Dashboard = () => {
     message: ''
   });
   const [alerts, setAlerts] = useState([]);
+  const [queuedFixes, setQueuedFixes] = useState(queuedFixCount());
   
   const navigate = useNavigate();
   const socketRef = useRef(null);
+  const serverUrlRef = useRef(API_URL);
   const isMountedRef = useRef(true);
   const watchIdRef = useRef(null);
   const isTrackingRef = useRef(false);
@@ -132,7 +135,19 @@ const Dashboard = () => {
     }
   };
 
-  const initializeWebSocket = () => {
+  const flushOfflineFixes = () => {
+    const token = localStorage.getItem('token');
+    if (!token || !queuedFixCount()) return;
+    
+    flushQueuedFixes(serverUrlRef.current, `Bearer ${token}`)
+      .then(({ uploaded }) => console.log(`📦 Uploaded ${uploaded} offline fixes`))
+      .catch((error) => console.warn('⚠️ Offline fixes kept for later:', error.message))
+      .finally(() => {
+        if (isMountedRef.current) setQueuedFixes(queuedFixCount());
+      });
+  };
+
+  const initializeWebSocket = (socketUrl = API_URL) => {
     const token = localStorage.getItem('token');
     const savedUser = localStorage.getItem('user');
     
@@ -144,7 +159,8 @@ const Dashboard = () => {
       socketRef.current.disconnect();
     }
     
-    socketRef.current = io(API_URL, {
+    serverUrlRef.current = socketUrl;
+    socketRef.current = io(socketUrl, {
       transports: ['websocket', 'polling'],
       reconnection: true,
       reconnectionAttempts: 5,
@@ -158,6 +174,7 @@ const Dashboard = () => {
       setConnectionStatus('connected');
       
       socketRef.current.emit('join_room', { user_email: userData.email });
+      flushOfflineFixes();
     });
     
     socketRef.current.on('location_update', (data) => {
@@ -202,6 +219,16 @@ const Dashboard = () => {
       console.log('✅ Room joined:', data);
     });
     
+    socketRef.current.on('worker_redirect', (data) => {
+      // Another backend worker owns this user's tracking state
+      if (data.worker && data.worker !== socketUrl) {
+        console.log('🔀 Switching to worker:', data.worker);
+        // A redirected fix was not stored: queue it for upload once connected to the owner
+        if (data.fix) setQueuedFixes(enqueueFix(data.fix));
+        initializeWebSocket(data.worker);
+      }
+    });
+    
     socketRef.current.on('ml_status_update', (data) => {
       console.log('🤖 ML Status Update:', data);
       setMlStatus(prev => ({ ...prev, ...data }));
@@ -307,20 +334,24 @@ const Dashboard = () => {
         const { latitude, longitude, accuracy } = position.coords;
         console.log(`📌 GPS: ${latitude.toFixed(6)}, ${longitude.toFixed(6)} | Accuracy: ${accuracy.toFixed(1)}m`);
         
-        if (socketRef.current && socketRef.current.connected) {
-          const locationData = {
-            device_id: deviceId,
-            latitude: latitude,
-            longitude: longitude,
-            accuracy: accuracy,
-            user_email: userData.email,
-            timestamp: new Date().toISOString()
-          };
-          
+        const locationData = {
+          device_id: deviceId,
+          latitude: latitude,
+          longitude: longitude,
+          accuracy: accuracy,
+          user_email: userData.email,
+          timestamp: new Date(position.timestamp).toISOString()
+        };
+        const connected = socketRef.current && socketRef.current.connected;
+        
+        if (connected && !queuedFixCount()) {
           console.log('📤 Sending location update');
           socketRef.current.emit('update_location', locationData);
         } else {
-          console.warn('⚠️ WebSocket not connected');
+          // Buffered fixes go first, so this one waits behind them
+          console.warn('⚠️ WebSocket not connected, buffering location');
+          setQueuedFixes(enqueueFix(locationData));
+          if (connected) flushOfflineFixes();
         }
       },
       (error) => {
@@ -488,6 +519,7 @@ const Dashboard = () => {
     localStorage.removeItem('device_id');
     localStorage.removeItem('location_permission');
     localStorage.removeItem('location_watch_id');
+    clearQueuedFixes();
     
     const watchId = localStorage.getItem('location_watch_id');
     if (watchId) {
@@ -685,6 +717,9 @@ const Dashboard = () => {
               Tracking {locations.length} device{locations.length !== 1 ? 's' : ''}
             </span>
             {university && <span style={{ color: '#2ecc71' }}>🏛️ University Active</span>}
+            {queuedFixes > 0 && (
+              <span style={{ color: '#f39c12' }}>📦 {queuedFixes} fix{queuedFixes !== 1 ? 'es' : ''} queued</span>
+            )}
           </div>
         </div>
         <div style={{ display: 'flex', gap: '10px', alignItems: 'center' }}>
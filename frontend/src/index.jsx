@@ -3,6 +3,7 @@ import ReactDOM from 'react-dom/client';
 import { BrowserRouter } from 'react-router-dom';
 import './index.css';
 import App from './App';
+import './workerRedirect';
 
 const root = ReactDOM.createRoot(document.getElementById('root'));
 root.render(
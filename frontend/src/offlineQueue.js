@@ -0,0 +1,91 @@
+import axios from 'axios';
+
+// Fixes captured while the WebSocket is down, uploaded in order once it is back
+const QUEUE_KEY = 'offline_fixes';
+const MAX_QUEUED_FIXES = 2000;
+const BATCH_SIZE = 500;
+
+let flushing = null;
+
+const readQueue = () => {
+  try {
+    return JSON.parse(localStorage.getItem(QUEUE_KEY)) || [];
+  } catch (e) {
+    return [];
+  }
+};
+
+const writeQueue = (fixes) => {
+  if (fixes.length) {
+    localStorage.setItem(QUEUE_KEY, JSON.stringify(fixes));
+  } else {
+    localStorage.removeItem(QUEUE_KEY);
+  }
+};
+
+// Fixes are removed by id once uploaded, not by position
+const fixKey = (fix) => fix.queue_id || fix.timestamp;
+
+export const queuedFixCount = () => readQueue().length;
+
+export const enqueueFix = (fix) => {
+  // Oldest fixes are dropped first when the buffer is full
+  const fixes = readQueue();
+  fixes.push({ ...fix, queue_id: `${Date.now()}-${Math.random().toString(36).slice(2, 10)}` });
+  writeQueue(fixes.slice(-MAX_QUEUED_FIXES));
+  return Math.min(fixes.length, MAX_QUEUED_FIXES);
+};
+
+export const clearQueuedFixes = () => localStorage.removeItem(QUEUE_KEY);
+
+const encodeBatch = async (fixes) => {
+  const json = JSON.stringify({ fixes });
+  if (typeof CompressionStream === 'undefined') {
+    return { body: json, headers: {} };
+  }
+  const stream = new Blob([json]).stream().pipeThrough(new CompressionStream('gzip'));
+  return {
+    body: await new Response(stream).arrayBuffer(),
+    headers: { 'Content-Encoding': 'gzip' }
+  };
+};
+
+const uploadQueue = async (baseUrl, token) => {
+  let url = baseUrl;
+  let uploaded = 0;
+  for (;;) {
+    const batch = readQueue().slice(0, BATCH_SIZE);
+    if (!batch.length) return { uploaded, url };
+    const { body, headers } = await encodeBatch(batch);
+    try {
+      await axios.post(`${url}/api/locations/bulk`, body, {
+        headers: { ...headers, Authorization: token, 'Content-Type': 'application/json' }
+      });
+    } catch (error) {
+      const response = error.response;
+      if (response && response.status === 409 && response.data.worker && response.data.worker !== url) {
+        // Another backend worker owns this user's tracking state
+        url = response.data.worker;
+        continue;
+      }
+      if (!response || response.status === 401 || response.status >= 500) {
+        // Offline again, signed out or server trouble: keep the fixes for the next attempt
+        throw error;
+      }
+      console.error('❌ Dropping rejected offline fixes:', response.data);
+    }
+    // Fixes queued (or trimmed) during the upload are left as they are
+    const sent = new Set(batch.map(fixKey));
+    writeQueue(readQueue().filter((fix) => !sent.has(fixKey(fix))));
+    uploaded += batch.length;
+  }
+};
+
+export const flushQueuedFixes = (baseUrl, token) => {
+  if (!flushing) {
+    flushing = uploadQueue(baseUrl, token).finally(() => {
+      flushing = null;
+    });
+  }
+  return flushing;
+};
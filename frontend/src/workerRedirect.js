@@ -0,0 +1,20 @@
+import axios from 'axios';
+
+// Writes to a user's state are only accepted by the backend worker that owns the user;
+// other workers answer 409 with the owner's URL, and the request is sent there once
+axios.interceptors.response.use(undefined, (error) => {
+  const { config, response } = error;
+  const worker = response && response.status === 409 && response.data && response.data.worker;
+  if (!worker || !config || config.workerRedirected) {
+    return Promise.reject(error);
+  }
+  const target = new URL(config.url, window.location.href);
+  if (target.origin === new URL(worker).origin) {
+    return Promise.reject(error);
+  }
+  return axios.request({
+    ...config,
+    url: `${worker}${target.pathname}${target.search}`,
+    workerRedirected: true
+  });
+});